@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+"""Times decompressing generated QRs, to check the speed of changes to the decompressor.
+
+Generates objective and subjective QRs for a number of matches with generate_test_qrs, then
+decompresses all of them several times and logs the best time. With --processes, the QRs are
+decompressed in that many worker processes however few there are, so the times can be compared to
+decompressing in this process to choose Decompressor.MIN_PARALLEL_QRS.
+
+Usage: python src/benchmark_decompressor.py --matches 80 --repeat 5 --processes 4
+"""
+
+import argparse
+import logging
+import random
+import timeit
+from unittest import mock
+
+import console  # Sets up logging
+import generate_test_qrs
+from calculations import decompressor
+
+log = logging.getLogger(__name__)
+
+
+def generate_qrs(num_matches: int) -> list:
+    """Returns raw_qr documents for every robot and alliance in `num_matches` matches"""
+    qrs = []
+    for match_number in range(1, num_matches + 1):
+        for alliance_color in ["red", "blue"]:
+            # generate_test_qrs only has skill levels for its own team list
+            teams = [random.choice(generate_test_qrs.TEAM_LIST) for _ in range(3)]
+            for team in teams:
+                qrs.append(
+                    generate_test_qrs.create_single_obj_qr(team, alliance_color, str(match_number))
+                )
+            qrs.append(
+                generate_test_qrs.create_single_subj_qr(teams, alliance_color, str(match_number))
+            )
+    return [
+        {"data": qr, "override": {}, "ulid": str(ulid), "blocklisted": False}
+        for ulid, qr in enumerate(qrs)
+    ]
+
+
+def benchmark(num_matches: int, repeat: int, processes: int = 1) -> float:
+    """Returns the best time in seconds to decompress the QRs of `num_matches` matches in
+    `processes` worker processes, or in this process if it's 1"""
+    qrs = generate_qrs(num_matches)
+    # Decompressing doesn't use the server
+    decompressor_ = decompressor.Decompressor(mock.MagicMock())
+    decompressor_.MIN_PARALLEL_QRS = 0
+    try:
+        # The workers are only started once, so starting them isn't timed
+        decompressor_.decompress_qrs(qrs, processes)
+        best_time = min(
+            timeit.repeat(
+                lambda: decompressor_.decompress_qrs(qrs, processes), number=1, repeat=repeat
+            )
+        )
+    finally:
+        decompressor_.worker_pool.close()
+    log.info(
+        f"Decompressed {len(qrs)} QRs with {processes} processes in {round(best_time, 4)} sec "
+        f"({round(best_time / len(qrs) * 1e6, 1)} µs per QR)"
+    )
+    return best_time
+
+
+def parser():
+    parse = argparse.ArgumentParser()
+    parse.add_argument("--matches", help="Matches to generate QRs for", type=int, default=80)
+    parse.add_argument("--repeat", help="Times to decompress the QRs", type=int, default=5)
+    parse.add_argument(
+        "--processes", help="Worker processes, 1 decompresses in this process", type=int, default=1
+    )
+    return parse.parse_args()
+
+
+if __name__ == "__main__":
+    args = parser()
+    benchmark(args.matches, args.repeat, args.processes)
@@ -27,6 +27,9 @@ class AutoPathCalc(BaseCalculations):
     def __init__(self, server):
         super().__init__(server)
         self.watched_collections = ["auto_pim"]
+        self.extra_read_collections = ["auto_paths"]
+        # Path numbers are written back to auto_pim
+        self.output_collections = ["auto_paths", "auto_pim"]
 
     def group_auto_paths(self, pim: dict, calculated_paths: List[dict]) -> dict:
         """
@@ -157,7 +160,7 @@ class AutoPathCalc(BaseCalculations):
         empty_pims = []
 
         # Check if changes need to be made to teams
-        if entries := self.entries_since_last():
+        if entries := self.peek_entries_since_last(["team_number", "match_number"]):
             for entry in entries:
                 if "team_number" not in entry["o"].keys():
                     continue
@@ -181,24 +184,17 @@ class AutoPathCalc(BaseCalculations):
             if pim not in unique_empty_pims:
                 unique_empty_pims.append(pim)
 
-        # Delete and re-insert if updating all data
-        if self.calc_all_data:
-            self.server.db.delete_data("auto_paths")
-
-        # Calculate data
-        updates = self.calculate_auto_paths(unique_empty_pims)
-
-        # Upload data to MongoDB
-        for update in updates:
-            if update != {}:
-                self.server.db.update_document(
-                    "auto_paths",
-                    update,
-                    {
-                        "team_number": update["team_number"],
-                        "path_number": update["path_number"],
-                    },
-                )
+        # Replace the old data at once if updating all data
+        with self.replace_outputs("auto_paths"):
+            # Calculate data
+            updates = self.calculate_auto_paths(unique_empty_pims)
+
+            # Upload data to MongoDB
+            self.server.db.bulk_upsert(
+                "auto_paths",
+                [update for update in updates if update != {}],
+                ["team_number", "path_number"],
+            )
         end_time = time.time()
         # Get total calc time
         total_time = end_time - start_time
@@ -2,7 +2,7 @@
 # Copyright (c) 2024 FRC Team 1678: Citrus Circuits
 """Holds functions used to determine auto scoring and paths in each match"""
 
-from typing import List, Dict, Union, Any, Tuple
+from typing import List, Dict, Optional, Union, Any, Tuple
 from calculations.base_calculations import BaseCalculations
 import logging
 import statistics
@@ -21,12 +21,22 @@ class AutoPIMCalc(BaseCalculations):
     def __init__(self, server):
         super().__init__(server)
         self.watched_collections = ["unconsolidated_obj_tim", "sim_precision"]
+        # obj_tim and any other collections that auto fields are pulled from
+        self.extra_read_collections = ["obj_tim"] + [
+            field.split(".")[0] for field in self.schema["tim_fields"]
+        ]
+        self.output_collections = ["auto_pim"]
 
     def get_unconsolidated_auto_timelines(
-        self, unconsolidated_obj_tims: List[Dict[str, List[dict]]]
+        self,
+        unconsolidated_obj_tims: List[Dict[str, List[dict]]],
+        sim_precisions: Optional[List[dict]] = None,
     ) -> Tuple[List[List[dict]], Union[int, None]]:
         """Given unconsolidated_obj_tims, returns unconsolidated auto timelines
-        and the index of the best scout's timeline"""
+        and the index of the best scout's timeline
+
+        sim_precisions are the sim_precision documents for the TIM, they are found in the database
+        if not given"""
 
         unconsolidated_auto_timelines = []
         best_sim_precision, best_scout_index = None, 0
@@ -37,13 +47,18 @@ class AutoPIMCalc(BaseCalculations):
                 for key in ["team_number", "match_number", "scout_name"]
             }
             unconsolidated_auto_timelines.append(
-                [
-                    action
-                    for action in unconsolidated_tim["timeline"]
-                    if action["in_teleop"] == False
-                ]
+                self.get_timeline_index(unconsolidated_tim).filter(in_teleop=False)
             )
-            sim_precision: List[Dict[str, float]] = self.server.db.find("sim_precision", sim)
+            if sim_precisions is None:
+                sim_precision: List[Dict[str, float]] = self.server.db.find(
+                    "sim_precision", sim, ["sim_precision"]
+                )
+            else:
+                sim_precision = [
+                    document
+                    for document in sim_precisions
+                    if all(document.get(key) == value for key, value in sim.items())
+                ]
             if len(sim_precision) == 0:
                 continue
             elif "sim_precision" not in sim_precision[0]:
@@ -82,8 +97,13 @@ class AutoPIMCalc(BaseCalculations):
 
         return consolidated_timeline
 
-    def get_consolidated_tim_fields(self, calculated_tim: dict) -> dict:
-        "Given a calculated_tim, return tim fields directly from other collections"
+    def get_consolidated_tim_fields(
+        self, calculated_tim: dict, tim_data: Optional[Dict[str, List[dict]]] = None
+    ) -> dict:
+        """Given a calculated_tim, return tim fields directly from other collections
+
+        tim_data maps collection names to the documents for the TIM in that collection, collections
+        that aren't in it are found in the database"""
         # Auto variables we collect
         tim_fields = self.schema["tim_fields"]
 
@@ -94,13 +114,17 @@ class AutoPIMCalc(BaseCalculations):
                 tim_auto_values[datapoint] = calculated_tim[datapoint]
             else:
                 # Get data from other collections, such as subj_team or tba_tim
-                data: List[dict] = self.server.db.find(
-                    collection,
-                    {
-                        "match_number": calculated_tim["match_number"],
-                        "team_number": calculated_tim["team_number"],
-                    },
-                )
+                if tim_data is not None and collection in tim_data:
+                    data: List[dict] = tim_data[collection]
+                else:
+                    data = self.server.db.find(
+                        collection,
+                        {
+                            "match_number": calculated_tim["match_number"],
+                            "team_number": calculated_tim["team_number"],
+                        },
+                        [datapoint],
+                    )
                 if data == []:
                     # Handle no data
                     tim_auto_values[datapoint] = None
@@ -122,6 +146,14 @@ class AutoPIMCalc(BaseCalculations):
             for i in range(info["max_count"]):
                 update[f"{field}_{i + 1}"] = "none"
 
+        # action_type to the fields that it applies to and its short-form name for each field, so
+        # each action is looked up once instead of checked against every field
+        action_fields = {}
+        for field, info in self.schema["--timeline_fields"].items():
+            for action_type in info["valid_actions"]:
+                action_fields.setdefault(action_type, []).append(
+                    (field, self.calculate_action(action_type, info["valid_actions"]))
+                )
         # For each action in the consolidated timeline, add it to one of the new fields (if it applies)
         for action in tim["auto_timeline"]:
             # BUG: action_type sometimes doesn't exist for a timeline action
@@ -132,16 +164,11 @@ class AutoPIMCalc(BaseCalculations):
             elif action["action_type"] is None:
                 log.warning("auto_pims: action_type is null")
                 continue
-            # Iterate through each timeline_field
-            for field, info in self.schema["--timeline_fields"].items():
-                # Check if the action is one of the valid actions for this field
-                if action["action_type"] in info["valid_actions"].keys():
-                    # Iterate to the next datapoint for that field
-                    counts[field] += 1
-                    # Calculate the value for the field
-                    update[f"{field}_{counts[field]}"] = self.calculate_action(
-                        action["action_type"], info["valid_actions"]
-                    )
+            # Iterate through each timeline_field that the action is one of the valid actions for
+            for field, value in action_fields.get(action["action_type"], []):
+                # Iterate to the next datapoint for that field
+                counts[field] += 1
+                update[f"{field}_{counts[field]}"] = value
         return update
 
     def calculate_action(self, action: str, action_dict):
@@ -172,16 +199,39 @@ class AutoPIMCalc(BaseCalculations):
                             unconsolidated_tims[num_1]["timeline"][num + 1][
                                 "action_type"
                             ] = new_value["name"]
+                            self.forget_timeline_index(tim)
         return unconsolidated_tims
 
     def calculate_auto_pims(self, tims: List[dict]) -> List[dict]:
         """Calculates auto data for the given tims, which looks like
         [{"team_number": 1678, "match_number": 42}, {"team_number": 1706, "match_number": 56}, ...]"""
         calculated_pims = []
-        for tim in tims:
-            # Get data for the tim from MongoDB
-            unconsolidated_obj_tims: List[dict] = self.server.db.find("unconsolidated_obj_tim", tim)
-            obj_tim: dict = self.server.db.find("obj_tim", tim)
+        # Get data for all of the tims from MongoDB at once instead of querying for each tim
+        keys = [(tim["team_number"], tim["match_number"]) for tim in tims]
+        group_by = ("team_number", "match_number")
+        # Datapoints used from each collection that auto fields are pulled from
+        tim_fields = {}
+        for field in self.schema["tim_fields"]:
+            collection, datapoint = field.split(".")
+            tim_fields.setdefault(collection, []).append(datapoint)
+        grouped_unconsolidated_obj_tims = self.server.db.find_grouped(
+            "unconsolidated_obj_tim", keys, group_by, projection=["timeline", "scout_name"]
+        )
+        grouped_obj_tims = self.server.db.find_grouped(
+            "obj_tim", keys, group_by, projection=tim_fields.get("obj_tim", [])
+        )
+        grouped_sim_precisions = self.server.db.find_grouped(
+            "sim_precision", keys, group_by, projection=["scout_name", "sim_precision"]
+        )
+        # Other collections that auto fields are pulled from, such as tba_tim
+        grouped_tim_data = {
+            collection: self.server.db.find_grouped(collection, keys, group_by, projection=fields)
+            for collection, fields in tim_fields.items()
+            if collection != "obj_tim"
+        }
+        for tim, key in zip(tims, keys):
+            unconsolidated_obj_tims: List[dict] = grouped_unconsolidated_obj_tims[key]
+            obj_tim: dict = grouped_obj_tims[key]
             if len(obj_tim) > 0:
                 obj_tim = obj_tim[0]
             else:
@@ -190,16 +240,21 @@ class AutoPIMCalc(BaseCalculations):
                 )
 
             # Run calculations on the team in match
-            tim.update(self.get_consolidated_tim_fields(obj_tim))
+            tim_data = {
+                collection: grouped[key] for collection, grouped in grouped_tim_data.items()
+            }
+            tim.update(self.get_consolidated_tim_fields(obj_tim, tim_data))
             tim.update(
                 {
                     "auto_timeline": self.consolidate_timelines(
                         *self.get_unconsolidated_auto_timelines(
-                            self.score_fail_type(unconsolidated_obj_tims)
+                            self.score_fail_type(unconsolidated_obj_tims),
+                            grouped_sim_precisions[key],
                         )
                     )
                 }
             )
+            self.clear_timeline_indexes()
             tim.update(self.create_auto_fields(tim))
             # Data that is later updated by auto_paths
             tim.update({"match_numbers_played": [], "num_matches_ran": 0, "path_number": 0})
@@ -215,7 +270,7 @@ class AutoPIMCalc(BaseCalculations):
         tims = []
 
         # Check if changes need to be made to teams
-        if entries := self.entries_since_last():
+        if entries := self.peek_entries_since_last():
             for entry in entries:
                 # Check that the entry is an unconsolidated_obj_tim
                 if "timeline" not in entry["o"].keys() or "team_number" not in entry["o"].keys():
@@ -240,24 +295,17 @@ class AutoPIMCalc(BaseCalculations):
         for tim in tims:
             if tim not in unique_tims:
                 unique_tims.append(tim)
-        # Delete and re-insert if updating all data
-        if self.calc_all_data:
-            self.server.db.delete_data("auto_pim")
-
-        # Calculate data
-        updates = self.calculate_auto_pims(unique_tims)
+        # Replace the old data at once if updating all data
+        with self.replace_outputs("auto_pim"):
+            # Calculate data
+            updates = self.calculate_auto_pims(unique_tims)
 
-        # Upload data to MongoDB
-        for update in updates:
-            if update != {}:
-                self.server.db.update_document(
-                    "auto_pim",
-                    update,
-                    {
-                        "team_number": update["team_number"],
-                        "match_number": update["match_number"],
-                    },
-                )
+            # Upload data to MongoDB
+            self.server.db.bulk_upsert(
+                "auto_pim",
+                [update for update in updates if update != {}],
+                ["team_number", "match_number"],
+            )
         end_time = time.time()
         # Get total calc time
         total_time = end_time - start_time
@@ -1,10 +1,14 @@
+import contextlib
+import itertools
 import json
+from typing import Iterable, Iterator, List, Optional
 
 import pymongo
 import statistics
 
 import server
 
+from calculations.timeline_index import TimelineIndex
 import utils
 import logging
 
@@ -14,56 +18,124 @@ log = logging.getLogger(__name__)
 class BaseCalculations:
     # Used for converting to a type that is given as a string
     STR_TYPES = {"str": str, "float": float, "int": int, "bool": bool}
+    # Number of documents read from MongoDB at a time when calculating all data
+    CALC_ALL_DATA_BATCH_SIZE = 1000
 
     def __init__(self, server: "server.Server"):
         self.server = server
         self.oplog = self.server.oplog
         self.calc_all_data = self.server.calc_all_data
-        self.update_timestamp()
+        # Use the snapshot taken by the server instead of querying the oplog for every calculation
+        self.timestamp = self.server.oplog_timestamp
         self.watched_collections = NotImplemented  # Calculations should override this attribute
-        self.teams_list = self.get_teams_list()
+        # Collections the calculation writes to, used by the server to schedule calculations
+        self.output_collections = NotImplemented  # Calculations should override this attribute
+        # Collections the calculation reads from that are not in `watched_collections`
+        self.extra_read_collections = []
+        self.teams_list = self.server.teams_list
+        # id of a TIM timeline to its TimelineIndex, see get_timeline_index()
+        self.timeline_indexes = {}
 
     def update_timestamp(self):
         """Updates the timestamp to the most recent oplog entry timestamp"""
-        last_op = self.oplog.find({}).sort("ts", pymongo.DESCENDING).limit(1)
-        self.timestamp = last_op.next()["ts"]
+        self.timestamp = self.get_latest_timestamp(self.oplog)
 
-    def entries_since_last(self):
+    @staticmethod
+    def get_latest_timestamp(oplog):
+        """Returns the timestamp of the most recent entry in `oplog`"""
+        last_op = oplog.find({}).sort("ts", pymongo.DESCENDING).limit(1)
+        return last_op.next()["ts"]
+
+    def entries_since_last(self, fields: Optional[List[str]] = None) -> Iterable[dict]:
         """Find changes in watched collections since the last update_timestamp()
 
         This checks the oplog for insert ('i'), delete ('d'), or update ('u') operations that have
-        been performed on the watched collections and returns a PyMongo cursor object
-        with the query results.
+        been performed on the watched collections and returns a list of the oplog entries. The
+        oplog is read through the server's shared oplog reader, so calculations don't each scan it.
+        When calculating all data, the documents are streamed from the database instead, with only
+        'fields' read if it is given. The streamed entries are always truthy, so use
+        peek_entries_since_last() to check if there are any.
         """
-        # If we want to use all data, read from the database but format it like an oplog entry
-        # Because the calc files expect the return value to be an oplog entry
         if self.calc_all_data:
-            data = []
-            for c in self.watched_collections:
-                for document in self.server.db.find(c):
-                    data.append({"o": document, "op": None})
-            return data
-        return list(
-            self.oplog.find(
-                {
-                    "ts": {"$gt": self.timestamp},
-                    "op": {"$in": ["i", "d", "u"]},
-                    "ns": {"$in": [f"{self.server.db.name}.{c}" for c in self.watched_collections]},
-                }
-            )
+            return self.all_data_entries(fields)
+        return self.server.oplog_reader.entries_since(
+            self.timestamp, [f"{self.server.db.name}.{c}" for c in self.watched_collections]
         )
 
+    def peek_entries_since_last(
+        self, fields: Optional[List[str]] = None
+    ) -> Optional[Iterator[dict]]:
+        """Returns the entries from entries_since_last(), or None if there aren't any
+
+        Only the first entry is read to check, so streamed entries aren't all read at once.
+        """
+        entries = iter(self.entries_since_last(fields))
+        first = next(entries, None)
+        if first is None:
+            return None
+        return itertools.chain([first], entries)
+
+    def all_data_entries(self, fields: Optional[List[str]] = None) -> Iterator[dict]:
+        """Yields every document in watched_collections, formatted like an oplog entry
+
+        The calc files expect oplog entries. Documents are read in batches, so the watched
+        collections are never all in memory at once.
+        """
+        for c in self.watched_collections:
+            for document in self.server.db.find_iter(
+                c, projection=fields, batch_size=self.CALC_ALL_DATA_BATCH_SIZE
+            ):
+                yield {"o": document, "op": None}
+
+    def get_timeline_index(self, tim: dict) -> TimelineIndex:
+        """Returns the TimelineIndex for the timeline of 'tim', which is only built once per TIM
+
+        Timeline actions that are changed after the timeline is indexed must be followed by
+        forget_timeline_index(), and indexes should be cleared with clear_timeline_indexes() once
+        the TIMs are calculated.
+        """
+        timeline = tim["timeline"]
+        index = self.timeline_indexes.get(id(timeline))
+        # The index keeps a reference to its timeline, so the id can't be reused by another list
+        if index is None or index.timeline is not timeline or index.size != len(timeline):
+            index = self.timeline_indexes[id(timeline)] = TimelineIndex(timeline)
+        return index
+
+    def forget_timeline_index(self, tim: dict) -> None:
+        """Removes the TimelineIndex of 'tim' so it is built again the next time it's needed"""
+        self.timeline_indexes.pop(id(tim["timeline"]), None)
+
+    def clear_timeline_indexes(self) -> None:
+        """Removes every TimelineIndex, so the timelines they index can be freed"""
+        self.timeline_indexes.clear()
+
+    @contextlib.contextmanager
+    def replace_outputs(self, *collections: str):
+        """Replaces 'collections' with the documents written inside the with block if calculating
+        all data, otherwise writes go to 'collections' as usual
+
+        This is used instead of deleting the old data before calculating all data, so the
+        collections are never empty while the calculation runs.
+        """
+        with contextlib.ExitStack() as stack:
+            if self.calc_all_data:
+                for collection in collections:
+                    stack.enter_context(self.server.db.replace_collection(collection))
+            yield
+
     def get_updated_teams(self) -> list:
         """Returns a list of team numbers that appear in watched_collections"""
         teams = set()
-        for entry in self.entries_since_last():
+        for entry in self.entries_since_last(["team_number"]):
             # Prevents error from not having a team num
             if "team_number" in entry["o"].keys():
                 teams.add(entry["o"]["team_number"])
             # If the doc was updated, need to manually find the document
             elif entry["op"] == "u":
                 document_id = entry["o2"]["_id"]
-                query = self.server.db.find(entry["ns"].split(".")[-1], {"_id": document_id})
+                query = self.server.db.find(
+                    entry["ns"].split(".")[-1], {"_id": document_id}, ["team_number"]
+                )
                 if query and "team_number" in query[0].keys():
                     teams.add(query[0]["team_number"])
         return list(teams)
@@ -2,16 +2,18 @@
 
 """Decompresses objective and subjective match collection QR codes."""
 
-import enum
+import hashlib
+import json
+import math
 import os
-import re
+from typing import List, Optional
 
 import yaml
 import time
 import utils
 from calculations import base_calculations
-from calculations import qr_state
-from calculations.qr_state import QRState
+from calculations.qr_decoder import QRDecoder, QRResult, QRType, decompress_qr_batch
+from calculations.qr_worker import QRWorkerPool
 import logging
 from data_transfer import database
 
@@ -20,273 +22,116 @@ server_log = logging.FileHandler("server.log")
 log.addHandler(server_log)
 
 
-class QRType(enum.Enum):
-    """Enum that stores QR types."""
+class Decompressor(QRDecoder, base_calculations.BaseCalculations):
+    """Decompresses new raw_qr documents into unconsolidated_obj_tim and subj_tim documents
 
-    OBJECTIVE = 0
-    SUBJECTIVE = 1
+    The decoding itself is in QRDecoder, which can run in worker processes.
+    """
 
-
-class Decompressor(base_calculations.BaseCalculations):
-
-    # Load latest match collection compression QR code schema
-    SCHEMA = qr_state.SCHEMA
-    OBJ_TIM_SCHEMA = utils.read_schema("schema/calc_obj_tim_schema.yml")
     OBJ_PIT_SCHEMA = utils.read_schema("schema/obj_pit_collection_schema.yml")
     SUBJ_PIT_SCHEMA = utils.read_schema("schema/subj_pit_collection_schema.yml")
-    _GENERIC_DATA_FIELDS = QRState._get_data_fields("generic_data")
-    OBJECTIVE_QR_FIELDS = _GENERIC_DATA_FIELDS.union(QRState._get_data_fields("objective_tim"))
-    SUBJECTIVE_QR_FIELDS = _GENERIC_DATA_FIELDS.union(QRState._get_data_fields("subjective_aim"))
-    TIMELINE_FIELDS = QRState.get_timeline_info()
+
+    # Fewest QRs decompressed in worker processes, smaller batches are faster in this process.
+    # From benchmark_decompressor.py, a QR takes about 55 µs to decompress, and sending it to a
+    # worker and reading its results takes about 13 µs in this process plus 0.5 ms for each batch,
+    # so with a few workers, batches of more than about 20 QRs are faster. Daemon mode batches of a
+    # match or two stay in this process.
+    MIN_PARALLEL_QRS = 100
 
     MISSING_TIM_IGNORE_FILE_PATH = utils.create_file_path("data/missing_tim_ignore.yml")
 
     def __init__(self, server):
         super().__init__(server)
         self.watched_collections = ["raw_qr"]
-
-    def convert_data_type(self, value, type_, name=None):
-        """Convert from QR string representation to database data type."""
-        # Enums are stored as int in the database
-        if type_ == "int":
-            return int(value)
-        if type_ == "float":
-            return float(value)
-        if type_ == "bool":
-            return utils.get_bool(value)
-        if type_ == "str":
-            return value  # Value is already a str
-        if "Enum" in type_:
-            return self.get_decompressed_name(value, name)
-        raise ValueError(f"Type {type_} not recognized")
-
-    def get_decompressed_name(self, compressed_name, section):
-        """Returns decompressed variable name from schema.
-
-        compressed_name: str - Compressed variable name within QR code
-        section: str - Section of schema that name comes from.
+        self.output_collections = ["unconsolidated_obj_tim", "subj_tim"]
+        # Started the first time a batch is large enough, and kept for the server's lifetime
+        self.worker_pool = QRWorkerPool()
+
+    def decompress_qr_results(
+        self, split_qrs: List[dict], processes: Optional[int] = None
+    ) -> List[QRResult]:
+        """Decompresses a list of QRs, returning the result of each QR in the same order.
+
+        Large batches (see MIN_PARALLEL_QRS), such as when calculating all data, are split between
+        `processes` worker processes, one for each CPU by default. The workers are started the first
+        time and then reused.
         """
-        for key, value in self.SCHEMA[section].items():
-            if isinstance(value, list):
-                if value[0] == compressed_name:
-                    return key
-            else:
-                if value == compressed_name:
-                    return key
-        raise ValueError(f"Retrieving Variable Name {compressed_name} from {section} failed.")
+        processes = processes or os.cpu_count() or 1
+        if processes == 1 or len(split_qrs) < self.MIN_PARALLEL_QRS:
+            return decompress_qr_batch(split_qrs)
+        # Contiguous shards, so results can be joined back together in order
+        shard_size = math.ceil(len(split_qrs) / processes)
+        shards = [split_qrs[i : i + shard_size] for i in range(0, len(split_qrs), shard_size)]
+        return [
+            result for shard in self.worker_pool.decompress_qr_batches(shards) for result in shard
+        ]
 
-    def get_decompressed_type(self, name, section):
-        """Returns server-side data type from schema.
+    @classmethod
+    def get_cache_key(cls, qr: dict) -> str:
+        """Returns the key of a raw_qr document's result in the decode cache
 
-        name: str - Decompressed variable name within Schema
-        section: str - Section of schema that name comes from.
+        The key is a hash of the ULID, data, overrides and schema version, so it changes whenever
+        the decompressed documents would.
         """
-        # Type all items after the first item
-        type_ = self.SCHEMA[section][name][1:]
-        # Detect special case of data type being a list
-        if len(type_) > 1:
-            return type_  # Returns list of the type (list) and the type of data stored in the list
-        return type_[0]  # Return the type of the value
-
-    def decompress_data(self, data, section):
-        """Decompress (split) data given the section of the QR it came from.
-
-        This matches compressed data names to actual variable names. It treats embedded dictionaries as
-        special cases, a parsing function needs to be written for each (e.g. timeline).
+        key_data = [qr["ulid"], qr["data"], qr["override"], cls.SCHEMA["schema_file"]["version"]]
+        return hashlib.sha256(
+            json.dumps(key_data, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def decompress_qr_results_cached(
+        self, split_qrs: List[dict], processes: Optional[int] = None
+    ) -> List[QRResult]:
+        """Same as decompress_qr_results, but only decompresses QRs that aren't in the decode cache
+
+        Cached results are replaced when a QR's key changes, and when calculating all data, results
+        that weren't used, such as from deleted QRs, are removed from the cache.
         """
-        decompressed_data = {}
-        # Iterate through data
-        for data_field in data:
-            compressed_name = data_field[0]  # Compressed name is always first character
-            value = data_field[1:]  # Actual data value is everything after the first character
-            # Get uncompressed name and the target data type
-            uncompressed_name = self.get_decompressed_name(compressed_name, section)
-            uncompressed_type = self.get_decompressed_type(uncompressed_name, section)
-            # Detect special cases in typing (e.g. value is list)
-            if isinstance(uncompressed_type, list):
-                # If second data type is dictionary, it should be handled separately
-                if "dict" in uncompressed_type:
-                    # Decompress timeline
-                    if uncompressed_name == "timeline":
-                        typed_value = self.decompress_timeline(value)
-                    # Value is not one of the currently known dictionaries
-                    else:
-                        raise NotImplementedError(
-                            f"Decompression of {uncompressed_name} as a dict not supported."
-                        )
-                # Decompress list of none-dicts
-                elif uncompressed_type[1] in ["int", "float", "bool", "str"]:
-                    if len(uncompressed_type) == 2:
-                        # Default case, use _list_data_separator to seperate value into list items
-                        split_values = value.split(self.SCHEMA["_list_data_separator"])
-                    else:
-                        # Use the specified length of each item to seperate
-                        split_values = [
-                            value[i : i + uncompressed_type[2]]
-                            for i in range(0, len(value), uncompressed_type[2])
-                        ]
-                    # Convert string to appropriate data type
-                    typed_value = [
-                        self.convert_data_type(split_value, uncompressed_type[1])
-                        for split_value in split_values
-                    ]
-            else:  # Normal data type
-                typed_value = self.convert_data_type(value, uncompressed_type, uncompressed_name)
-            decompressed_data[uncompressed_name] = typed_value
-        return decompressed_data
-
-    def decompress_generic_qr(self, data):
-        """Decompress generic section of QR or raise error if schema is outdated."""
-        # Split data by separator specified in schema
-        data = data.split(self.SCHEMA["generic_data"]["_separator"])
-        for entry in data:
-            if entry[0] == "A":
-                schema_version = int(entry[1:])
-                if schema_version != self.SCHEMA["schema_file"]["version"]:
-                    raise LookupError(
-                        f'QR Schema (v{schema_version}) does not match Server version (v{self.SCHEMA["schema_file"]["version"]})'
-                    )
-        return self.decompress_data(data, "generic_data")
-
-    def decompress_timeline(self, data):
-        """Decompress the timeline based on schema."""
-        decompressed_timeline = []  # Timeline is a list of dictionaries
-        # Return empty list if timeline is empty
-
-        if data == "":
-            return decompressed_timeline
-
-        timeline_length = sum([entry["length"] for entry in self.TIMELINE_FIELDS])
-
-        if len(data) % timeline_length != 0:
-            raise ValueError(f"Invalid timeline -- Timeline length invalid: {data}")
-
-        # Split into list of actions. Each action is a string of length timeline_length
-        timeline_actions = [
-            data[i : i + timeline_length] for i in range(0, len(data), timeline_length)
-        ]
-
-        # index of to_teleop action in timeline_actions
-        teleop_index = len(timeline_actions)
-
-        for action in timeline_actions:
-            decompressed_action = dict()
-            current_position = 0
-            # check if current action is to_teleop
-            if self.SCHEMA["action_type"]["to_teleop"] in action:
-                teleop_index = timeline_actions.index(action)
-            for entry in self.TIMELINE_FIELDS:
-                # Get untyped value by slicing action string from current position to next position
-                next_position = current_position + entry["length"]
-                untyped_value = action[current_position:next_position]
-                # Set action value to the converted data type
-                decompressed_action[entry["name"]] = self.convert_data_type(
-                    untyped_value, entry["type"], entry["name"]
-                )
-                current_position = next_position
-            # add and set in_teleop key to True or False depending on if it occurred before (False) or after (True) teleop_index
-            if timeline_actions.index(action) >= teleop_index:
-                decompressed_action["in_teleop"] = True
-            else:
-                decompressed_action["in_teleop"] = False
-            decompressed_timeline.append(decompressed_action)
-        return decompressed_timeline
-
-    def get_qr_type(self, first_char):
-        """Returns the qr type from QRType enum based on first character."""
-        if first_char == self.SCHEMA["objective_tim"]["_start_character"]:
-            return QRType.OBJECTIVE
-        if first_char == self.SCHEMA["subjective_aim"]["_start_character"]:
-            return QRType.SUBJECTIVE
-        raise ValueError(f"QR type unknown - Invalid first character for QR: {first_char}")
-
-    def decompress_single_qr(self, qr_data, qr_type, override):
-        """Decompress a full QR."""
-        # Split into generic data and objective/subjective data
-        qr_data = qr_data.split(self.SCHEMA["generic_data"]["_section_separator"])
-        # Generic QR is first section of QR
-        decompressed_data = []
-        # Decompress subjective QR
-        if qr_type == QRType.SUBJECTIVE:
-            teams_data = qr_data[1].split(self.SCHEMA["subjective_aim"]["_team_separator"])
-            """none_generic_data = qr_data[1].split(
-                self.SCHEMA["subjective_aim"]["_alliance_data_separator"]
-            )
-            if len(none_generic_data) != 2:
-                raise IndexError("Subjective QR missing whole-alliance data")
-            teams_data = none_generic_data[0].split(
-                self.SCHEMA["subjective_aim"]["_team_separator"]
+        keys = [self.get_cache_key(qr) for qr in split_qrs]
+        cached_results = self.server.db.get_qr_decode_cache(keys)
+        new_results = iter(
+            self.decompress_qr_results(
+                [qr for qr, key in zip(split_qrs, keys) if key not in cached_results], processes
             )
-            alliance_data = none_generic_data[1].split(
-                self.SCHEMA["subjective_aim"]["_alliance_data_separator"]
-            )
-            """
-
-            if len(teams_data) != 3:
-                raise IndexError("Incorrect number of teams in Subjective QR")
-            for team in teams_data:
-                # Regular expression that finds all occurences of an integer occuring after "B" and "C" and returns the matches as a list of strings
-                scores = re.findall(r"(?<=[BC])\d+", team)
-                invalid = False
-                for score in scores:
-                    if score not in ["1", "2", "3"]:
-                        invalid = True
-
-                if invalid:
-                    continue
-
-                decompressed_document = self.decompress_generic_qr(qr_data[0])
-                """
-                subjective_data = team.split(self.SCHEMA["subjective_aim"]["_separator"]) + (
-                    alliance_data if alliance_data != [""] else []
-                )
-                decompressed_data.append(decompressed_document)
-                """
-                subjective_data = team.split(self.SCHEMA["subjective_aim"]["_separator"])
-                decompressed_document.update(
-                    self.decompress_data(subjective_data, "subjective_aim")
-                )
-                if set(decompressed_document.keys()) != self.SUBJECTIVE_QR_FIELDS:
-                    raise ValueError("QR missing data fields", qr_type)
-                decompressed_data.append(decompressed_document)
-        elif qr_type == QRType.OBJECTIVE:  # Decompress objective QR
-            objective_data = qr_data[1].split(self.SCHEMA["objective_tim"]["_separator"])
-            decompressed_document = self.decompress_generic_qr(qr_data[0])
-            decompressed_document.update(self.decompress_data(objective_data, "objective_tim"))
-            decompressed_data.append(decompressed_document)
-            if set(decompressed_document.keys()) != self.OBJECTIVE_QR_FIELDS:
-                raise ValueError("QR missing data fields", qr_type)
-            decompressed_document.update({"override": override})
-        return decompressed_data
-
-    def decompress_qrs(self, split_qrs):
-        """Decompresses a list of QRs. Returns dict of decompressed QRs split by type."""
-        db = database.Database()
+        )
+        results = []
+        uncached_results = {}
+        for key in keys:
+            if key in cached_results:
+                results.append(cached_results[key])
+            else:
+                result = uncached_results[key] = next(new_results)
+                results.append(result)
+        log.info(
+            f"Restored {len(keys) - len(uncached_results)} of {len(keys)} QRs from the decode cache"
+        )
+        # Results are cached before they are inserted, which adds _ids to the documents
+        self.server.db.update_qr_decode_cache(uncached_results)
+        if self.calc_all_data:
+            self.server.db.prune_qr_decode_cache(keys)
+        return results
+
+    def decompress_qrs(self, split_qrs, processes: Optional[int] = None, use_cache: bool = False):
+        """Decompresses a list of QRs. Returns dict of decompressed QRs split by type.
+
+        QRs that can't be decompressed are skipped and logged together with their ULIDs. If
+        `use_cache` is True, QRs that haven't changed since they were last decompressed are
+        restored from the decode cache instead.
+        """
         output = {"unconsolidated_obj_tim": [], "subj_tim": []}
         log.info(f"Started decompression on qr batch")
-        for qr in split_qrs:
-            qr_type = utils.catch_function_errors(self.get_qr_type, qr["data"][0])
-            if qr_type is None:
-                continue
-            decompressed_qr = utils.catch_function_errors(
-                self.decompress_single_qr, qr["data"][1:], qr_type, qr["override"]
-            )
-            if decompressed_qr is None:
+        errors = []
+        if use_cache:
+            results = self.decompress_qr_results_cached(split_qrs, processes)
+        else:
+            results = self.decompress_qr_results(split_qrs, processes)
+        for result in results:
+            if result["error"] is not None:
+                errors.append(f'{result["ulid"]}: {result["error"]}')
                 continue
-            # Override non-timeline datapoints at decompression
-            for decompressed in decompressed_qr:
-                decompressed["ulid"] = qr["ulid"]
-                for override in qr["override"]:
-                    if override in decompressed and override not in list(
-                        self.OBJ_TIM_SCHEMA["timeline_counts"].keys()
-                    ):  # Checks that override is not a timeline datapoint
-                        decompressed[override] = qr["override"][override]
-                # If there were datapoints in override that weren't in decompressed data,
-                # add override to data for obj_tim calcs to handle
-            if qr_type == QRType.OBJECTIVE:
-                output["unconsolidated_obj_tim"].extend(decompressed_qr)
-            elif qr_type == QRType.SUBJECTIVE:
-                output["subj_tim"].extend(decompressed_qr)
+            output[result["collection"]].extend(result["documents"])
+        if errors:
+            error_list = "\n".join(errors)
+            log.error(f"Failed to decompress {len(errors)} of {len(split_qrs)} QRs:\n{error_list}")
         log.info(f"Finished decompression on qr batch")
         return output
 
@@ -304,11 +149,7 @@ class Decompressor(base_calculations.BaseCalculations):
         decompressed_data = {}
         db = database.Database()
         # Use team number to find if team already has pit data inserted into MongoDB
-        current_data = [
-            document
-            for document in db.find(pit_type)
-            if document["team_number"] == pit_data["team_number"]
-        ]
+        current_data = db.find(pit_type, {"team_number": pit_data["team_number"]})
 
         # Enter data into a dictionary
         for name, value in pit_data.items():
@@ -375,7 +216,9 @@ class Decompressor(base_calculations.BaseCalculations):
         else:
             items_to_ignore = []
         matches_to_ignore = [item["match_number"] for item in items_to_ignore if len(item) == 1]
-        tims = self.server.db.find("unconsolidated_obj_tim")
+        tims = self.server.db.find(
+            "unconsolidated_obj_tim", projection=["match_number", "scout_id"]
+        )
         matches = {}
         for tim in tims:
             match_number = tim["match_number"]
@@ -458,10 +301,13 @@ class Decompressor(base_calculations.BaseCalculations):
     def run(self):
         # Get calc start time
         start_time = time.time()
+        # Only new QRs are decompressed, updates such as digest migrations only have the changes
         new_qrs = [
-            entry["o"] for entry in self.entries_since_last() if not entry["o"]["blocklisted"]
+            entry["o"]
+            for entry in self.entries_since_last()
+            if entry["op"] in ("i", None) and not entry["o"]["blocklisted"]
         ]
-        decompressed_qrs = self.decompress_qrs(new_qrs)
+        decompressed_qrs = self.decompress_qrs(new_qrs, use_cache=True)
 
         # Checks if two subjective scouts scouted the same alliance in a match
         # If so, delete one of the qrs
@@ -477,12 +323,11 @@ class Decompressor(base_calculations.BaseCalculations):
                 filtered_qrs.append(qr)
         decompressed_qrs["subj_tim"] = filtered_qrs
 
-        for collection in ["unconsolidated_obj_tim", "subj_tim"]:
-            if self.calc_all_data:
-                # Prevent duplicates when calculating all data by deleting data before inserting
-                # Updating doesn't work because unconsolidated_obj_tim doesn't have unique keys
-                self.server.db.delete_data(collection)
-            self.server.db.insert_documents(collection, decompressed_qrs[collection])
+        # Prevent duplicates when calculating all data by replacing the old data
+        # Updating doesn't work because unconsolidated_obj_tim doesn't have unique keys
+        with self.replace_outputs("unconsolidated_obj_tim", "subj_tim"):
+            for collection in ["unconsolidated_obj_tim", "subj_tim"]:
+                self.server.db.insert_documents(collection, decompressed_qrs[collection])
         log.info("UPLOADED ALL RAW QRS TO LOCAL DB")
         end_time = time.time()
         # Get total calc time
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+"""Indexes the TBA matches of an event so calculations can look matches up instead of scanning them."""
+
+import collections
+from typing import Dict, List, Optional, Set, Tuple
+
+import utils
+
+
+class EventMatches:
+    """TBA matches keyed by (comp_level, match_number), with the teams in each match.
+
+    Built once per server cycle from the event's TBA matches and shared by every calculation (see
+    Server.get_event_matches), so looking up a match or its teams is a dictionary lookup.
+    """
+
+    def __init__(self, matches: Optional[List[dict]]):
+        self.matches = matches or []
+        # (comp_level, match_number) to the matches with that key, in TBA order. Playoff matches in
+        # different sets share match numbers, so there can be more than one.
+        self.matches_by_key: Dict[Tuple[str, int], List[dict]] = collections.defaultdict(list)
+        # (comp_level, match_number), or just match_number for every comp level, to the team
+        # numbers in those matches
+        self.teams: Dict[object, Set[str]] = collections.defaultdict(set)
+        for match in self.matches:
+            key = (match["comp_level"], match["match_number"])
+            self.matches_by_key[key].append(match)
+            teams = set(utils.get_teams_in_match(match, "red"))
+            teams.update(utils.get_teams_in_match(match, "blue"))
+            self.teams[key].update(teams)
+            self.teams[match["match_number"]].update(teams)
+
+    def get_match(self, match_number: int, comp_level: str = "qm") -> Optional[dict]:
+        """Returns the first match with 'comp_level' and 'match_number', or None if there isn't one"""
+        matches = self.matches_by_key.get((comp_level, match_number))
+        return matches[0] if matches else None
+
+    def get_teams(self, match_number: int, comp_level: Optional[str] = None) -> Set[str]:
+        """Returns the team numbers in the matches with 'match_number'
+
+        If 'comp_level' is None, teams from matches with that number in every comp level are
+        included.
+        """
+        key = match_number if comp_level is None else (comp_level, match_number)
+        return self.teams.get(key, set())
+
+    def get_latest_match_number(self, comp_level: str = "qm") -> int:
+        """Returns the highest match number in 'comp_level' that has a score breakdown, or 0"""
+        return max(
+            [
+                match_number
+                for (level, match_number), matches in self.matches_by_key.items()
+                if level == comp_level
+                and any(match["score_breakdown"] is not None for match in matches)
+            ]
+            + [0]
+        )
@@ -2,7 +2,7 @@
 """Calculate objective team data from Team in Match (TIM) data."""
 
 import utils
-from typing import List, Dict
+from typing import Any, Callable, List, Dict, Tuple
 from calculations import base_calculations
 import statistics
 import time
@@ -12,6 +12,143 @@ log = logging.getLogger(__name__)
 server_log = logging.FileHandler("server.log")
 log.addHandler(server_log)
 
+# A compiled filter is a description of the filter, for printing the plan, and a function that
+# returns if a TIM meets the filter
+TIMFilter = Tuple[str, Callable[[Dict], bool]]
+
+
+def compile_filter(field: str, value: Any, kind: str) -> TIMFilter:
+    """Compiles one filter from calc_obj_team_schema into a function that checks a TIM
+
+    kind is "equals" for TIMs where field is value, "not" for TIMs where field is missing or not
+    value, or "equals_or_missing" for TIMs where field is missing or value.
+    """
+    if kind == "equals":
+        return f"{field} == {value!r}", lambda tim: tim[field] == value
+    if kind == "not":
+        return f"{field} != {value!r}", lambda tim: tim.get(field, value) != value
+    return f"{field} in (missing, {value!r})", lambda tim: tim.get(field, value) == value
+
+
+def compile_count_filters(tim_fields) -> Tuple[List[TIMFilter], int]:
+    """Compiles the tim_fields of a count into filters, where the count is the sum of the number of
+    TIMs that meet each filter, multiplied by the returned number of times the filters are counted
+
+    tim_fields is either a list of {datapoint: value} dicts, or a dict of datapoints to values,
+    where "not" is a dict or list of dicts of datapoints the TIMs shouldn't have the values of.
+    """
+    if isinstance(tim_fields, list):
+        filters = [
+            compile_filter(key.split(".")[1], value, "equals")
+            for field in tim_fields
+            for key, value in field.items()
+        ]
+        return filters, 1
+    filters = []
+    for key, value in tim_fields.items():
+        if key != "not":
+            filters.append(compile_filter(key, value, "equals"))
+        # Datapoints in a list of dicts still have the obj_tim or subj_tim in front of them
+        elif isinstance(value, list):
+            for val in value:
+                for not_field, not_value in val.items():
+                    filters.append(compile_filter(not_field.split(".")[1], not_value, "not"))
+        else:
+            for not_field, not_value in value.items():
+                filters.append(compile_filter(not_field, not_value, "not"))
+    # Every filter in a dict is counted once for each of its keys
+    return filters, len(tim_fields)
+
+
+def compile_weight(value) -> Tuple[str, Callable[[Dict], Any]]:
+    """Compiles the weight of a sum term, which is a number, the name of a team datapoint, or a
+    list of both that are multiplied together"""
+    if isinstance(value, list):
+        factors = [compile_weight(v) for v in value]
+
+        def weight(team_data):
+            product = 1
+            for _, factor in factors:
+                product *= factor(team_data)
+            return product
+
+        return " * ".join(description for description, _ in factors), weight
+    if isinstance(value, str):
+        return value, lambda team_data: team_data[value]
+    return repr(value), lambda team_data: value
+
+
+def compile_plan(schema: Dict) -> Dict[str, Dict[str, Dict]]:
+    """Compiles the sections of calc_obj_team_schema that filter or combine TIMs, so the schema is
+    only read once instead of for every team
+
+    Returns a dictionary of the section names to the calculations in that section to their plan.
+    """
+    plan = {"counts": {}, "multi_counts": {}, "special_counts": {}, "sums": {}}
+    for calculation, calc_schema in schema["counts"].items():
+        filters, repeats = compile_count_filters(calc_schema["tim_fields"])
+        plan["counts"][calculation] = {
+            "lfm": "lfm" in calculation,
+            "filters": filters,
+            "repeats": repeats,
+        }
+    for calculation, calc_schema in schema["multi_counts"].items():
+        plan["multi_counts"][calculation] = {
+            "lfm": "lfm" in calculation,
+            "fields": [tim_field.split(".")[1] for tim_field in calc_schema["tim_fields"]],
+        }
+    for calculation, calc_schema in schema["special_counts"].items():
+        filters = {"obj_tim": [], "subj_tim": []}
+        for field in calc_schema["tim_fields"]:
+            for key, value in field.items():
+                # Separates the datapoint into the obj/subj_tim part and the actual datapoint
+                name, key = key.split(".")[0], key.split(".")[1]
+                filters["obj_tim" if name == "obj_tim" else "subj_tim"].append(
+                    compile_filter(key, value, "equals_or_missing")
+                )
+        plan["special_counts"][calculation] = {"lfm": "lfm" in calculation, **filters}
+    for calculation, calc_schema in schema["sums"].items():
+        # incap_time has no point values
+        if calculation in ["total_incap_time", "lfm_total_incap_time"]:
+            plan["sums"][calculation] = {"lfm": "lfm" in calculation, "field": "incap_time"}
+            continue
+        plan["sums"][calculation] = {
+            "terms": [
+                (field, *compile_weight(value))
+                for field, value in calc_schema.items()
+                if field != "type"
+            ]
+        }
+    return plan
+
+
+def format_plan(plan: Dict[str, Dict[str, Dict]]) -> str:
+    """Returns the compiled plan from compile_plan as text"""
+    lines = []
+    for section, calculations in plan.items():
+        lines.append(f"{section}:")
+        for calculation, calc_plan in calculations.items():
+            tims = "lfm_tims" if calc_plan.get("lfm") else "tims"
+            if section == "counts":
+                terms = [f"count({tims} where {d})" for d, _ in calc_plan["filters"]]
+                if calc_plan["repeats"] != 1 and terms:
+                    terms = [f"{calc_plan['repeats']} * ({' + '.join(terms)})"]
+            elif section == "multi_counts":
+                terms = [f"sum({tims}.{field})" for field in calc_plan["fields"]]
+            elif section == "special_counts":
+                # Each obj_tim filter is counted separately, and any subj_tim filter can match
+                subj_filters = " or ".join(d for d, _ in calc_plan["subj_tim"]) or "none"
+                terms = [
+                    f"count(obj_{tims} where {d} with subj_{tims} where {subj_filters})"
+                    for d, _ in calc_plan["obj_tim"]
+                ]
+            elif "field" in calc_plan:
+                terms = [f"sum({tims}.{calc_plan['field']})"]
+            else:
+                terms = [f"{field} * {d}" for field, d, _ in calc_plan["terms"]]
+            lines.append(f"  {calculation} = {' + '.join(terms) or '0'}")
+    return "\n".join(lines)
+
 
 class OBJTeamCalc(base_calculations.BaseCalculations):
     """Runs OBJ Team calculations"""
@@ -19,11 +156,15 @@ class OBJTeamCalc(base_calculations.BaseCalculations):
     # Get the last section of each entry (so foo.bar.baz becomes baz)
     SCHEMA = utils.unprefix_schema_dict(utils.read_schema("schema/calc_obj_team_schema.yml"))
     TIM_SCHEMA = utils.read_schema("schema/calc_obj_tim_schema.yml")
+    # Counts and sums compiled from SCHEMA once, instead of reading the schema for every team
+    PLAN = compile_plan(SCHEMA)
 
     def __init__(self, server):
         """Overrides watched collections, passes server object"""
         super().__init__(server)
         self.watched_collections = ["obj_tim", "subj_tim"]
+        self.extra_read_collections = ["ss_tim"]
+        self.output_collections = ["obj_team"]
 
     def get_action_counts(self, tims: List[Dict]):
         """Gets a list of times each team completed a certain action by tim for averages
@@ -97,77 +238,32 @@ class OBJTeamCalc(base_calculations.BaseCalculations):
             team_info[calculation] = standard_deviation
         return team_info
 
-    def filter_tims_for_counts(self, tims: List[Dict], schema):
-        """Filters tims based on schema for count calculations"""
-        tims_that_meet_filter = 0
-        for field in schema["tim_fields"]:
-            if type(field) == dict:
-                for key, value in field.items():
-                    key = key.split(".")[1]
-                    # Checks that the TIMs in their given field meet the filter
-                    tims_that_meet_filter += len(list(filter(lambda tim: tim[key] == value, tims)))
-            else:
-                for key, value in schema["tim_fields"].items():
-                    if key != "not":
-                        # Checks that the TIMs in their given field meet the filter
-                        tims_that_meet_filter += len(
-                            list(filter(lambda tim: tim[key] == value, tims))
-                        )
-                    else:
-                        # not_field expects the output to be anything but the given filter
-                        # not_value is the filter that not_field shouldn't have
-                        # checks if value is a list
-                        if isinstance(value, list):
-                            for val in value:
-                                for not_field, not_value in val.items():
-                                    # gets rid of obj_tim or subj_tim in front of datapoint
-                                    not_field = not_field.split(".")[1]
-                                    tims_that_meet_filter += len(
-                                        list(
-                                            # filter gets every item that meets the conditions of the lambda function in tims
-                                            filter(
-                                                lambda tim: tim.get(not_field, not_value)
-                                                != not_value,
-                                                tims,
-                                            )
-                                        )
-                                    )
-                        else:
-                            for not_field, not_value in value.items():
-                                tims_that_meet_filter += len(
-                                    list(
-                                        filter(
-                                            lambda tim: tim.get(not_field, not_value) != not_value,
-                                            tims,
-                                        )
-                                    )
-                                )
-
-        return tims_that_meet_filter
+    def filter_tims_for_counts(self, tims: List[Dict], plan: Dict) -> int:
+        """Returns the number of TIMs that meet each of the compiled count filters, added up"""
+        return plan["repeats"] * sum(
+            sum(1 for tim in tims if meets_filter(tim)) for _, meets_filter in plan["filters"]
+        )
 
     def calculate_counts(self, tims: List[Dict], lfm_tims: List[Dict]):
         """Creates a dictionary of calculated counts, called team_info,
         where the keys are the names of the calculations, and the values are the results
         """
         team_info = {}
-        for calculation, schema in self.SCHEMA["counts"].items():
-            if "lfm" in calculation:
-                tims_that_meet_filter = self.filter_tims_for_counts(lfm_tims, schema)
-            else:
-                tims_that_meet_filter = self.filter_tims_for_counts(tims, schema)
-            team_info[calculation] = tims_that_meet_filter
+        for calculation, plan in self.PLAN["counts"].items():
+            team_info[calculation] = self.filter_tims_for_counts(
+                lfm_tims if plan["lfm"] else tims, plan
+            )
         return team_info
 
     def calculate_multi_counts(self, tims: List[Dict], lfm_tims: List[Dict]):
         """Calculates counts of datapoints that can occur more than once in a match, such as trap_successes"""
         team_info = {}
-        for calculation, schema in self.SCHEMA["multi_counts"].items():
-            tim_fields = [tim_field.split(".")[1] for tim_field in schema["tim_fields"]]
+        for calculation, plan in self.PLAN["multi_counts"].items():
             team_info[calculation] = sum(
                 [
                     tim[tim_field]
-                    for tim_field in tim_fields
-                    for tim in (lfm_tims if "lfm" in calculation else tims)
+                    for tim_field in plan["fields"]
+                    for tim in (lfm_tims if plan["lfm"] else tims)
                 ]
             )
         return team_info
@@ -175,51 +271,30 @@ class OBJTeamCalc(base_calculations.BaseCalculations):
     def calculate_special_counts(self, obj_tims, subj_tims, lfm_obj_tims, lfm_subj_tims):
         """Calculates counts of datapoints collected by Objective and Subjective Scouts."""
         team_info = {}
-        for calculation, schema in self.SCHEMA["special_counts"].items():
-            total = 0
-            obj_tims_that_meet_filter = []
-            subj_tims_that_meet_filter = []
-            if "lfm" in calculation:
-                for field in schema["tim_fields"]:
-                    for key, value in field.items():
-                        # Separates the datapoint into the obj/subj_tim part and the actual datapoint
-                        key, name = key.split(".")[1], key.split(".")[0]
-                        # Checks that the TIMs in their given field meet the filter
-                        if name == "obj_tim":
-                            # joins the two lists together
-                            # filter gets every item that meets the conditions of the lambda function in tims
-                            obj_tims_that_meet_filter = obj_tims_that_meet_filter + list(
-                                filter(lambda tim: tim.get(key, value) == value, lfm_obj_tims)
-                            )
-                        else:
-                            subj_tims_that_meet_filter = subj_tims_that_meet_filter + list(
-                                filter(lambda tim: tim.get(key, value) == value, lfm_subj_tims)
-                            )
+        for calculation, plan in self.PLAN["special_counts"].items():
+            if plan["lfm"]:
+                obj_tims_to_filter, subj_tims_to_filter = lfm_obj_tims, lfm_subj_tims
             else:
-                for field in schema["tim_fields"]:
-                    for key, value in field.items():
-                        # Separates the datapoint into the obj/subj_tim part and the actual datapoint
-                        key, name = key.split(".")[1], key.split(".")[0]
-                        # Checks that the TIMs in their given field meet the filter
-                        if name == "obj_tim":
-                            # joins the two lists together
-                            # filter gets every item that meets the conditions of the lambda function in tims
-                            obj_tims_that_meet_filter = obj_tims_that_meet_filter + list(
-                                filter(lambda tim: tim.get(key, value) == value, obj_tims)
-                            )
-                        else:
-                            subj_tims_that_meet_filter = subj_tims_that_meet_filter + list(
-                                filter(lambda tim: tim.get(key, value) == value, subj_tims)
-                            )
-            for tim in obj_tims_that_meet_filter:
-                for s_tim in subj_tims_that_meet_filter:
-                    if (
-                        tim["match_number"] == s_tim["match_number"]
-                        and tim["team_number"] == s_tim["team_number"]
-                    ):
-                        total += 1
-                        break
-            team_info[calculation] = total
+                obj_tims_to_filter, subj_tims_to_filter = obj_tims, subj_tims
+            # An obj_tim is counted once for each filter it meets
+            obj_tims_that_meet_filter = [
+                tim
+                for _, meets_filter in plan["obj_tim"]
+                for tim in obj_tims_to_filter
+                if meets_filter(tim)
+            ]
+            # Matches and teams of the subj_tims that meet any filter
+            subj_tims_that_meet_filter = {
+                (tim["match_number"], tim["team_number"])
+                for _, meets_filter in plan["subj_tim"]
+                for tim in subj_tims_to_filter
+                if meets_filter(tim)
+            }
+            team_info[calculation] = sum(
+                1
+                for tim in obj_tims_that_meet_filter
+                if (tim["match_number"], tim["team_number"]) in subj_tims_that_meet_filter
+            )
         return team_info
 
     def calculate_super_counts(self, tims, lfm_tims):
@@ -381,39 +456,32 @@ class OBJTeamCalc(base_calculations.BaseCalculations):
         where the keys are the names of the calculations, and the values are the results
         """
         team_info = {}
-        for calculation, schema in self.SCHEMA["sums"].items():
-            # incap_time has no point values
-            if calculation == "total_incap_time":
-                team_info[calculation] = sum(tim["incap_time"] for tim in tims)
-            elif calculation == "lfm_total_incap_time":
-                # Use lfm_tims instead of tims, also this is the only lfm sum
-                team_info[calculation] = sum([tim["incap_time"] for tim in lfm_tims])
+        for calculation, plan in self.PLAN["sums"].items():
+            if "field" in plan:
+                team_info[calculation] = sum(
+                    tim[plan["field"]] for tim in (lfm_tims if plan["lfm"] else tims)
+                )
             else:
                 total_points = 0
-                for field, value in schema.items():
-                    if field == "type":
-                        continue
-                    if isinstance(value, list):
-                        weight = 1
-                        for v in value:
-                            weight *= v if not isinstance(v, str) else team_data[v]
-                    else:
-                        weight = value if not isinstance(value, str) else team_data[value]
+                for field, _, weight in plan["terms"]:
                     total_points += (
                         team_data[field] if field in team_data else team_info[field]
-                    ) * weight
+                    ) * weight(team_data)
                 team_info[calculation] = total_points
         return team_info
 
     def update_team_calcs(self, teams: list) -> list:
         """Calculate data for given team using objective calculated TIMs"""
         obj_team_updates = {}
+        # Load the data for all of the teams from the database at once
+        grouped_obj_tims = self.server.db.find_grouped("obj_tim", teams, group_by="team_number")
         # Subj aim data for super counts
+        grouped_subj_tims = self.server.db.find_grouped("subj_tim", teams, group_by="team_number")
+        grouped_ss_tims = self.server.db.find_grouped("ss_tim", teams, group_by="team_number")
         for team in teams:
-            # Load team data from database
-            obj_tims = self.server.db.find("obj_tim", {"team_number": team})
-            subj_tims = self.server.db.find("subj_tim", {"team_number": team})
-            ss_tims = self.server.db.find("ss_tim", {"team_number": team})
+            obj_tims = grouped_obj_tims[team]
+            subj_tims = grouped_subj_tims[team]
+            ss_tims = grouped_ss_tims[team]
             # Last 4 tims to calculate last 4 matches
             obj_lfm_tims = sorted(obj_tims, key=lambda tim: tim["match_number"])[-4:]
             subj_lfm_tims = sorted(subj_tims, key=lambda tim: tim["match_number"])[-4:]
@@ -481,18 +549,17 @@ class OBJTeamCalc(base_calculations.BaseCalculations):
         # Get calc start time
         start_time = time.time()
         teams = []
+        updated_teams = self.get_updated_teams()
+        obj_tims = self.server.db.find_grouped(
+            "obj_tim", updated_teams, group_by="team_number", projection=["team_number"]
+        )
         # Filter out teams that are in subj_tim but not obj_tim
-        for team in self.get_updated_teams():
-            if self.server.db.find("obj_tim", {"team_number": team}):
+        for team in updated_teams:
+            if obj_tims[team]:
                 teams.append(team)
-        # Delete and re-insert if updating all data
-        if self.calc_all_data:
-            self.server.db.delete_data("obj_team")
-
-        for update in self.update_team_calcs(teams):
-            self.server.db.update_document(
-                "obj_team", update, {"team_number": update["team_number"]}
-            )
+        # Replace the old data at once if updating all data
+        with self.replace_outputs("obj_team"):
+            self.server.db.bulk_upsert("obj_team", self.update_team_calcs(teams), ["team_number"])
         end_time = time.time()
         # Get total calc time
         total_time = end_time - start_time
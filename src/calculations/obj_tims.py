@@ -6,9 +6,8 @@ import copy
 import statistics
 import utils
 from calculations.base_calculations import BaseCalculations
-from typing import List, Union, Dict
+from typing import List, Union, Dict, Tuple
 import logging
-from data_transfer import tba_communicator
 import time
 
 log = logging.getLogger(__name__)
@@ -23,6 +22,8 @@ class ObjTIMCalcs(BaseCalculations):
     def __init__(self, server):
         super().__init__(server)
         self.watched_collections = ["unconsolidated_obj_tim"]
+        self.extra_read_collections = ["unconsolidated_totals"]
+        self.output_collections = ["obj_tim"]
 
     def consolidate_nums(self, nums: List[Union[int, float]], decimal=False) -> int:
         """Given numbers reported by multiple scouts, estimates actual number
@@ -89,24 +90,13 @@ class ObjTIMCalcs(BaseCalculations):
         return final_categorical_actions
 
     def filter_timeline_actions(self, tim: dict, **filters) -> list:
-        """Removes timeline actions that don't meet the filters and returns all the actions that do"""
-        actions = tim["timeline"]
-        for field, required_value in filters.items():
-            if field == "time":
-                # Times are given as closed intervals: either [0,134] or [135,150]
-                actions = filter(
-                    lambda action: required_value[0] <= action["time"] <= required_value[1],
-                    actions,
-                )
-            elif required_value == "score":
-                # Removes actions for which required_value is not contained within action[field] (eg score and score_cone_high)
-                actions = filter(lambda action: str(required_value) in str(action[field]), actions)
-            else:
-                # Removes actions for which action[field] != required_value
-                actions = filter(lambda action: action[field] == required_value, actions)
-            # filter returns an iterable object
-            actions = list(actions)
-        return actions
+        """Removes timeline actions that don't meet the filters and returns all the actions that do
+
+        Times are given as closed intervals: either [0,134] or [135,150]. A required value of
+        "score" matches any value that contains it (eg score and score_amp). The actions are found
+        with the TIM's TimelineIndex instead of checking every action in the timeline.
+        """
+        return self.get_timeline_index(tim).filter(("score",), **filters)
 
     def count_timeline_actions(self, tim: dict, **filters) -> int:
         """Returns the number of actions in one TIM timeline that meets the required filters"""
@@ -207,9 +197,21 @@ class ObjTIMCalcs(BaseCalculations):
         the number of speaker and amp cycles. Both these calculations weight the different intake to
         score cycles.
         """
+        # Set decimal to True, so it returns a float
+        return {
+            key: self.consolidate_nums(unconsolidated_values, True)
+            for key, unconsolidated_values in self.get_expected_fields(tims, current_tim).items()
+        }
+
+    def get_expected_fields(self, tims, current_tim) -> Dict[str, list]:
+        """Returns the expected fields from calculate_expected_fields for each scout, before they
+        are consolidated
+
+        current_tim is the TIM with the consolidated counts and times.
+        """
         intake_weights = self.schema["intake_weights"]
         totals = []
-        calculated_tim = {}
+        unconsolidated = {}
         for tim in tims:
             cycles = {}
             for field, value in self.schema["calculate_expected_fields"].items():
@@ -325,14 +327,10 @@ class ObjTIMCalcs(BaseCalculations):
                 elif value["calc"] == "num":
                     cycles[field] = num_cycles
             totals.append(cycles)
-        # Consolidate the values from each tim to produce one number
+        # Group the values from each tim so they can be consolidated to one number
         for key in list(totals[0].keys()):
-            unconsolidated_values = []
-            for tim in totals:
-                unconsolidated_values.append(tim[key])
-            # Set decimal to True, so it returns a float
-            calculated_tim[key] = self.consolidate_nums(unconsolidated_values, True)
-        return calculated_tim
+            unconsolidated[key] = [tim[key] for tim in totals]
+        return unconsolidated
 
     def score_fail_type(self, unconsolidated_tims: List[Dict]):
         for num_1, tim in enumerate(unconsolidated_tims):
@@ -348,11 +346,22 @@ class ObjTIMCalcs(BaseCalculations):
                             unconsolidated_tims[num_1]["timeline"][num + 1][
                                 "action_type"
                             ] = new_value["name"]
+                            self.forget_timeline_index(tim)
         return unconsolidated_tims
 
     def calculate_tim_counts(self, unconsolidated_tims: List[Dict]) -> dict:
         """Given a list of unconsolidated TIMs, returns the calculated count based data fields"""
-        calculated_tim = {}
+        return {
+            calculation: self.consolidate_nums(unconsolidated_counts)
+            for calculation, unconsolidated_counts in self.get_unconsolidated_counts(
+                unconsolidated_tims
+            ).items()
+        }
+
+    def get_unconsolidated_counts(self, unconsolidated_tims: List[Dict]) -> Dict[str, list]:
+        """Given a list of unconsolidated TIMs, returns the count based data fields reported by
+        each scout, before they are consolidated"""
+        unconsolidated = {}
         self.score_fail_type(unconsolidated_tims)
         for calculation, filters in self.schema["timeline_counts"].items():
             unconsolidated_counts = []
@@ -416,12 +425,22 @@ class ObjTIMCalcs(BaseCalculations):
                 if not isinstance(new_count, self.type_check_dict[expected_type]):
                     raise TypeError(f"Expected {new_count} calculation to be a {expected_type}")
                 unconsolidated_counts.append(new_count)
-            calculated_tim[calculation] = self.consolidate_nums(unconsolidated_counts)
-        return calculated_tim
+            unconsolidated[calculation] = unconsolidated_counts
+        return unconsolidated
 
     def calculate_tim_times(self, unconsolidated_tims: List[Dict]) -> dict:
         """Given a list of unconsolidated TIMs, returns the calculated time data fields"""
-        calculated_tim = {}
+        return {
+            calculation: self.consolidate_nums(unconsolidated_cycle_times)
+            for calculation, unconsolidated_cycle_times in self.get_unconsolidated_times(
+                unconsolidated_tims
+            ).items()
+        }
+
+    def get_unconsolidated_times(self, unconsolidated_tims: List[Dict]) -> Dict[str, list]:
+        """Given a list of unconsolidated TIMs, returns the time data fields reported by each
+        scout, before they are consolidated"""
+        unconsolidated = {}
         for calculation, action_types in self.schema["timeline_cycle_time"].items():
             unconsolidated_cycle_times = []
             # Variable type of a calculation is in the schema, but it's not a filter
@@ -441,8 +460,8 @@ class ObjTIMCalcs(BaseCalculations):
                         f"Expected {new_cycle_time} calculation to be a {expected_type}"
                     )
                 unconsolidated_cycle_times.append(new_cycle_time)
-            calculated_tim[calculation] = self.consolidate_nums(unconsolidated_cycle_times)
-        return calculated_tim
+            unconsolidated[calculation] = unconsolidated_cycle_times
+        return unconsolidated
 
     def calculate_aggregates(self, calculated_tim: List[Dict]):
         """Given a list of consolidated tims by calculate_tim_counts, return consolidated aggregates"""
@@ -465,7 +484,17 @@ class ObjTIMCalcs(BaseCalculations):
 
     def calculate_pre_consolidation_aggregates(self, unconsolidated_tims: List[Dict]):
         """Given a list of unconsolidated tims, return unconsolidated aggregates"""
-        final_aggregates = {}
+        return {
+            aggregate: self.consolidate_nums(totals)
+            for aggregate, totals in self.get_pre_consolidation_aggregates(
+                unconsolidated_tims
+            ).items()
+        }
+
+    def get_pre_consolidation_aggregates(self, unconsolidated_tims: List[Dict]) -> Dict[str, list]:
+        """Given a list of unconsolidated tims, returns the aggregates for each scout, before they
+        are consolidated"""
+        unconsolidated = {}
 
         # initilize the list
         for aggregate, filters in self.schema["pre_consolidated_aggregates"].items():
@@ -477,9 +506,8 @@ class ObjTIMCalcs(BaseCalculations):
                 for count in aggregate_counts:
                     scout_totals += tim[count] if count in tim else 0
                 totals.append(scout_totals)
-            # Consolidate numbers from all 3 scouts
-            final_aggregates[aggregate] = self.consolidate_nums(totals)
-        return final_aggregates
+            unconsolidated[aggregate] = totals
+        return unconsolidated
 
     def calculate_point_values(self, calculated_tim: List[Dict]):
         """Given a list of consolidated tims by calculate_tim_counts, return consolidated point values"""
@@ -566,24 +594,128 @@ class ObjTIMCalcs(BaseCalculations):
             )
         return self.consolidate_bools(unconsolidated_preloads)
 
+    def get_aggregate_weights(self, fields: List[str]) -> Dict[str, Dict[str, int]]:
+        """Returns the number of times each of 'fields' is added up in each aggregate
+
+        Counts that aren't in 'fields' use the weights of aggregates before them, the same as
+        calculate_aggregates.
+        """
+        aggregate_weights = {}
+        for aggregate, filters in self.schema["aggregates"].items():
+            if not filters["counts"]:
+                continue
+            weights = {}
+            for count in filters["counts"]:
+                if count in fields:
+                    weights[count] = weights.get(count, 0) + 1
+                elif count in aggregate_weights:
+                    for field, weight in aggregate_weights[count].items():
+                        weights[field] = weights.get(field, 0) + weight
+            aggregate_weights[aggregate] = weights
+        return aggregate_weights
+
+    def calculate_tims(self, tims_data: List[Tuple[List[Dict], List[Dict]]]) -> List[dict]:
+        """Given the unconsolidated TIMs and unconsolidated totals for each TIM, returns the
+        calculated TIMs, the same as calculate_tim
+
+        The data from every TIM is consolidated at once with NumPy, instead of one datapoint at a
+        time.
+        """
+        # Imported here because NumPy is slow to import when the server starts
+        from consolidation import consolidate_rows, weighted_sums
+
+        calculated_tims = [{} for _ in tims_data]
+        valid = []
+        for i, (unconsolidated_tims, _) in enumerate(tims_data):
+            if len(unconsolidated_tims) == 0:
+                log.warning("calculate_tim: zero TIMs given")
+            else:
+                valid.append(i)
+
+        def consolidate(get_unconsolidated, decimal=False):
+            """Consolidates the datapoints from get_unconsolidated(i) for every valid TIM"""
+            slots, rows = [], []
+            for i in valid:
+                for field, values in get_unconsolidated(i).items():
+                    slots.append((i, field))
+                    rows.append(values)
+            for (i, field), value in zip(slots, consolidate_rows(rows, decimal)):
+                calculated_tims[i][field] = value
+
+        consolidate(lambda i: self.get_unconsolidated_counts(tims_data[i][0]))
+        consolidate(lambda i: self.get_pre_consolidation_aggregates(tims_data[i][1]))
+        consolidate(lambda i: self.get_unconsolidated_times(tims_data[i][0]))
+        # Expected fields use the consolidated incap time
+        consolidate(lambda i: self.get_expected_fields(tims_data[i][0], calculated_tims[i]), True)
+        # The timelines have all been counted
+        self.clear_timeline_indexes()
+        for i in valid:
+            calculated_tims[i].update(self.consolidate_categorical_actions(tims_data[i][0]))
+        if not valid:
+            return calculated_tims
+
+        # Aggregates are sums of the consolidated datapoints
+        fields = list(calculated_tims[valid[0]].keys())
+        aggregate_weights = self.get_aggregate_weights(fields)
+        aggregate_fields = sorted({field for w in aggregate_weights.values() for field in w})
+        aggregates = weighted_sums(
+            [[calculated_tims[i][field] for field in aggregate_fields] for i in valid],
+            [[w.get(field) for field in aggregate_fields] for w in aggregate_weights.values()],
+        )
+        for i, row in zip(valid, aggregates):
+            calculated_tims[i].update(zip(aggregate_weights.keys(), row))
+            calculated_tims[i]["climbed"] = "O" in [
+                calculated_tims[i]["stage_level_left"],
+                calculated_tims[i]["stage_level_center"],
+                calculated_tims[i]["stage_level_right"],
+            ]
+
+        # Point values are sums of counts multiplied by their values
+        sections = self.schema["point_calculations"]
+        point_fields = sorted(
+            {field for filters in sections.values() for field in filters["counts"]}
+        )
+        point_rows, note_rows = [], []
+        for i in valid:
+            point_rows.append([])
+            note_rows.append([])
+            for field in point_fields:
+                count = calculated_tims[i].get(field, 0)
+                # Same as calculate_point_values
+                if isinstance(count, bool):
+                    point_rows[-1].append(int(count))
+                    note_rows[-1].append(int(count))
+                elif isinstance(count, str):
+                    point_rows[-1].append(int(count not in ["N", "F"]))
+                    note_rows[-1].append(int(count != "N"))
+                else:
+                    point_rows[-1].append(count)
+                    note_rows[-1].append(count)
+        points = weighted_sums(
+            point_rows,
+            [[f["counts"].get(field) for field in point_fields] for f in sections.values()],
+        )
+        notes = weighted_sums(
+            note_rows,
+            [
+                [1 if field in f["counts"] else None for field in point_fields]
+                for f in sections.values()
+            ],
+        )
+        for i, point_row, note_row in zip(valid, points, notes):
+            for section, total_points, note_count in zip(sections.keys(), point_row, note_row):
+                if section == "points_per_note":
+                    total_points = 0 if note_count == 0 else total_points / note_count
+                calculated_tims[i][section] = total_points
+            self.add_tim_info(calculated_tims[i], tims_data[i][0])
+        return calculated_tims
+
     def calculate_tim(self, unconsolidated_tims: List[Dict], unconsolidated_totals) -> dict:
         """Given a list of unconsolidated TIMs, returns a calculated TIM"""
-        if len(unconsolidated_tims) == 0:
-            log.warning("calculate_tim: zero TIMs given")
-            return {}
-        calculated_tim = {}
-        calculated_tim.update(self.calculate_tim_counts(unconsolidated_tims))
-        calculated_tim.update(self.calculate_pre_consolidation_aggregates(unconsolidated_totals))
-        calculated_tim.update(self.calculate_tim_times(unconsolidated_tims))
-        calculated_tim.update(self.calculate_expected_fields(unconsolidated_tims, calculated_tim))
-        calculated_tim.update(self.consolidate_categorical_actions(unconsolidated_tims))
-        calculated_tim.update(self.calculate_aggregates(calculated_tim))
-        calculated_tim["climbed"] = "O" in [
-            calculated_tim["stage_level_left"],
-            calculated_tim["stage_level_center"],
-            calculated_tim["stage_level_right"],
-        ]
-        calculated_tim.update(self.calculate_point_values(calculated_tim))
+        return self.calculate_tims([(unconsolidated_tims, unconsolidated_totals)])[0]
+
+    def add_tim_info(self, calculated_tim: dict, unconsolidated_tims: List[Dict]) -> None:
+        """Adds the fields that aren't consolidated from datapoints to calculated_tim"""
         # Use any of the unconsolidated TIMs to get the team and match number,
         # since that should be the same for each unconsolidated TIM
         calculated_tim["match_number"] = unconsolidated_tims[0]["match_number"]
@@ -593,17 +725,20 @@ class ObjTIMCalcs(BaseCalculations):
         calculated_tim["confidence_ranking"] = len(unconsolidated_tims)
         calculated_tim["scored_preload"] = self.calculate_scored_preload(unconsolidated_tims)
 
-        return calculated_tim
-
     def update_calcs(self, tims: List[Dict[str, Union[str, int]]]) -> List[dict]:
         """Calculate data for each of the given TIMs. Those TIMs are represented as dictionaries:
         {'team_number': '1678', 'match_number': 69}"""
-        calculated_tims = []
-        for tim in tims:
-            unconsolidated_obj_tims = self.server.db.find("unconsolidated_obj_tim", tim)
-            unconsolidated_totals = self.server.db.find("unconsolidated_totals", tim)
-            calculated_tim = self.calculate_tim(unconsolidated_obj_tims, unconsolidated_totals)
-            calculated_tims.append(calculated_tim)
+        # Get the data for all of the TIMs at once instead of querying for each TIM
+        keys = [(tim["team_number"], tim["match_number"]) for tim in tims]
+        unconsolidated_obj_tims = self.server.db.find_grouped(
+            "unconsolidated_obj_tim", keys, group_by=("team_number", "match_number")
+        )
+        unconsolidated_totals = self.server.db.find_grouped(
+            "unconsolidated_totals", keys, group_by=("team_number", "match_number")
+        )
+        calculated_tims = self.calculate_tims(
+            [(unconsolidated_obj_tims[key], unconsolidated_totals[key]) for key in keys]
+        )
         harmonized_teams = self.calculate_harmony(calculated_tims)
         for tim in calculated_tims:
             if tim == {}:
@@ -622,14 +757,12 @@ class ObjTIMCalcs(BaseCalculations):
         """Executes the OBJ TIM calculations"""
         # Get calc start time
         start_time = time.time()
-        tba_match_data: List[dict] = tba_communicator.tba_request(
-            f"event/{utils.TBA_EVENT_KEY}/matches"
-        )
+        event_matches = self.server.get_event_matches()
 
         # Get oplog entries
         tims = []
         # Check if changes need to be made to teams
-        if entries := self.entries_since_last():
+        if entries := self.peek_entries_since_last(["team_number", "match_number"]):
             for entry in entries:
                 team_num = entry["o"]["team_number"]
                 if team_num not in self.teams_list:
@@ -645,42 +778,26 @@ class ObjTIMCalcs(BaseCalculations):
         for tim in tims:
             if tim not in unique_tims:
                 unique_tims.append(tim)
-        # Delete and re-insert if updating all data
-        if self.calc_all_data:
-            self.server.db.delete_data("obj_tim")
-
-        updates = self.update_calcs(unique_tims)
-        if updates == None:
-            pass
-        else:
-            for update in updates:
-                if update != {}:
-                    real_matches = [
-                        match
-                        for match in tba_match_data
-                        if match["match_number"] == update["match_number"]
-                    ]
-                    real_teams = [
-                        team[3:]
-                        for real_match in real_matches
-                        for team in (
-                            real_match["alliances"]["red"]["team_keys"]
-                            + real_match["alliances"]["blue"]["team_keys"]
-                        )
-                    ]
-                    if update["team_number"] in real_teams:
-                        self.server.db.update_document(
-                            "obj_tim",
-                            update,
-                            {
-                                "team_number": update["team_number"],
-                                "match_number": update["match_number"],
-                            },
-                        )
-                    else:
-                        team_number = update["team_number"]
-                        match_number = update["match_number"]
-                        log.warning(f"{team_number} not found in match {match_number}")
+        # Replace the old data at once if updating all data
+        with self.replace_outputs("obj_tim"):
+            updates = self.update_calcs(unique_tims)
+            if updates == None:
+                pass
+            else:
+                # TIMs from matches they actually played in, which are written to the database
+                valid_updates = []
+                for update in updates:
+                    if update != {}:
+                        real_teams = event_matches.get_teams(update["match_number"])
+                        if update["team_number"] in real_teams:
+                            valid_updates.append(update)
+                        else:
+                            team_number = update["team_number"]
+                            match_number = update["match_number"]
+                            log.warning(f"{team_number} not found in match {match_number}")
+                self.server.db.bulk_upsert(
+                    "obj_tim", valid_updates, ["team_number", "match_number"]
+                )
             end_time = time.time()
             # Get total calc time
             total_time = end_time - start_time
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+"""Keeps which teams each team has played with, so subjective scores can be adjusted for them."""
+
+import collections
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+
+class PartnerGraph:
+    """Sparse matrix of how many times each team has played with each other team.
+
+    Built from one scan of subj_tim documents with team_number, match_number and
+    alliance_color_is_red. Row i, column j is the number of subj_tims team j has in the matches
+    and alliances team i played in, which includes team i itself, so averaging partner scores for
+    every team is one sparse matrix-vector product.
+    """
+
+    def __init__(self, tims: Iterable[dict]):
+        # (match_number, alliance_color_is_red) to the teams with a subj_tim in that alliance
+        self.alliances: Dict[Tuple[int, bool], List[str]] = collections.defaultdict(list)
+        # Team number to match number to alliance color, the last one if there are repeats
+        self.matches_played: Dict[str, Dict[int, bool]] = {}
+        for tim in tims:
+            alliance = (tim["match_number"], tim["alliance_color_is_red"])
+            self.alliances[alliance].append(tim["team_number"])
+            self.matches_played.setdefault(tim["team_number"], {})[alliance[0]] = alliance[1]
+        self.teams = list(self.matches_played)
+        self.team_indexes = {team: index for index, team in enumerate(self.teams)}
+        # The matrix in coordinate form: rows, columns and number of times played together
+        partner_counts = collections.Counter()
+        for team, matches in self.matches_played.items():
+            row = self.team_indexes[team]
+            for alliance in matches.items():
+                for partner in self.alliances[alliance]:
+                    partner_counts[(row, self.team_indexes[partner])] += 1
+        self.rows = np.array([row for row, _ in partner_counts], dtype=np.intp)
+        self.columns = np.array([column for _, column in partner_counts], dtype=np.intp)
+        self.counts = np.array(list(partner_counts.values()), dtype=float)
+        # Number of partners of each team, including repeats
+        self.totals = np.bincount(self.rows, weights=self.counts, minlength=len(self.teams))
+
+    def get_partners(self, team: str) -> List[str]:
+        """Returns the teams that 'team' has played with, including themselves and repeats, in the
+        order the matches were scanned"""
+        partners = []
+        for alliance in self.matches_played.get(team, {}).items():
+            partners.extend(self.alliances[alliance])
+        return partners
+
+    def average_partner_values(self, values: Dict[str, float]) -> Dict[str, float]:
+        """Returns the average value of each team's partners, including repeats
+
+        Partners without a value in 'values' count as 0, and teams without any matches average to
+        0, like BaseCalculations.avg of an empty list.
+        """
+        vector = np.array([values.get(team, 0) for team in self.teams], dtype=float)
+        sums = np.bincount(
+            self.rows, weights=self.counts * vector[self.columns], minlength=len(self.teams)
+        )
+        averages = np.divide(
+            sums, self.totals, out=np.zeros(len(self.teams)), where=self.totals != 0
+        )
+        return {team: float(averages[index]) for team, index in self.team_indexes.items()}
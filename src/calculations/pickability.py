@@ -1,3 +1,5 @@
+from typing import Dict, List
+
 from calculations import base_calculations
 import utils
 import logging
@@ -15,6 +17,7 @@ class PickabilityCalc(base_calculations.BaseCalculations):
         super().__init__(server)
         self.pickability_schema = utils.read_schema("schema/calc_pickability_schema.yml")
         self.get_watched_collections()
+        self.output_collections = ["pickability"]
 
     def get_watched_collections(self):
         """Reads from the schema file to generate the correct watched collections"""
@@ -24,6 +27,21 @@ class PickabilityCalc(base_calculations.BaseCalculations):
                 if "." in sub_calc:
                     self.watched_collections.add(sub_calc.split(".")[0])
 
+    def get_watched_fields(self) -> Dict[str, List[str]]:
+        """Returns the datapoints used from each watched collection, including datapoints used as
+        weights"""
+        fields = {collection: [] for collection in self.watched_collections}
+        for calc in self.pickability_schema["calculations"].values():
+            for sub_calc, weighted_value in calc.items():
+                if not isinstance(weighted_value, list):
+                    weighted_value = [weighted_value]
+                for datapoint in [sub_calc] + weighted_value:
+                    if isinstance(datapoint, str) and "." in datapoint:
+                        collection, field = datapoint.split(".")
+                        if collection in fields and field not in fields[collection]:
+                            fields[collection].append(field)
+        return fields
+
     def calculate_pickability(self, calc_name: str, team_data: dict) -> float:
         """Calculates first and second pickability
 
@@ -60,12 +78,15 @@ class PickabilityCalc(base_calculations.BaseCalculations):
     def update_pickability(self):
         """Creates updated pickability documents"""
         updates = []
+        watched_fields = self.get_watched_fields()
         for team in self.get_updated_teams():
             # Data that is needed to calculate pickability
             team_data = {}
             # Get each calc name and search for it in the database
             for collection in self.watched_collections:
-                if query := self.server.db.find(collection, {"team_number": team}):
+                if query := self.server.db.find(
+                    collection, {"team_number": team}, watched_fields[collection]
+                ):
                     team_data[collection] = query[0]
             update = {"team_number": team}
             for calc_name in self.pickability_schema["calculations"]:
@@ -82,17 +103,11 @@ class PickabilityCalc(base_calculations.BaseCalculations):
         # Get calc start time
         start_time = time.time()
         # Finds oplog entries in the watched collections
-        entries = self.entries_since_last()
-        if entries == []:
+        if self.peek_entries_since_last(["team_number"]) is None:
             return
-        # Delete and re-insert if updating all data
-        if self.calc_all_data:
-            self.server.db.delete_data("pickability")
-
-        for update in self.update_pickability():
-            self.server.db.update_document(
-                "pickability", update, {"team_number": update["team_number"]}
-            )
+        # Replace the old data at once if updating all data
+        with self.replace_outputs("pickability"):
+            self.server.db.bulk_upsert("pickability", self.update_pickability(), ["team_number"])
         end_time = time.time()
         # Get total calc time
         total_time = end_time - start_time
@@ -2,14 +2,11 @@
 """Makes predictive calculations for alliances in matches in a competition."""
 
 import utils
-import numpy as np
 from statistics import NormalDist as Norm
 from calculations.base_calculations import BaseCalculations
 from data_transfer import tba_communicator
 import logging
 import time
-import pandas as pd
-import statsmodels.api as sm
 
 log = logging.getLogger(__name__)
 server_log = logging.FileHandler("server.log")
@@ -55,6 +52,8 @@ class PredictedAimCalc(BaseCalculations):
     def __init__(self, server):
         super().__init__(server)
         self.watched_collections = ["obj_team", "tba_team"]
+        self.extra_read_collections = ["obj_tim"]
+        self.output_collections = ["predicted_aim", "predicted_alliances"]
 
     def calc_alliance_auto_score(self, predicted_values):
         """Calculates the predicted auto score for an alliance.
@@ -400,7 +399,7 @@ class PredictedAimCalc(BaseCalculations):
             "has_actual_data": False,
         }
         match_number = aim["match_number"]
-        if self.server.db.find("obj_tim", {"match_number": match_number}) != []:
+        if self.server.db.find("obj_tim", {"match_number": match_number}, ["match_number"]) != []:
             actual_match_dict["has_actual_data"] = True
         else:
             actual_match_dict["has_actual_data"] = False
@@ -694,26 +693,19 @@ class PredictedAimCalc(BaseCalculations):
                 if team in teams:
                     aims.append(alliance)
                     break
-        # Delete and re-insert if updating all data
-        if self.calc_all_data:
-            self.server.db.delete_data("predicted_aim")
-
-        # Inserts predicted_aim data into database
-        for update in self.update_predicted_aim(aims):
-            self.server.db.update_document(
+        # Replace the old data at once if updating all data
+        with self.replace_outputs("predicted_aim"):
+            # Inserts predicted_aim data into database
+            self.server.db.bulk_upsert(
                 "predicted_aim",
-                update,
-                {
-                    "match_number": update["match_number"],
-                    "alliance_color_is_red": update["alliance_color_is_red"],
-                },
+                self.update_predicted_aim(aims),
+                ["match_number", "alliance_color_is_red"],
             )
 
         # Inserts data into predicted_alliances
-        for update in self.update_playoffs_alliances():
-            self.server.db.update_document(
-                "predicted_alliances", update, {"alliance_num": update["alliance_num"]}
-            )
+        self.server.db.bulk_upsert(
+            "predicted_alliances", self.update_playoffs_alliances(), ["alliance_num"]
+        )
 
         end_time = time.time()
         # Get total calc time
@@ -16,6 +16,7 @@ class PredictedTeamCalc(BaseCalculations):
     def __init__(self, server):
         super().__init__(server)
         self.watched_collections = ["predicted_aim"]
+        self.output_collections = ["predicted_team"]
 
     def calculate_current_values(self, ranking_data, team_number):
         for team_data in ranking_data:
@@ -156,14 +157,14 @@ class PredictedTeamCalc(BaseCalculations):
     def run(self):
         # Get calc start time
         start_time = time.time()
-        # Get oplog entries
-        entries = self.entries_since_last()
-        if entries:
-            self.server.db.delete_data("predicted_team")
+        # Only recalculate if predicted_aim changed
+        if self.peek_entries_since_last(["_id"]) is not None:
             predicted_aim = self.server.db.find("predicted_aim")
-            self.server.db.insert_documents(
-                "predicted_team", self.update_predicted_team(predicted_aim)
-            )
+            # Every document is rewritten, so replace the old ones at once instead of deleting them
+            with self.server.db.replace_collection("predicted_team"):
+                self.server.db.insert_documents(
+                    "predicted_team", self.update_predicted_team(predicted_aim)
+                )
         self.update_timestamp()
         end_time = time.time()
         # Get total calc time
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+"""Decodes match collection QR codes with tables compiled from the QR schema.
+
+This module doesn't import the server or the database, so the Decompressor can decode QRs in
+worker processes without starting mongod or connecting to it.
+"""
+
+import enum
+import re
+from typing import List, Optional, TypedDict
+
+import utils
+from calculations import qr_state
+from calculations.qr_state import QRState
+
+
+class QRType(enum.Enum):
+    """Enum that stores QR types."""
+
+    OBJECTIVE = 0
+    SUBJECTIVE = 1
+
+
+class QRResult(TypedDict):
+    """Result of decompressing one raw_qr document, see QRDecoder.decompress_qr"""
+
+    ulid: str
+    # Collection the documents go in, None if the QR couldn't be decompressed
+    collection: Optional[str]
+    documents: List[dict]
+    # Error type and message if the QR couldn't be decompressed
+    error: Optional[str]
+
+
+class QRDecoder:
+    """Decompresses QR data into TIM documents, used by the Decompressor calculation"""
+
+    # Load latest match collection compression QR code schema
+    SCHEMA = qr_state.SCHEMA
+    OBJ_TIM_SCHEMA = utils.read_schema("schema/calc_obj_tim_schema.yml")
+    _GENERIC_DATA_FIELDS = QRState._get_data_fields("generic_data")
+    OBJECTIVE_QR_FIELDS = _GENERIC_DATA_FIELDS.union(QRState._get_data_fields("objective_tim"))
+    SUBJECTIVE_QR_FIELDS = _GENERIC_DATA_FIELDS.union(QRState._get_data_fields("subjective_aim"))
+    TIMELINE_FIELDS = QRState.get_timeline_info()
+    # Decoder tables compiled from the schema once, so decompressing doesn't search the schema
+    # Section to {compressed name: variable name}, also used to decompress enums
+    DECOMPRESSED_NAMES = QRState.get_decompressed_names()
+    # QR data section to {compressed name: (variable name, data type)}
+    DATA_FIELDS = {
+        section: QRState.get_data_field_types(section)
+        for section in ["generic_data", "objective_tim", "subjective_aim"]
+    }
+    # (name, start index, end index, type) of each timeline field and the length of an action
+    TIMELINE_SLICES, TIMELINE_ACTION_LENGTH = QRState.get_timeline_slices()
+
+    @classmethod
+    def convert_data_type(cls, value, type_, name=None):
+        """Convert from QR string representation to database data type."""
+        # Enums are stored as int in the database
+        if type_ == "int":
+            return int(value)
+        if type_ == "float":
+            return float(value)
+        if type_ == "bool":
+            return utils.get_bool(value)
+        if type_ == "str":
+            return value  # Value is already a str
+        if "Enum" in type_:
+            return cls.get_decompressed_name(value, name)
+        raise ValueError(f"Type {type_} not recognized")
+
+    @classmethod
+    def get_decompressed_name(cls, compressed_name, section):
+        """Returns decompressed variable name from schema.
+
+        compressed_name: str - Compressed variable name within QR code
+        section: str - Section of schema that name comes from.
+        """
+        decompressed_name = cls.DECOMPRESSED_NAMES[section].get(compressed_name)
+        if decompressed_name is not None:
+            return decompressed_name
+        raise ValueError(f"Retrieving Variable Name {compressed_name} from {section} failed.")
+
+    @classmethod
+    def get_decompressed_type(cls, name, section):
+        """Returns server-side data type from schema.
+
+        name: str - Decompressed variable name within Schema
+        section: str - Section of schema that name comes from.
+        """
+        # Type all items after the first item
+        type_ = cls.SCHEMA[section][name][1:]
+        # Detect special case of data type being a list
+        if len(type_) > 1:
+            return type_  # Returns list of the type (list) and the type of data stored in the list
+        return type_[0]  # Return the type of the value
+
+    @classmethod
+    def decompress_data(cls, data, section):
+        """Decompress (split) data given the section of the QR it came from.
+
+        This matches compressed data names to actual variable names. It treats embedded dictionaries as
+        special cases, a parsing function needs to be written for each (e.g. timeline).
+        """
+        decompressed_data = {}
+        data_fields = cls.DATA_FIELDS.get(section, {})
+        # Iterate through data
+        for data_field in data:
+            compressed_name = data_field[0]  # Compressed name is always first character
+            value = data_field[1:]  # Actual data value is everything after the first character
+            # Get uncompressed name and the target data type
+            if compressed_name in data_fields:
+                uncompressed_name, uncompressed_type = data_fields[compressed_name]
+            else:
+                uncompressed_name = cls.get_decompressed_name(compressed_name, section)
+                uncompressed_type = cls.get_decompressed_type(uncompressed_name, section)
+            # Detect special cases in typing (e.g. value is list)
+            if isinstance(uncompressed_type, list):
+                # If second data type is dictionary, it should be handled separately
+                if "dict" in uncompressed_type:
+                    # Decompress timeline
+                    if uncompressed_name == "timeline":
+                        typed_value = cls.decompress_timeline(value)
+                    # Value is not one of the currently known dictionaries
+                    else:
+                        raise NotImplementedError(
+                            f"Decompression of {uncompressed_name} as a dict not supported."
+                        )
+                # Decompress list of none-dicts
+                elif uncompressed_type[1] in ["int", "float", "bool", "str"]:
+                    if len(uncompressed_type) == 2:
+                        # Default case, use _list_data_separator to seperate value into list items
+                        split_values = value.split(cls.SCHEMA["_list_data_separator"])
+                    else:
+                        # Use the specified length of each item to seperate
+                        split_values = [
+                            value[i : i + uncompressed_type[2]]
+                            for i in range(0, len(value), uncompressed_type[2])
+                        ]
+                    # Convert string to appropriate data type
+                    typed_value = [
+                        cls.convert_data_type(split_value, uncompressed_type[1])
+                        for split_value in split_values
+                    ]
+            else:  # Normal data type
+                typed_value = cls.convert_data_type(value, uncompressed_type, uncompressed_name)
+            decompressed_data[uncompressed_name] = typed_value
+        return decompressed_data
+
+    @classmethod
+    def decompress_generic_qr(cls, data):
+        """Decompress generic section of QR or raise error if schema is outdated."""
+        # Split data by separator specified in schema
+        data = data.split(cls.SCHEMA["generic_data"]["_separator"])
+        for entry in data:
+            if entry[0] == "A":
+                schema_version = int(entry[1:])
+                if schema_version != cls.SCHEMA["schema_file"]["version"]:
+                    raise LookupError(
+                        f'QR Schema (v{schema_version}) does not match Server version (v{cls.SCHEMA["schema_file"]["version"]})'
+                    )
+        return cls.decompress_data(data, "generic_data")
+
+    @classmethod
+    def decompress_timeline(cls, data):
+        """Decompress the timeline based on schema."""
+        decompressed_timeline = []  # Timeline is a list of dictionaries
+        # Return empty list if timeline is empty
+
+        if data == "":
+            return decompressed_timeline
+
+        timeline_length = cls.TIMELINE_ACTION_LENGTH
+
+        if len(data) % timeline_length != 0:
+            raise ValueError(f"Invalid timeline -- Timeline length invalid: {data}")
+
+        to_teleop = cls.SCHEMA["action_type"]["to_teleop"]
+        in_teleop = False
+        for start in range(0, len(data), timeline_length):
+            # Each action is a string of length timeline_length
+            action = data[start : start + timeline_length]
+            # Actions from to_teleop on are in teleop
+            if to_teleop in action:
+                in_teleop = True
+            decompressed_action = {
+                name: cls.convert_data_type(action[field_start:field_end], type_, name)
+                for name, field_start, field_end, type_ in cls.TIMELINE_SLICES
+            }
+            decompressed_action["in_teleop"] = in_teleop
+            decompressed_timeline.append(decompressed_action)
+        return decompressed_timeline
+
+    @classmethod
+    def get_qr_type(cls, first_char):
+        """Returns the qr type from QRType enum based on first character."""
+        if first_char == cls.SCHEMA["objective_tim"]["_start_character"]:
+            return QRType.OBJECTIVE
+        if first_char == cls.SCHEMA["subjective_aim"]["_start_character"]:
+            return QRType.SUBJECTIVE
+        raise ValueError(f"QR type unknown - Invalid first character for QR: {first_char}")
+
+    @classmethod
+    def decompress_single_qr(cls, qr_data, qr_type, override):
+        """Decompress a full QR."""
+        # Split into generic data and objective/subjective data
+        qr_data = qr_data.split(cls.SCHEMA["generic_data"]["_section_separator"])
+        # Generic QR is first section of QR
+        decompressed_data = []
+        # Decompress subjective QR
+        if qr_type == QRType.SUBJECTIVE:
+            teams_data = qr_data[1].split(cls.SCHEMA["subjective_aim"]["_team_separator"])
+            """none_generic_data = qr_data[1].split(
+                cls.SCHEMA["subjective_aim"]["_alliance_data_separator"]
+            )
+            if len(none_generic_data) != 2:
+                raise IndexError("Subjective QR missing whole-alliance data")
+            teams_data = none_generic_data[0].split(
+                cls.SCHEMA["subjective_aim"]["_team_separator"]
+            )
+            alliance_data = none_generic_data[1].split(
+                cls.SCHEMA["subjective_aim"]["_alliance_data_separator"]
+            )
+            """
+
+            if len(teams_data) != 3:
+                raise IndexError("Incorrect number of teams in Subjective QR")
+            for team in teams_data:
+                # Regular expression that finds all occurences of an integer occuring after "B" and "C" and returns the matches as a list of strings
+                scores = re.findall(r"(?<=[BC])\d+", team)
+                invalid = False
+                for score in scores:
+                    if score not in ["1", "2", "3"]:
+                        invalid = True
+
+                if invalid:
+                    continue
+
+                decompressed_document = cls.decompress_generic_qr(qr_data[0])
+                """
+                subjective_data = team.split(cls.SCHEMA["subjective_aim"]["_separator"]) + (
+                    alliance_data if alliance_data != [""] else []
+                )
+                decompressed_data.append(decompressed_document)
+                """
+                subjective_data = team.split(cls.SCHEMA["subjective_aim"]["_separator"])
+                decompressed_document.update(cls.decompress_data(subjective_data, "subjective_aim"))
+                if set(decompressed_document.keys()) != cls.SUBJECTIVE_QR_FIELDS:
+                    raise ValueError("QR missing data fields", qr_type)
+                decompressed_data.append(decompressed_document)
+        elif qr_type == QRType.OBJECTIVE:  # Decompress objective QR
+            objective_data = qr_data[1].split(cls.SCHEMA["objective_tim"]["_separator"])
+            decompressed_document = cls.decompress_generic_qr(qr_data[0])
+            decompressed_document.update(cls.decompress_data(objective_data, "objective_tim"))
+            decompressed_data.append(decompressed_document)
+            if set(decompressed_document.keys()) != cls.OBJECTIVE_QR_FIELDS:
+                raise ValueError("QR missing data fields", qr_type)
+            decompressed_document.update({"override": override})
+        return decompressed_data
+
+    @classmethod
+    def decompress_qr(cls, qr: dict) -> "QRResult":
+        """Decompresses one raw_qr document and applies its overrides.
+
+        Errors are returned in the result instead of being raised or logged.
+        """
+        try:
+            qr_type = cls.get_qr_type(qr["data"][0])
+            decompressed_qr = cls.decompress_single_qr(qr["data"][1:], qr_type, qr["override"])
+        # Keyboard interrupts should stop server
+        except KeyboardInterrupt:
+            raise
+        except Exception as err:
+            return {
+                "ulid": qr["ulid"],
+                "collection": None,
+                "documents": [],
+                "error": f"{err.__class__.__name__}: {err}",
+            }
+        # Override non-timeline datapoints at decompression
+        for decompressed in decompressed_qr:
+            decompressed["ulid"] = qr["ulid"]
+            for override in qr["override"]:
+                if (
+                    override in decompressed
+                    and override not in cls.OBJ_TIM_SCHEMA["timeline_counts"]
+                ):  # Checks that override is not a timeline datapoint
+                    decompressed[override] = qr["override"][override]
+            # If there were datapoints in override that weren't in decompressed data,
+            # add override to data for obj_tim calcs to handle
+        return {
+            "ulid": qr["ulid"],
+            "collection": ("unconsolidated_obj_tim" if qr_type == QRType.OBJECTIVE else "subj_tim"),
+            "documents": decompressed_qr,
+            "error": None,
+        }
+
+
+def decompress_qr_batch(qrs: List[dict]) -> List[QRResult]:
+    """Decompresses each raw_qr document in `qrs`, used as the task for worker processes"""
+    return [QRDecoder.decompress_qr(qr) for qr in qrs]
@@ -6,7 +6,10 @@ import utils
 import datetime
 from ulid import ULID
 import logging
+import queue
+import threading
 import time
+from typing import Iterable, List
 
 import sys
 from console import console
@@ -17,29 +20,46 @@ log.addHandler(server_log)
 
 
 class QRInput(calculations.base_calculations.BaseCalculations):
+    # Waits for QRs to be entered, so it doesn't run in daemon mode
+    is_interactive = True
+    # When streaming QRs, most QRs inserted at once and the longest a QR waits to be inserted
+    STREAM_BATCH_SIZE = 10
+    STREAM_BATCH_SECONDS = 0.5
+
     def __init__(self, server):
         super().__init__(server)
         self.schema = utils.read_schema("schema/match_collection_qr_schema.yml")
+        # QRs come from stdin instead of the oplog, so there are no watched collections
+        self.watched_collections = []
+        # QRs are uploaded here, and stand strategist and pit data are pulled from the tablets
+        self.extra_read_collections = ["raw_qr", "ss_tim", "unconsolidated_ss_team"]
+        self.output_collections = [
+            "raw_qr",
+            "raw_obj_pit",
+            "ss_tim",
+            "ss_team",
+            "unconsolidated_ss_team",
+        ]
+
+    def is_valid_qr_code(self, qr_code: str) -> bool:
+        """Checks to make sure the qr is valid by checking its starting character"""
+        return qr_code.startswith(
+            self.schema["subjective_aim"]["_start_character"]
+        ) or qr_code.startswith(self.schema["objective_tim"]["_start_character"])
 
-    def upload_qr_codes(self, qr_codes):
-        # Acquires current qr data
-        qr_data = [qr_code["data"] for qr_code in self.server.db.find("raw_qr")]
-        qr = set()
+    def upload_qr_codes(self, qr_codes) -> List[dict]:
+        """Uploads the valid QR codes in `qr_codes` to raw_qr, returns the inserted documents"""
+        # Duplicates of QRs in raw_qr are skipped by the database, see Database.insert_raw_qrs
+        qr = {}
+        inserted = []
 
         for qr_code in qr_codes:
-            # Check for duplicate QR codes
-            if qr_code in qr_data:
-                log.warning(f"Duplicate QR code not uploaded\t{qr_code}")
-                continue
-            # Checks to make sure the qr is valid by checking its starting character
-            elif qr_code.startswith(
-                self.schema["subjective_aim"]["_start_character"]
-            ) or qr_code.startswith(self.schema["objective_tim"]["_start_character"]):
-                qr.add(qr_code)
+            if self.is_valid_qr_code(qr_code):
+                qr[qr_code] = None
             else:
                 log.warning(f'Invalid QR code not uploaded: "{qr_code}"')
 
-        if qr != set():
+        if qr:
             qr = [
                 {
                     "data": qr_code,
@@ -50,10 +70,91 @@ class QRInput(calculations.base_calculations.BaseCalculations):
                 }
                 for qr_code in qr
             ]
-            self.server.db.insert_documents("raw_qr", qr)
+            inserted = self.server.db.insert_raw_qrs(qr)
+            inserted_codes = {document["data"] for document in inserted}
+            for document in qr:
+                if document["data"] not in inserted_codes:
+                    log.warning(f"Duplicate QR code not uploaded\t{document['data']}")
+        return inserted
+
+    def check_streamed_qr_code(self, qr_code: str) -> bool:
+        """Checks a QR code as soon as it's scanned, returns whether it should be uploaded
+
+        Only the start character and schema version are checked, the Decompressor decompresses the
+        QR after it's uploaded. QRs from another schema version are still uploaded, like QRs that
+        aren't streamed, but are reported right away so they can be scanned again.
+        """
+        if not self.is_valid_qr_code(qr_code):
+            log.warning(f'Invalid QR code not uploaded: "{qr_code}"')
+            return False
+        generic_schema = self.schema["generic_data"]
+        # The generic data is the first section, after the start character
+        generic_data = qr_code[1:].split(generic_schema["_section_separator"])[0]
+        version_name = generic_schema["schema_version"][0]
+        versions = [
+            entry[len(version_name) :]
+            for entry in generic_data.split(generic_schema["_separator"])
+            if entry.startswith(version_name)
+        ]
+        if versions != [str(self.schema["schema_file"]["version"])]:
+            log.warning(
+                f"QR code schema version doesn't match the server "
+                f'(v{self.schema["schema_file"]["version"]}):\t{qr_code}'
+            )
+        return True
+
+    def stream_qr_codes(self, lines: Iterable[str]) -> int:
+        """Uploads QR codes from `lines`, such as a scanner on stdin, as they are read
+
+        Each QR is checked when it's read (see check_streamed_qr_code). QRs are inserted every
+        STREAM_BATCH_SIZE QRs, or STREAM_BATCH_SECONDS after the first QR of a batch, so in daemon
+        mode the Decompressor runs on each batch while more QRs are being scanned. Returns the
+        number of QRs inserted once `lines` ends.
+        """
+        lines_queue = queue.Queue()
+
+        def read_lines():
+            try:
+                for line in lines:
+                    lines_queue.put(line)
+            finally:
+                # Marks the end of the lines
+                lines_queue.put(None)
+
+        threading.Thread(target=read_lines, name="qr-input-reader", daemon=True).start()
+        batch = []
+        batch_start_time = 0.0
+        num_inserted = 0
+        finished = False
+        while not finished:
+            timeout = None
+            if batch:
+                timeout = max(0, batch_start_time + self.STREAM_BATCH_SECONDS - time.monotonic())
+            try:
+                line = lines_queue.get(timeout=timeout)
+            except queue.Empty:
+                line = ""
+            if line is None:
+                finished = True
+            elif (qr_code := line.strip()) and self.check_streamed_qr_code(qr_code):
+                if not batch:
+                    batch_start_time = time.monotonic()
+                batch.append(qr_code)
+            if batch and (
+                finished
+                or len(batch) >= self.STREAM_BATCH_SIZE
+                or time.monotonic() - batch_start_time >= self.STREAM_BATCH_SECONDS
+            ):
+                num_inserted += len(self.upload_qr_codes(batch))
+                batch = []
+        return num_inserted
 
     def run(self, test_input=None):
-        """Grabs QR codes from user using stdin.read(), each qr is separated by a newline"""
+        """Grabs QR codes from user using stdin.read(), each qr is separated by a newline
+
+        To upload QRs as they are scanned instead of after CTRL+D, run the server with
+        --stream-qrs (see stream_qr_codes).
+        """
         # Get calc start time
         start_time = time.time()
 
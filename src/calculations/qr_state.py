@@ -58,3 +58,51 @@ class QRState:
         # Sort timeline_fields by the position they appear in
         timeline_fields.sort(key=lambda x: x["position"])
         return timeline_fields
+
+    @staticmethod
+    def get_decompressed_names():
+        """Maps the compressed names in each section of the schema to their variable names.
+
+        Compressed names are the first item of list entries, or the whole entry otherwise. If
+        entries share a compressed name, the first one is used, the same as searching in order.
+        """
+        decompressed_names = {}
+        for section, entries in SCHEMA.items():
+            if not isinstance(entries, dict):
+                continue
+            section_names = decompressed_names[section] = {}
+            for name, value in entries.items():
+                if isinstance(value, list):
+                    if not value:
+                        continue
+                    value = value[0]
+                if isinstance(value, (dict, list)):
+                    continue
+                section_names.setdefault(value, name)
+        return decompressed_names
+
+    @staticmethod
+    def get_data_field_types(section):
+        """Maps the compressed names of the data fields in a section to their variable name and
+        data type. The data type is a list if there is more than one item after the compressed name.
+        """
+        data_field_types = {}
+        for compressed_name, name in QRState.get_decompressed_names()[section].items():
+            value = SCHEMA[section][name]
+            if isinstance(value, list) and len(value) > 1:
+                type_ = value[1:]
+                data_field_types[compressed_name] = (name, type_ if len(type_) > 1 else type_[0])
+        return data_field_types
+
+    @staticmethod
+    def get_timeline_slices():
+        """Returns the name, start index, end index and type of each field in a timeline action,
+        in the order they appear, and the length of one action."""
+        timeline_slices = []
+        position = 0
+        for field in QRState.get_timeline_info():
+            timeline_slices.append(
+                (field["name"], position, position + field["length"], field["type"])
+            )
+            position += field["length"]
+        return timeline_slices, position
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""Decodes QRs for the Decompressor in worker processes that only import qr_decoder.
+
+The workers are started with `python -m calculations.qr_worker` instead of with multiprocessing,
+which would import the server's main script (and the database) again in each worker. Batches of
+raw_qr documents are pickled to a worker's stdin and their results are pickled back on its stdout.
+"""
+
+import contextlib
+import os
+import pickle
+import subprocess
+import sys
+import threading
+from typing import List
+
+# Workers run from src/, so 'calculations' can be imported
+SRC_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class QRWorkerPool:
+    """Worker processes that decode batches of raw_qr documents, started once and kept running
+
+    Workers exit when the pool is closed, or when the process that started them exits.
+    """
+
+    def __init__(self):
+        self.workers: List[subprocess.Popen] = []
+        # A batch and its results must not be interleaved with another thread's
+        self.lock = threading.Lock()
+
+    def start(self, processes: int) -> None:
+        """Starts workers until there are at least `processes` of them"""
+        while len(self.workers) < processes:
+            self.workers.append(
+                subprocess.Popen(
+                    [sys.executable, "-m", "calculations.qr_worker"],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    cwd=SRC_DIRECTORY,
+                )
+            )
+
+    def close(self) -> None:
+        """Stops the workers, they are started again if the pool is used"""
+        with self.lock:
+            self._close()
+
+    def _close(self) -> None:
+        for worker in self.workers:
+            # Workers exit once there are no more batches to read
+            with contextlib.suppress(OSError):
+                worker.stdin.close()
+            worker.wait()
+            worker.stdout.close()
+        self.workers = []
+
+    def decompress_qr_batches(self, batches: List[List[dict]]) -> List[List[dict]]:
+        """Decompresses each batch in its own worker, returning the results of each batch"""
+        with self.lock:
+            self.start(len(batches))
+            workers = self.workers[: len(batches)]
+            try:
+                # Each worker reads its whole batch before writing results, so all of the batches
+                # are sent before any results are read
+                for worker, batch in zip(workers, batches):
+                    pickle.dump(batch, worker.stdin, pickle.HIGHEST_PROTOCOL)
+                    worker.stdin.flush()
+                return [pickle.load(worker.stdout) for worker in workers]
+            except (OSError, EOFError, pickle.UnpicklingError):
+                # A worker stopped, so start new workers next time
+                for worker in self.workers:
+                    worker.kill()
+                self._close()
+                raise
+
+
+def main() -> None:
+    """Decompresses batches of raw_qr documents from stdin until it is closed"""
+    # Results are pickled to stdout, so anything else that's printed goes to stderr instead
+    results = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    from calculations import qr_decoder
+
+    while True:
+        try:
+            batch = pickle.load(sys.stdin.buffer)
+        except EOFError:
+            return
+        pickle.dump(qr_decoder.decompress_qr_batch(batch), results, pickle.HIGHEST_PROTOCOL)
+        results.flush()
+
+
+if __name__ == "__main__":
+    main()
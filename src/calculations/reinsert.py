@@ -17,6 +17,8 @@ class ReinsertCalc(base_calculations.BaseCalculations):
     def __init__(self, server):
         super().__init__(server)
         self.collections = ["raw_obj_pit", "ss_team", "ss_tim", "raw_qr"]
+        self.extra_read_collections = self.collections
+        self.output_collections = self.collections
 
     def run(self):
         for collection in self.collections:
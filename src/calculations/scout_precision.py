@@ -18,12 +18,14 @@ class ScoutPrecisionCalc(BaseCalculations):
     def __init__(self, server):
         super().__init__(server)
         self.watched_collections = ["unconsolidated_totals"]
+        self.extra_read_collections = ["sim_precision"]
+        self.output_collections = ["scout_precision"]
         self.overall_schema = utils.read_schema("schema/calc_scout_precision_schema.yml")
 
     def find_updated_scouts(self):
         """Returns a list of scout names that appear in entries_since_last"""
         scouts = set()
-        for entry in self.entries_since_last():
+        for entry in self.entries_since_last(["scout_name"]):
             # Prevents error from not having a team num
             if "scout_name" in entry["o"].keys():
                 scouts.add(entry["o"]["scout_name"])
@@ -31,7 +33,9 @@ class ScoutPrecisionCalc(BaseCalculations):
             elif entry["op"] == "u":
                 document_id = entry["o2"]["_id"]
                 if (
-                    query := self.server.db.find(entry["ns"].split(".")[-1], {"_id": document_id})
+                    query := self.server.db.find(
+                        entry["ns"].split(".")[-1], {"_id": document_id}, ["scout_name"]
+                    )
                 ) and "scout_name" in query[0].keys():
                     scouts.add(query[0]["scout_name"])
         return list(scouts)
@@ -84,7 +88,14 @@ class ScoutPrecisionCalc(BaseCalculations):
         """Creates overall precision updates."""
         updates = []
         for scout in scouts:
-            scout_sims = self.server.db.find("sim_precision", {"scout_name": scout})
+            scout_sims = self.server.db.find(
+                "sim_precision",
+                {"scout_name": scout},
+                [
+                    schema["requires"].split(".")[1]
+                    for schema in self.overall_schema["calculations"].values()
+                ],
+            )
             update = {}
             update["scout_name"] = scout
             if (scout_precision := self.calc_scout_precision(scout_sims)) != {}:
@@ -98,12 +109,10 @@ class ScoutPrecisionCalc(BaseCalculations):
         start_time = time.time()
         scouts = self.find_updated_scouts()
 
-        if self.calc_all_data:
-            self.server.db.delete_data("scout_precision")
-
-        for update in self.update_scout_precision_calcs(scouts):
-            self.server.db.update_document(
-                "scout_precision", update, {"scout_name": update["scout_name"]}
+        # Replace the old data at once if updating all data
+        with self.replace_outputs("scout_precision"):
+            self.server.db.bulk_upsert(
+                "scout_precision", self.update_scout_precision_calcs(scouts), ["scout_name"]
             )
         end_time = time.time()
         # Get total calc time
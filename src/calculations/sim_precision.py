@@ -1,7 +1,7 @@
 from datetime import datetime
 
 from calculations.base_calculations import BaseCalculations
-from data_transfer import tba_communicator
+from calculations.event_matches import EventMatches
 import utils
 import time
 import logging
@@ -16,6 +16,7 @@ class SimPrecisionCalc(BaseCalculations):
     def __init__(self, server):
         super().__init__(server)
         self.watched_collections = ["unconsolidated_totals"]
+        self.output_collections = ["sim_precision"]
         self.sim_schema = utils.read_schema("schema/calc_sim_precision_schema.yml")
 
     def get_scout_tim_score(
@@ -25,7 +26,9 @@ class SimPrecisionCalc(BaseCalculations):
         required is the dictionary of required datapoints: {weight: value, calculation: [calculations]} from schema
         """
         scout_data = self.server.db.find(
-            "unconsolidated_totals", {"match_number": match_number, "scout_name": scout}
+            "unconsolidated_totals",
+            {"match_number": match_number, "scout_name": scout},
+            [datapoint.split(".")[1] for datapoint in required],
         )
 
         if scout_data == []:
@@ -63,6 +66,7 @@ class SimPrecisionCalc(BaseCalculations):
                 "match_number": match_number,
                 "alliance_color_is_red": alliance_color_is_red,
             },
+            ["team_number", "scout_name"],
         )
         teams = set([document["team_number"] for document in scout_data])
         # Populate dictionary with teams in alliance
@@ -114,7 +118,7 @@ class SimPrecisionCalc(BaseCalculations):
 
     def get_tba_value(
         self,
-        tba_match_data: List[dict],
+        event_matches: EventMatches,
         tba_points: List,
         match_number: int,
         alliance_color_is_red: bool,
@@ -122,12 +126,10 @@ class SimPrecisionCalc(BaseCalculations):
         """Get the total value for the required datapoints caclculated using tba match data"""
         alliance_color = ["blue", "red"][int(alliance_color_is_red)]
 
-        for match in tba_match_data:
-            if match["match_number"] == match_number and match["comp_level"] == "qm":
-                tba_match_data = match["score_breakdown"][alliance_color]
+        score_breakdown = event_matches.get_match(match_number)["score_breakdown"][alliance_color]
         total = 0
         for datapoint in tba_points:
-            total += tba_match_data[datapoint]
+            total += score_breakdown[datapoint]
 
         return total
 
@@ -187,20 +189,11 @@ class SimPrecisionCalc(BaseCalculations):
 
     def update_sim_precision_calcs(self, unconsolidated_sims):
         """Creates scout-in-match precision updates"""
-        tba_match_data: List[dict] = tba_communicator.tba_request(
-            f"event/{utils.TBA_EVENT_KEY}/matches"
-        )
+        event_matches = self.server.get_event_matches()
         # When we're running server at competition, we have to wait until TBA updates
         # match data, so we get the latest TBA match and our latest match
         latest_match = max([s["match_number"] for s in unconsolidated_sims] + [0])
-        latest_tba_match = max(
-            [
-                t["match_number"]
-                for t in tba_match_data
-                if t["score_breakdown"] is not None and t["comp_level"] == "qm"
-            ]
-            + [0]
-        )
+        latest_tba_match = event_matches.get_latest_match_number()
         updates = []
         # Create dicts for shared data between scouts
         tba_aim_scores = {}
@@ -219,11 +212,11 @@ class SimPrecisionCalc(BaseCalculations):
 
                 # Get the scores from TBA
                 red_tba_aim_score = self.get_tba_value(
-                    tba_match_data, tba_points, match_number, True
+                    event_matches, tba_points, match_number, True
                 )
 
                 blue_tba_aim_score = self.get_tba_value(
-                    tba_match_data, tba_points, match_number, False
+                    event_matches, tba_points, match_number, False
                 )
 
                 # Get the scores of all scouts in a match
@@ -275,16 +268,11 @@ class SimPrecisionCalc(BaseCalculations):
                 "team_number": sim_data["team_number"],
                 "alliance_color_is_red": sim_data["alliance_color_is_red"],
             }
-            for match in tba_match_data:
-                if (
-                    match["match_number"] == sim_data["match_number"]
-                    and match["comp_level"] == "qm"
-                ):
-                    # Convert match timestamp from Unix time (on TBA) to human-readable
-                    update["timestamp"] = datetime.fromtimestamp(match["actual_time"])
-                    break
-            else:
+            match = event_matches.get_match(sim_data["match_number"])
+            if match is None:
                 continue
+            # Convert match timestamp from Unix time (on TBA) to human-readable
+            update["timestamp"] = datetime.fromtimestamp(match["actual_time"])
             if (
                 sim_precision := self.calc_sim_precision(
                     sim_data, aim_match_errors, aim_match_reported_values, tba_aim_scores
@@ -298,7 +286,7 @@ class SimPrecisionCalc(BaseCalculations):
 
         # Get calc start time
         start_time = time.time()
-        entries = self.entries_since_last()
+        entries = self.entries_since_last(["scout_name", "match_number"])
         sims = []
         for entry in entries:
             sims.append(
@@ -307,19 +295,12 @@ class SimPrecisionCalc(BaseCalculations):
                     "match_number": entry["o"]["match_number"],
                 }
             )
-        # Delete and re-insert if updating all data
-        if self.calc_all_data:
-            self.server.db.delete_data("sim_precision")
-
-        for update in self.update_sim_precision_calcs(sims):
-            self.server.db.update_document(
+        # Replace the old data at once if updating all data
+        with self.replace_outputs("sim_precision"):
+            self.server.db.bulk_upsert(
                 "sim_precision",
-                update,
-                {
-                    "scout_name": update["scout_name"],
-                    "match_number": update["match_number"],
-                    "alliance_color_is_red": update["alliance_color_is_red"],
-                },
+                self.update_sim_precision_calcs(sims),
+                ["scout_name", "match_number", "alliance_color_is_red"],
             )
         end_time = time.time()
         # Get total calc time
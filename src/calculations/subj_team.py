@@ -21,23 +21,31 @@ class SubjTeamCalcs(base_calculations.BaseCalculations):
         """Overrides watched collections, passes server object"""
         super().__init__(server)
         self.watched_collections = ["subj_tim"]
+        self.extra_read_collections = ["subj_team"]
+        self.output_collections = ["subj_team"]
         self.teams_that_have_competed = set()
+        # Built from one subj_tim scan each cycle, or when teams_played_with is first called
+        self.partner_graph = None
+
+    def get_partner_graph(self) -> "partner_graph.PartnerGraph":
+        """Scans subj_tim once and returns which teams each team has played with"""
+        # Imported here so numpy is only loaded when the partner graph is built, not at server
+        # startup
+        from calculations.partner_graph import PartnerGraph
+
+        return PartnerGraph(
+            self.server.db.find_iter(
+                "subj_tim",
+                projection=["team_number", "match_number", "alliance_color_is_red"],
+            )
+        )
 
     def teams_played_with(self, team: str) -> List[str]:
         """Returns a list of teams that the given team has played with so far, including themselves
         and including repeats"""
-        partners = []
-        # matches_played is a dictionary where keys are match numbers and values represent alliance color
-        matches_played = {}
-        for tim in self.server.db.find("subj_tim", {"team_number": team}):
-            matches_played.update({tim["match_number"]: tim["alliance_color_is_red"]})
-        for match_num, alliance_color in matches_played.items():
-            # Find subj_tim data for robots in the same match and alliance as the team
-            alliance_data = self.server.db.find(
-                "subj_tim", {"match_number": match_num, "alliance_color_is_red": alliance_color}
-            )
-            partners.extend([tim["team_number"] for tim in alliance_data])
-        return partners
+        if self.partner_graph is None:
+            self.partner_graph = self.get_partner_graph()
+        return self.partner_graph.get_partners(team)
 
     def unadjusted_ability_calcs(self, team: str) -> Dict[str, float]:
         """Retrieves subjective AIM info for the given team and returns a dictionary with
@@ -58,7 +66,7 @@ class SubjTeamCalcs(base_calculations.BaseCalculations):
             team_rankings = []
             ignore_filter = lambda data: not ("ignore" in calc_info and data in calc_info["ignore"])
             is_list = calc_info["type"] == "List"
-            for tim in self.server.db.find(collection_name, {"team_number": team}):
+            for tim in self.server.db.find(collection_name, {"team_number": team}, [ranking_name]):
                 tim_value = tim[ranking_name]
                 if is_list:
                     team_rankings.append(tim_value)
@@ -92,7 +100,7 @@ class SubjTeamCalcs(base_calculations.BaseCalculations):
             # scores is a dictionary of team numbers to rank score
             scores = {}
             for team in self.teams_that_have_competed:
-                tim = self.server.db.find(collection_name, {"team_number": team})
+                tim = self.server.db.find(collection_name, {"team_number": team}, [unadjusted_calc])
                 if tim:
                     scores[team] = tim[0][unadjusted_calc]
             # Now scale the scores so they range from 0 to 1, and use those scaled scores to
@@ -127,18 +135,20 @@ class SubjTeamCalcs(base_calculations.BaseCalculations):
             team: (((score - worst) / (best - worst)) if best - worst != 0 else 0)
             for team, score in scores.items()
         }
+        if self.partner_graph is None:
+            self.partner_graph = self.get_partner_graph()
+        # Average scaled score of each team's partners, for all teams at once
+        teammate_averages = self.partner_graph.average_partner_values(scaled_scores)
         for team, score in scores.items():
-            teammate_scaled_scores = [
-                scaled_scores[partner] for partner in self.teams_played_with(team)
-            ]
             calculations[team] = calculations.get(team, {})
+            teammate_average = teammate_averages.get(team, 0)
             # If teammates tend to rank low, the team's score is lowered more than if teammates tend to rank high
             if index is None:
-                calculations[team][calc_name] = score * self.avg(teammate_scaled_scores)
+                calculations[team][calc_name] = score * teammate_average
             elif index == 0:
-                calculations[team][calc_name] = [score * self.avg(teammate_scaled_scores)]
+                calculations[team][calc_name] = [score * teammate_average]
             else:
-                calculations[team][calc_name].append(score * self.avg(teammate_scaled_scores))
+                calculations[team][calc_name].append(score * teammate_average)
 
     def calculate_driver_ability(self):
         """Takes a weighted average of all the adjusted component scores to calculate overall driver ability."""
@@ -154,9 +164,10 @@ class SubjTeamCalcs(base_calculations.BaseCalculations):
                 scores = []
                 for requirement in calc_info["requires"]:
                     collection_name, _, score_name = requirement.partition(".")
-                    scores.append(
-                        self.server.db.find(collection_name, {"team_number": team})[0][score_name]
-                    )
+                    document = self.server.db.find(
+                        collection_name, {"team_number": team}, [score_name]
+                    )[0]
+                    scores.append(document[score_name])
                 # driver_ability is a weighted average of its component scores
                 ability_dict[team] = self.avg(scores, calc_info["weights"])
             # Put the driver abilities of all teams in a list
@@ -181,31 +192,38 @@ class SubjTeamCalcs(base_calculations.BaseCalculations):
         start_time = time.time()
         # Adjusted calcs have to be re-run on all teams that have competed
         # because team data changing for one team affects all teams that played with that team
-        self.teams_that_have_competed = set()
-        for tim in self.server.db.find("subj_tim"):
-            self.teams_that_have_competed.add(tim["team_number"])
-        # Delete and re-insert if updating all data
-        if self.calc_all_data:
-            self.server.db.delete_data("subj_team")
-        # See which teams are affected by new subj TIM data
-        updated_teams = self.get_updated_teams()
-        for team in updated_teams:
-            new_calc = self.unadjusted_ability_calcs(team)
-            self.server.db.update_document(
-                "subj_team", new_calc, {"team_number": new_calc["team_number"]}
+        # One subj_tim scan finds the teams and who they played with for this cycle
+        self.partner_graph = self.get_partner_graph()
+        self.teams_that_have_competed = set(self.partner_graph.teams)
+        # Replace the old data at once if updating all data
+        with self.replace_outputs("subj_team"):
+            # See which teams are affected by new subj TIM data
+            updated_teams = self.get_updated_teams()
+            self.server.db.bulk_upsert(
+                "subj_team",
+                [self.unadjusted_ability_calcs(team) for team in updated_teams],
+                ["team_number"],
             )
-        if len(self.teams_that_have_competed) != 0:
-            # Now use the new info to recalculate adjusted ability scores
-            adjusted_calcs = self.adjusted_ability_calcs()
-            for team in self.teams_that_have_competed:
-                self.server.db.update_document(
-                    "subj_team", adjusted_calcs[team], {"team_number": team}
+            if len(self.teams_that_have_competed) != 0:
+                # Now use the new info to recalculate adjusted ability scores
+                adjusted_calcs = self.adjusted_ability_calcs()
+                self.server.db.bulk_upsert(
+                    "subj_team",
+                    [
+                        {**adjusted_calcs[team], "team_number": team}
+                        for team in self.teams_that_have_competed
+                    ],
+                    ["team_number"],
                 )
-            # Use the adjusted ability scores to calculate driver ability
-            driver_ability_calcs = self.calculate_driver_ability()
-            for team in self.teams_that_have_competed:
-                self.server.db.update_document(
-                    "subj_team", driver_ability_calcs[team], {"team_number": team}
+                # Use the adjusted ability scores to calculate driver ability
+                driver_ability_calcs = self.calculate_driver_ability()
+                self.server.db.bulk_upsert(
+                    "subj_team",
+                    [
+                        {**driver_ability_calcs[team], "team_number": team}
+                        for team in self.teams_that_have_competed
+                    ],
+                    ["team_number"],
                 )
         end_time = time.time()
         # Get total calc time
@@ -2,14 +2,11 @@
 
 """Runs team calculations dependent on TBA data"""
 
-from typing import Dict, List
+from typing import Dict, List, Optional
 from calculations import base_calculations
 import utils
 from server import Server
 from data_transfer import tba_communicator
-import numpy as np
-import numpy.linalg as nl
-from cc import cc, CCEvent
 import logging
 import time
 
@@ -23,11 +20,26 @@ class TBATeamCalc(base_calculations.BaseCalculations):
 
     # Get the last section of each entry (so foo.bar.baz becomes baz)
     SCHEMA = utils.unprefix_schema_dict(utils.read_schema("schema/calc_tba_team_schema.yml"))
+    # Calculated contributions to score_breakdown fields, such as:
+    #   teleop_note_cc: {score_breakdown: teleopNotePoints}
+    #   foul_cc: {score_breakdown: foulPoints, alliance: opponent}
+    #   recent_auto_cc: {score_breakdown: autoPoints, half_life: 8}
+    # 'score_breakdown' is a path in an alliance's score breakdown, with nested fields separated by
+    # dots. 'alliance: opponent' credits the field to the other alliance, and 'half_life' is the
+    # number of matches it takes for a match's weight to halve. Only foul_cc is calculated if the
+    # schema doesn't have a ccs section.
+    CCS = SCHEMA.get("ccs", {"foul_cc": {"score_breakdown": "foulPoints", "alliance": "opponent"}})
 
     def __init__(self, server):
         """Overrides watched collections, passes server object"""
         super().__init__(server)
         self.watched_collections = ["obj_tim", "tba_tim"]
+        self.extra_read_collections = ["tba_team"]
+        self.output_collections = ["tba_team"]
+        # CC engine for the alliances in the TBA matches, kept between cycles so only new matches
+        # are added to it
+        self.cc_engine = None
+        self.cc_alliances = []
 
     def tim_counts(self, obj_tims, tba_tims):
         """Gets the counts for each schema entry for the given tims"""
@@ -79,13 +91,14 @@ class TBATeamCalc(base_calculations.BaseCalculations):
             out["leave_success_rate"] = out["leave_successes"] / (match_count)
         return out
 
-    def calculate_cc(self, cc_type, precision: int = 2) -> Dict[str, float]:
+    def calculate_ccs(self) -> Dict[str, Dict[str, float]]:
         """
-        Calculates the amount of foul/link points each team contributes.
+        Calculates the amount of each CC schema field that each team contributes.
 
         Calculated contribution (a.k.a. OPR) is a method of estimating the amount of something a team contributes to an alliance.
 
-        It uses a numpy matrix and calculates a least squares solution for each team.
+        It calculates a least squares solution for each team with a CC engine that is kept between
+        cycles, see get_cc_engine. Every CC with the same half life is solved in one batch.
 
         See Also
         ---------
@@ -95,28 +108,84 @@ class TBATeamCalc(base_calculations.BaseCalculations):
         matches_resp = self.server.db.get_tba_cache(matches_endpoint)
         if matches_resp is None:
             matches_resp = {"data": tba_communicator.tba_request(matches_endpoint)}
-        tba_matches = matches_resp.get("data", [])
-        cc_aims: List[CCEvent] = []
-        if cc_type == "foul":
-            # For each AIM, add the foul points for the other alliance in a dictionary
-            # with the team numbers and foul points contributed
-            for match in tba_matches:
-                if match.get("score_breakdown", None) is None:
-                    continue
-                cc_aims.append(
-                    {
-                        "parties": utils.get_teams_in_match(match, "red"),
-                        "value": match["score_breakdown"]["blue"]["foulPoints"],
-                    }
-                )
-                cc_aims.append(
-                    {
-                        "parties": utils.get_teams_in_match(match, "blue"),
-                        "value": match["score_breakdown"]["red"]["foulPoints"],
-                    }
-                )
-        solved = cc(cc_aims)
-        return solved
+        tba_matches = [
+            match
+            for match in matches_resp.get("data", [])
+            if match.get("score_breakdown", None) is not None
+        ]
+        engine = self.get_cc_engine(tba_matches)
+        # Half life to the value vectors of the CCs with that half life
+        value_vectors: Dict[Optional[float], Dict[str, List[float]]] = {}
+        for name, cc_info in self.CCS.items():
+            try:
+                values = self.get_cc_values(tba_matches, cc_info)
+            except (KeyError, TypeError):
+                log.warning(f"{name}: score breakdown has no {cc_info['score_breakdown']}")
+                continue
+            value_vectors.setdefault(cc_info.get("half_life"), {})[name] = values
+        ccs = {}
+        for half_life, vectors in value_vectors.items():
+            weights = None
+            if half_life is not None:
+                # Both alliances in a match have the match's weight
+                weights = [
+                    0.5 ** (age / half_life)
+                    for age in self.get_match_ages(tba_matches)
+                    for _ in range(2)
+                ]
+            ccs.update(engine.solve_many(vectors, weights=weights))
+        return ccs
+
+    @staticmethod
+    def get_cc_values(tba_matches: List[dict], cc_info: dict) -> List[float]:
+        """Returns the value of a CC schema entry for the red and then blue alliance of each match"""
+        values = []
+        for match in tba_matches:
+            for color, opponent in [("red", "blue"), ("blue", "red")]:
+                breakdown = match["score_breakdown"][
+                    opponent if cc_info.get("alliance") == "opponent" else color
+                ]
+                for field in cc_info["score_breakdown"].split("."):
+                    breakdown = breakdown[field]
+                values.append(breakdown)
+        return values
+
+    @staticmethod
+    def get_match_ages(tba_matches: List[dict]) -> List[int]:
+        """Returns how many matches were played after each match, for time decayed CCs
+
+        Matches are ordered by when they were played, or by their order in 'tba_matches' if TBA
+        doesn't have the time.
+        """
+        order = sorted(
+            range(len(tba_matches)),
+            key=lambda index: (tba_matches[index].get("actual_time") or 0, index),
+        )
+        ages = [0] * len(tba_matches)
+        for rank, index in enumerate(order):
+            ages[index] = len(tba_matches) - 1 - rank
+        return ages
+
+    def get_cc_engine(self, tba_matches: List[dict]):
+        """Returns a CC engine with an event for the red and then blue alliance of each match
+
+        If the matches are the ones from the last cycle with new matches after them, the new
+        alliances are appended to the last cycle's engine instead of building a new one.
+        """
+        # Imported here so numpy is only loaded when CCs are calculated, not at server startup
+        from cc import CCEngine
+
+        alliances = []
+        for match in tba_matches:
+            alliances.append(tuple(utils.get_teams_in_match(match, "red")))
+            alliances.append(tuple(utils.get_teams_in_match(match, "blue")))
+        if self.cc_engine is None or alliances[: len(self.cc_alliances)] != self.cc_alliances:
+            self.cc_engine = CCEngine()
+            self.cc_alliances = []
+        for alliance in alliances[len(self.cc_alliances) :]:
+            self.cc_engine.add_event(alliance)
+        self.cc_alliances = alliances
+        return self.cc_engine
 
     def update_team_calcs(self, teams: list) -> list:
         """Returns updates to team calculations based on refs"""
@@ -130,8 +199,7 @@ class TBATeamCalc(base_calculations.BaseCalculations):
 
         tba_team_updates = {}
 
-        foul_ccs = self.calculate_cc(cc_type="foul")
-        link_ccs = self.calculate_cc(cc_type="link")
+        ccs = self.calculate_ccs()
         for team in teams:
             # Load team data from database
             obj_tims = self.server.db.find("obj_tim", {"team_number": team})
@@ -139,18 +207,17 @@ class TBATeamCalc(base_calculations.BaseCalculations):
             # Because of database structure, returns as a list
             team_data = self.tim_counts(obj_tims, tba_tims)
             team_data["team_number"] = team
-            # Add foul_cc and link cc
-            if team in foul_ccs:
-                team_data["foul_cc"] = foul_ccs[team]
-            if team in link_ccs:
-                team_data["link_cc"] = link_ccs[team]
+            # Add CCs, such as foul_cc
+            for name, team_ccs in ccs.items():
+                if team in team_ccs:
+                    team_data[name] = team_ccs[team]
             # Load team names
             if team in team_names:
                 team_data["team_name"] = team_names[team]
             else:
                 # Set team name to "UNKNOWN NAME" if the team is not already in the database
                 # If the team is, it is assumed that the name in the database will be more accurate
-                if not self.server.db.find("tba_team", {"team_number": team}):
+                if not self.server.db.find("tba_team", {"team_number": team}, ["team_number"]):
                     team_data["team_name"] = "UNKNOWN NAME"
                 # Warn that the team is not in the team list for event if there is team data
                 if team_names:
@@ -165,12 +232,10 @@ class TBATeamCalc(base_calculations.BaseCalculations):
         """Executes the TBA Team calculations"""
         # Get calc start time
         start_time = time.time()
-        # Delete and re-insert if updating all data
-        if self.calc_all_data:
-            self.server.db.delete_data("tba_team")
-        for update in self.update_team_calcs(self.get_updated_teams()):
-            self.server.db.update_document(
-                "tba_team", update, {"team_number": update["team_number"]}
+        # Replace the old data at once if updating all data
+        with self.replace_outputs("tba_team"):
+            self.server.db.bulk_upsert(
+                "tba_team", self.update_team_calcs(self.get_updated_teams()), ["team_number"]
             )
         end_time = time.time()
         # Get total calc time
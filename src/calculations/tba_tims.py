@@ -25,7 +25,16 @@ class TBATIMCalc(base_calculations.BaseCalculations):
     def __init__(self, server):
         """Creates an empty list to add references of calculated tims to"""
         super().__init__(server)
-        self.calculated = set([tim["match_number"] for tim in self.server.db.find("tba_tim")])
+        self.calculated = set(
+            [
+                tim["match_number"]
+                for tim in self.server.db.find("tba_tim", projection=["match_number"])
+            ]
+        )
+        # New matches come from TBA instead of the oplog, so there are no watched collections
+        self.watched_collections = []
+        self.extra_read_collections = ["tba_tim"]
+        self.output_collections = ["tba_tim"]
 
     def entries_since_last(self) -> List[Dict[str, Any]]:
         """Checks for uncalculated matches, returns the match data
@@ -227,30 +236,23 @@ class TBATIMCalc(base_calculations.BaseCalculations):
         # reference is not in the self.calculated
         entries = self.entries_since_last()
 
-        # Delete and re-insert if updating all data
-        if self.calc_all_data:
-            self.server.db.delete_data("tba_tim")
-
-        for match in entries:
-            for team_number in self.get_team_list_from_match(match):
-                # Calculate the tim, getting the team and match from entry
-                calculated_tim = self.calculate_tim(team_number, match)
-
-                # Ensure we don't write results from a calculation that errorred
-                if calculated_tim is None:
-                    continue
-
-                # Add the tim ref to calculated, right after it gets calculated
-                self.calculated.add(match["match_number"])
-
-                self.server.db.update_document(
-                    "tba_tim",
-                    calculated_tim,
-                    {
-                        "match_number": calculated_tim["match_number"],
-                        "team_number": calculated_tim["team_number"],
-                    },
-                )
+        # Replace the old data at once if updating all data
+        with self.replace_outputs("tba_tim"):
+            calculated_tims = []
+            for match in entries:
+                for team_number in self.get_team_list_from_match(match):
+                    # Calculate the tim, getting the team and match from entry
+                    calculated_tim = self.calculate_tim(team_number, match)
+
+                    # Ensure we don't write results from a calculation that errorred
+                    if calculated_tim is None:
+                        continue
+
+                    # Add the tim ref to calculated, right after it gets calculated
+                    self.calculated.add(match["match_number"])
+                    calculated_tims.append(calculated_tim)
+
+            self.server.db.bulk_upsert("tba_tim", calculated_tims, ["match_number", "team_number"])
         end_time = time.time()
         # Get total calc time
         total_time = end_time - start_time
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+"""Indexes the actions in a TIM timeline so they can be filtered without walking the timeline."""
+
+import bisect
+import collections
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+class TimelineIndex:
+    """Buckets the actions in a timeline by action_type and in_teleop.
+
+    Each bucket keeps the positions of its actions in the timeline, in order, and the times of its
+    actions sorted for time range queries. Filtering returns the same actions, in the same order,
+    as walking the timeline and checking each action.
+    """
+
+    def __init__(self, timeline: List[dict]):
+        self.timeline = timeline
+        # Number of actions indexed, to check if actions were added to the timeline later
+        self.size = len(timeline)
+        # action_type to in_teleop to the positions of those actions in the timeline
+        self.buckets: Dict[Any, Dict[Any, List[int]]] = collections.defaultdict(
+            lambda: collections.defaultdict(list)
+        )
+        for position, action in enumerate(timeline):
+            self.buckets[action.get("action_type")][action.get("in_teleop")].append(position)
+        # (action_type, in_teleop), or None for every action, to the sorted times and positions of
+        # the actions in that bucket
+        self.sorted_times: Dict[Optional[tuple], Tuple[List[Any], List[int]]] = {}
+
+    def get_buckets(
+        self, action_types: Sequence[Any], in_teleop: Optional[Sequence[Any]] = None
+    ) -> List[tuple]:
+        """Returns the (action_type, in_teleop) keys of the buckets for 'action_types'
+
+        'in_teleop' is a one item list with the in_teleop value of the buckets, or None to use
+        buckets from both teleop and auto.
+        """
+        keys = []
+        for action_type in action_types:
+            for teleop in self.buckets.get(action_type, {}):
+                if in_teleop is None or teleop == in_teleop[0]:
+                    keys.append((action_type, teleop))
+        return keys
+
+    def get_positions(self, key: Optional[tuple]) -> List[int]:
+        """Returns the positions of the actions in a bucket, or every action if 'key' is None"""
+        if key is None:
+            return list(range(self.size))
+        return self.buckets[key[0]][key[1]]
+
+    def get_positions_in_time_range(self, key: Optional[tuple], start: Any, end: Any) -> List[int]:
+        """Returns the positions of the actions in a bucket, or every action if 'key' is None, with
+        times in [start, end]"""
+        if key not in self.sorted_times:
+            times = sorted(
+                (self.timeline[position]["time"], position) for position in self.get_positions(key)
+            )
+            self.sorted_times[key] = ([time for time, _ in times], [pos for _, pos in times])
+        times, positions = self.sorted_times[key]
+        return positions[bisect.bisect_left(times, start) : bisect.bisect_right(times, end)]
+
+    def filter(self, substring_values: Sequence[str] = (), **filters) -> List[dict]:
+        """Returns the actions that meet all of the filters, in timeline order
+
+        Each filter is a field and the value it must have, except for "time", which is a closed
+        interval such as [0, 134]. Values in 'substring_values' match any value that contains them,
+        such as "score" matching "score_amp".
+        """
+        filters = dict(filters)
+        # Substring matches on in_teleop are checked against each action below
+        if "in_teleop" in filters and filters["in_teleop"] not in substring_values:
+            in_teleop = [filters.pop("in_teleop")]
+        else:
+            in_teleop = None
+        if "action_type" in filters:
+            action_type = filters.pop("action_type")
+            if action_type in substring_values:
+                action_types = [value for value in self.buckets if str(action_type) in str(value)]
+            else:
+                action_types = [action_type]
+            keys = self.get_buckets(action_types, in_teleop)
+        elif in_teleop is not None:
+            keys = self.get_buckets(list(self.buckets), in_teleop)
+        else:
+            keys = [None]
+        time_range = filters.pop("time", None)
+        positions = []
+        for key in keys:
+            if time_range is None:
+                positions.extend(self.get_positions(key))
+            else:
+                positions.extend(self.get_positions_in_time_range(key, *time_range))
+        if len(keys) > 1 or time_range is not None:
+            positions.sort()
+        actions = [self.timeline[position] for position in positions]
+        for field, required_value in filters.items():
+            if required_value in substring_values:
+                actions = [
+                    action for action in actions if str(required_value) in str(action[field])
+                ]
+            else:
+                actions = [action for action in actions if action[field] == required_value]
+        return actions
+
+    def count(self, substring_values: Sequence[str] = (), **filters) -> int:
+        """Returns the number of actions that meet all of the filters"""
+        return len(self.filter(substring_values, **filters))
@@ -5,7 +5,6 @@ import utils
 from calculations.base_calculations import BaseCalculations
 from typing import List, Union, Dict
 import logging
-from data_transfer import tba_communicator
 import time
 
 log = logging.getLogger(__name__)
@@ -20,23 +19,15 @@ class UnconsolidatedTotals(BaseCalculations):
     def __init__(self, server):
         super().__init__(server)
         self.watched_collections = ["unconsolidated_obj_tim"]
+        self.output_collections = ["unconsolidated_totals"]
 
     def filter_timeline_actions(self, tim: dict, **filters) -> list:
-        """Removes timeline actions that don't meet the filters and returns all the actions that do"""
-        actions = tim["timeline"]
-        for field, required_value in filters.items():
-            if field == "time":
-                # Times are given as closed intervals: either [0,134] or [135,150]
-                actions = filter(
-                    lambda action: required_value[0] <= action["time"] <= required_value[1],
-                    actions,
-                )
-            else:
-                # Removes actions for which action[field] != required_value
-                actions = filter(lambda action: action[field] == required_value, actions)
-            # filter returns an iterable object
-            actions = list(actions)
-        return actions
+        """Removes timeline actions that don't meet the filters and returns all the actions that do
+
+        Times are given as closed intervals: either [0,134] or [135,150]. The actions are found
+        with the TIM's TimelineIndex instead of checking every action in the timeline.
+        """
+        return self.get_timeline_index(tim).filter(**filters)
 
     def count_timeline_actions(self, tim: dict, **filters) -> int:
         """Returns the number of actions in one TIM timeline that meets the required filters"""
@@ -56,6 +47,7 @@ class UnconsolidatedTotals(BaseCalculations):
                             unconsolidated_tims[num_1]["timeline"][num + 1][
                                 "action_type"
                             ] = new_value["name"]
+                            self.forget_timeline_index(tim)
         return unconsolidated_tims
 
     def calculate_unconsolidated_tims(self, unconsolidated_tims: List[Dict]):
@@ -65,6 +57,12 @@ class UnconsolidatedTotals(BaseCalculations):
             return {}
         unconsolidated_tims = self.score_fail_type(unconsolidated_tims)
         unconsolidated_totals = []
+        # Variable type of a calculation is in the schema, but it's not a filter
+        count_filters = {}
+        for calculation, filters in self.schema["timeline_counts"].items():
+            filters_ = copy.deepcopy(filters)
+            count_filters[calculation] = (filters_.pop("type"), filters_)
+        aggregates = {**self.schema["aggregates"], **self.schema["pre_consolidated_aggregates"]}
         # Calculates unconsolidated tim counts
         for tim in unconsolidated_tims:
             tim_totals = {}
@@ -72,50 +70,42 @@ class UnconsolidatedTotals(BaseCalculations):
             tim_totals["match_number"] = tim["match_number"]
             tim_totals["team_number"] = tim["team_number"]
             tim_totals["alliance_color_is_red"] = tim["alliance_color_is_red"]
-            # Calculate unconsolidated tim counts
-            for aggregate, filters in self.schema["aggregates"].items():
-                total_count = 0
-                aggregate_counts = filters["counts"]
-                for calculation, filters in self.schema["timeline_counts"].items():
-                    filters_ = copy.deepcopy(filters)
-                    expected_type = filters_.pop("type")
+            # Calculate unconsolidated tim counts, which only need to be counted once per TIM
+            timeline_counts = {}
+            if aggregates:
+                for calculation, (expected_type, filters_) in count_filters.items():
                     new_count = self.count_timeline_actions(tim, **filters_)
                     if not isinstance(new_count, self.type_check_dict[expected_type]):
                         raise TypeError(f"Expected {new_count} calculation to be a {expected_type}")
-                    tim_totals[calculation] = new_count
-                    # Calculate unconsolidated aggregates
-                    for count in aggregate_counts:
-                        if calculation == count:
-                            total_count += new_count
-                    tim_totals[aggregate] = total_count
-            # New section for obj_tim, unconsolidated_totals needs to iterate through these datapoints as well
-            for aggregate, filters in self.schema["pre_consolidated_aggregates"].items():
-                total_count = 0
-                aggregate_counts = filters["counts"]
-                for calculation, filters in self.schema["timeline_counts"].items():
-                    filters_ = copy.deepcopy(filters)
-                    expected_type = filters_.pop("type")
-                    new_count = self.count_timeline_actions(tim, **filters_)
-                    if not isinstance(new_count, self.type_check_dict[expected_type]):
-                        raise TypeError(f"Expected {new_count} calculation to be a {expected_type}")
-                    tim_totals[calculation] = new_count
-                    # Calculate unconsolidated aggregates
-                    for count in aggregate_counts:
-                        if calculation == count:
-                            total_count += new_count
-                    tim_totals[aggregate] = total_count
+                    timeline_counts[calculation] = new_count
+                tim_totals.update(timeline_counts)
+            # Calculate unconsolidated aggregates, including the pre_consolidated_aggregates that
+            # obj_tim uses
+            if timeline_counts:
+                for aggregate, filters in aggregates.items():
+                    tim_totals[aggregate] = sum(
+                        timeline_counts[count]
+                        for count in filters["counts"]
+                        if count in timeline_counts
+                    )
             # Calculate unconsolidated categorical actions
             for category in self.schema["categorical_actions"]:
                 tim_totals[category] = tim[category]
             unconsolidated_totals.append(tim_totals)
+        self.clear_timeline_indexes()
         return unconsolidated_totals
 
     def update_calcs(self, tims: List[Dict[str, Union[str, int]]]) -> List[dict]:
         """Calculate data for each of the given TIMs. Those TIMs are represented as dictionaries:
         {'team_number': '1678', 'match_number': 69}"""
         unconsolidated_totals = []
-        for tim in tims:
-            unconsolidated_obj_tims = self.server.db.find("unconsolidated_obj_tim", tim)
+        # Get the data for all of the TIMs at once instead of querying for each TIM
+        keys = [(tim["team_number"], tim["match_number"]) for tim in tims]
+        grouped_obj_tims = self.server.db.find_grouped(
+            "unconsolidated_obj_tim", keys, group_by=("team_number", "match_number")
+        )
+        for key in keys:
+            unconsolidated_obj_tims = grouped_obj_tims[key]
             # check for overrides
             override = {}
             for t in unconsolidated_obj_tims:
@@ -170,14 +160,12 @@ class UnconsolidatedTotals(BaseCalculations):
         """Executes the OBJ TIM calculations"""
         # Get calc start time
         start_time = time.time()
-        tba_match_data: List[dict] = tba_communicator.tba_request(
-            f"event/{utils.TBA_EVENT_KEY}/matches"
-        )
+        event_matches = self.server.get_event_matches()
 
         # Get oplog entries
         tims = []
         # Check if changes need to be made to teams
-        if entries := self.entries_since_last():
+        if entries := self.peek_entries_since_last(["team_number", "match_number"]):
             for entry in entries:
                 team_num = entry["o"]["team_number"]
                 if team_num not in self.teams_list:
@@ -193,40 +181,25 @@ class UnconsolidatedTotals(BaseCalculations):
         for tim in tims:
             if tim not in unique_tims:
                 unique_tims.append(tim)
-        # Delete and re-insert if updating all data
-        if self.calc_all_data:
-            self.server.db.delete_data("unconsolidated_totals")
-
-        updates = self.update_calcs(unique_tims)
-        if len(updates) > 1:
-            for document in updates:
-                real_matches = [
-                    match
-                    for match in tba_match_data
-                    if match["match_number"] == document["match_number"]
-                ]
-                real_teams = [
-                    team[3:]
-                    for real_match in real_matches
-                    for team in (
-                        real_match["alliances"]["red"]["team_keys"]
-                        + real_match["alliances"]["blue"]["team_keys"]
-                    )
-                ]
-                if document["team_number"] in real_teams:
-                    self.server.db.update_document(
-                        "unconsolidated_totals",
-                        document,
-                        {
-                            "team_number": document["team_number"],
-                            "match_number": document["match_number"],
-                            "scout_name": document["scout_name"],
-                        },
-                    )
-                else:
-                    team_number = document["team_number"]
-                    match_number = document["match_number"]
-                    log.warning(f"{team_number} not found in match {match_number}")
+        # Replace the old data at once if updating all data
+        with self.replace_outputs("unconsolidated_totals"):
+            updates = self.update_calcs(unique_tims)
+            if len(updates) > 1:
+                # Totals from matches the teams actually played in, which are written to the database
+                valid_updates = []
+                for document in updates:
+                    real_teams = event_matches.get_teams(document["match_number"])
+                    if document["team_number"] in real_teams:
+                        valid_updates.append(document)
+                    else:
+                        team_number = document["team_number"]
+                        match_number = document["match_number"]
+                        log.warning(f"{team_number} not found in match {match_number}")
+                self.server.db.bulk_upsert(
+                    "unconsolidated_totals",
+                    valid_updates,
+                    ["team_number", "match_number", "scout_name"],
+                )
         end_time = time.time()
         # Get total calc time
         total_time = end_time - start_time
@@ -1,6 +1,7 @@
+import bisect
 import numpy as np
 import numpy.linalg as nl
-from typing import List, TypedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, TypedDict
 
 
 class CCEvent(TypedDict):
@@ -12,6 +13,194 @@ class CCEvent(TypedDict):
     value: float  # The value of the event
 
 
+class CCEngine:
+    """
+    Solves calculated contributions for many value vectors over the same events.
+
+    The parties × events incidence matrix is kept sparse, as the event and party index of each
+    entry. The normal matrix (incidence matrix times its transpose) is factorized once with a
+    singular value decomposition, so solving each value vector (foul points, auto points, etc.) is
+    a sparse product and two small matrix products. Events can be appended when new matches are
+    played, which only refactorizes the next time a value vector is solved.
+    """
+
+    def __init__(self, events: Iterable[Sequence[str]] = ()):
+        """
+        Parameters
+        ----------
+        events : Iterable[Sequence[str]]
+            The parties involved in each event, in the order the values will be given.
+        """
+        self.parties: List[str] = []
+        self.party_indexes: Dict[str, int] = {}
+        # Sparse incidence matrix, as the event index and party index of each nonzero entry
+        self.event_rows: List[int] = []
+        self.party_columns: List[int] = []
+        self.num_events = 0
+        # Normal matrix, the number of events each pair of parties was in together, and how many
+        # of the events have been added to it
+        self.normal_matrix = np.zeros((0, 0))
+        self.normal_events = 0
+        # Singular value decomposition of the normal matrix, None until a value vector is solved
+        self.factorization: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+        # Event weights, as bytes, to the decomposition of the weighted normal matrix
+        self.weighted_factorizations: Dict[bytes, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        for parties in events:
+            self.add_event(parties)
+
+    def add_event(self, parties: Sequence[str]) -> None:
+        """
+        Appends an event, such as an alliance in a new match.
+
+        Parameters
+        ----------
+        parties : Sequence[str]
+            The parties involved in the event. Repeated parties are counted once.
+        """
+        indexes = []
+        for party in dict.fromkeys(parties):
+            if party not in self.party_indexes:
+                self.party_indexes[party] = len(self.parties)
+                self.parties.append(party)
+            indexes.append(self.party_indexes[party])
+        self.event_rows.extend([self.num_events] * len(indexes))
+        self.party_columns.extend(indexes)
+        self.num_events += 1
+        self.factorization = None
+        self.weighted_factorizations = {}
+
+    def get_incidence_rows(self, start: int = 0) -> np.ndarray:
+        """
+        Returns the dense incidence matrix rows of the events from 'start' on, with a column for
+        each party. This is small even for a whole competition.
+        """
+        first_entry = bisect.bisect_left(self.event_rows, start)
+        incidence = np.zeros((self.num_events - start, len(self.parties)))
+        incidence[
+            np.array(self.event_rows[first_entry:], dtype=np.intp) - start,
+            self.party_columns[first_entry:],
+        ] = 1
+        return incidence
+
+    @staticmethod
+    def decompose(left_side: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns the singular value decomposition of a normal matrix, with the singular values
+        inverted.
+
+        The inverted singular values have the same cutoff as numpy.linalg.lstsq with rcond=None,
+        so solutions are the same minimum norm least squares solutions.
+        """
+        u, singular_values, vt = nl.svd(left_side)
+        cutoff = np.finfo(float).eps * len(left_side) * singular_values.max(initial=0)
+        inverted = np.zeros_like(singular_values)
+        nonzero = singular_values > cutoff
+        inverted[nonzero] = 1 / singular_values[nonzero]
+        return u, inverted, vt
+
+    def factorize(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns the singular value decomposition of the normal matrix, calculating it if events
+        were added since it was last calculated.
+
+        Only the events added since then are added to the normal matrix.
+        """
+        if self.factorization is None:
+            num_parties = len(self.parties)
+            left_side = np.zeros((num_parties, num_parties))
+            previous = len(self.normal_matrix)
+            left_side[:previous, :previous] = self.normal_matrix
+            new_events = self.get_incidence_rows(self.normal_events)
+            left_side += new_events.transpose() @ new_events
+            self.normal_matrix, self.normal_events = left_side, self.num_events
+            self.factorization = self.decompose(left_side)
+        return self.factorization
+
+    def factorize_weighted(self, weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns the singular value decomposition of the normal matrix with each event weighted by
+        'weights', for weighted least squares, calculating it if it isn't cached.
+        """
+        key = weights.tobytes()
+        if key not in self.weighted_factorizations:
+            incidence = self.get_incidence_rows()
+            self.weighted_factorizations[key] = self.decompose(
+                incidence.transpose() @ (weights[:, np.newaxis] * incidence)
+            )
+        return self.weighted_factorizations[key]
+
+    def solve_many(
+        self,
+        value_vectors: Dict[str, Sequence[float]],
+        precision: int = 2,
+        weights: Optional[Sequence[float]] = None,
+    ) -> Dict[str, Dict[str, float]]:
+        """
+        Calculates the contribution of each party for each value vector.
+
+        Parameters
+        ----------
+        value_vectors : Dict[str, Sequence[float]]
+            Names, such as "foul", to the value of each event, in the order the events were added.
+        precision : int, optional
+            The precision to round the calculated contributions to. Default is 2.
+        weights : Sequence[float], optional
+            The weight of each event, such as more weight for recent matches. Default is None,
+            which weights every event the same.
+
+        Returns
+        -------
+        Dict[str, Dict[str, float]]
+            The names of the value vectors to dictionaries mapping party names to their
+            calculated contribution, with parties in sorted order.
+        """
+        if not value_vectors or not self.parties:
+            return {name: {} for name in value_vectors}
+        names = list(value_vectors)
+        values = np.array([value_vectors[name] for name in names], dtype=float)
+        if values.shape[1] != self.num_events:
+            raise ValueError(f"Expected {self.num_events} values for each vector")
+        if weights is not None:
+            weights = np.array(weights, dtype=float)
+            if len(weights) != self.num_events:
+                raise ValueError(f"Expected {self.num_events} weights")
+            values = values * weights
+        # Right side of the normal equations, the total (weighted) value of the events each party
+        # was in, from the sparse incidence matrix
+        event_rows = np.array(self.event_rows, dtype=np.intp)
+        right_side = np.array(
+            [
+                np.bincount(
+                    self.party_columns, weights=vector[event_rows], minlength=len(self.parties)
+                )
+                for vector in values
+            ]
+        ).transpose()
+        if weights is None:
+            u, inverted, vt = self.factorize()
+        else:
+            u, inverted, vt = self.factorize_weighted(weights)
+        solved = vt.transpose() @ (inverted[:, np.newaxis] * (u.transpose() @ right_side))
+        return {
+            name: {
+                party: round(float(solved[self.party_indexes[party], column]), precision)
+                for party in sorted(self.parties)
+            }
+            for column, name in enumerate(names)
+        }
+
+    def solve(
+        self,
+        values: Sequence[float],
+        precision: int = 2,
+        weights: Optional[Sequence[float]] = None,
+    ) -> Dict[str, float]:
+        """
+        Calculates the contribution of each party for one value vector, the same as solve_many.
+        """
+        return self.solve_many({"value": values}, precision, weights)["value"]
+
+
 def cc(data: List[CCEvent], precision: int = 2) -> dict:
     """
     Calculates the contribution of each party to a set of events.
@@ -28,38 +217,5 @@ def cc(data: List[CCEvent], precision: int = 2) -> dict:
     dict
         A dictionary mapping party names to their calculated contribution.
     """
-    # Create a set to store the unique parties involved in the events
-    parties = set()
-
-    # Iterate through each event to add each involved party to the set
-    for event in data:
-        for party in event["parties"]:
-            parties.add(party)
-
-    # Sort the parties and create a matrix to store the parties' involvement in each event
-    parties = sorted(parties)
-    party_matrix = np.zeros((len(parties), len(data)))
-
-    # Create a matrix to store the values of each event
-    value_matrix = np.zeros((1, len(data)))
-
-    # Iterate through each event to fill the party matrix and value matrix
-    for event_index, event in enumerate(data):
-        for team in event["parties"]:
-            party_matrix[parties.index(team), event_index] = 1
-        value_matrix[0, event_index] = event["value"]
-
-    # Transpose the party matrix to prepare it for matrix multiplication
-    transposed_party_matrix = np.transpose(party_matrix)
-
-    # Multiply the party matrix with its transpose to get the left side of the equation
-    left_side = np.matmul(party_matrix, transposed_party_matrix)
-
-    # Multiply the value matrix with the transposed party matrix to get the right side of the equation
-    right_side = np.matmul(value_matrix, transposed_party_matrix)
-
-    # Solve the equation to get the calculated contribution of each party
-    solved = nl.lstsq(left_side, right_side.transpose(), rcond=None)[0]
-
-    # Return the calculated contribution rounded to the specified precision
-    return {parties[i]: round(cc[0], precision) for i, cc in enumerate(solved)}
+    engine = CCEngine(event["parties"] for event in data)
+    return engine.solve([event["value"] for event in data], precision)
@@ -0,0 +1,165 @@
+import collections
+import numpy as np
+import statistics
+from typing import List, Optional, Tuple, Union
+
+Number = Union[int, float]
+
+
+def pack_rows(rows: List[List[Number]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Packs lists of numbers with different lengths into one array.
+
+    Parameters
+    ----------
+    rows : List[List[Number]]
+        The numbers in each row, such as the values reported by each scout for one datapoint.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        The values, padded with zeros to the length of the longest row, and a mask that is True
+        for the values that are in the rows.
+    """
+    width = max((len(row) for row in rows), default=0)
+    values = np.zeros((len(rows), width))
+    mask = np.zeros((len(rows), width), dtype=bool)
+    for i, row in enumerate(rows):
+        values[i, : len(row)] = row
+        mask[i, : len(row)] = True
+    return values, mask
+
+
+def masked_mean(values: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Returns the mean of the masked values in each row, or 0 for rows without values"""
+    counts = mask.sum(axis=1)
+    sums = np.where(mask, values, 0).sum(axis=1)
+    return np.divide(sums, counts, out=np.zeros(len(values)), where=counts > 0)
+
+
+def consolidate(values: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """
+    Consolidates the masked values in each row into one number, before rounding.
+
+    This is a vectorized version of `ObjTIMCalcs.consolidate_nums`:
+    - If the mean is one of the values, or there are no values, the mean is used.
+    - If a value is reported more than once, only the most common values (the modes) are used.
+    - Otherwise, the values are averaged with the reciprocal of their squared z-scores as weights.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        The values in each row, from `pack_rows`.
+    mask : np.ndarray
+        True for the values that are in each row, from `pack_rows`.
+
+    Returns
+    -------
+    np.ndarray
+        The consolidated value for each row.
+    """
+    mean = masked_mean(values, mask)
+    done = ~mask.any(axis=1) | (mask & (values == mean[:, None])).any(axis=1)
+    # equal[row, i, j] is True if values i and j in the row are the same
+    equal = mask[:, :, None] & mask[:, None, :] & (values[:, :, None] == values[:, None, :])
+    frequencies = equal.sum(axis=2)
+    # Only use the first of each repeated value, so each mode is counted once
+    earlier = np.tril(np.ones((values.shape[1],) * 2, dtype=bool), k=-1)
+    first = mask & ~(equal & earlier).any(axis=2)
+    max_frequencies = frequencies.max(axis=1, initial=0)
+    has_modes = ~done & (max_frequencies > 1)
+    modes = first & (frequencies == max_frequencies[:, None])
+    mask = np.where(has_modes[:, None], modes, mask)
+    mean = np.where(has_modes, masked_mean(values, mask), mean)
+    done |= has_modes & (mask & (values == mean[:, None])).any(axis=1)
+    # The mean isn't one of the values in rows that aren't done, so no z-score is 0
+    deviations = np.where(mask, values - mean[:, None], 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        std_devs = np.sqrt((deviations**2).sum(axis=1) / mask.sum(axis=1))
+        weights = np.where(mask & ~done[:, None], 1 / (deviations / std_devs[:, None]) ** 2, 0)
+        weighted = (values * weights).sum(axis=1) / weights.sum(axis=1)
+    return np.where(done, mean, weighted)
+
+
+def consolidate_row(nums: List[Number]) -> float:
+    """Consolidates one row of numbers the same way as `consolidate`, in Python
+
+    The results are exactly the same as `ObjTIMCalcs.consolidate_nums` before rounding.
+    """
+    mean = sum(nums) / len(nums) if nums else 0
+    if not nums or mean in nums:
+        return mean
+    if len(nums) > len(set(nums)):
+        frequencies = collections.Counter(nums)
+        max_frequency = max(frequencies.values())
+        return consolidate_row([num for num, n in frequencies.items() if n == max_frequency])
+    std_dev = statistics.pstdev(nums)
+    weights = [1 / ((num - mean) / std_dev) ** 2 for num in nums]
+    return sum(num * weight for num, weight in zip(nums, weights)) / sum(weights)
+
+
+def consolidate_rows(rows: List[List[Number]], decimal: bool = False) -> List[Number]:
+    """
+    Consolidates each row of numbers into one number, the same as `ObjTIMCalcs.consolidate_nums`.
+
+    Parameters
+    ----------
+    rows : List[List[Number]]
+        The numbers reported by each scout, for each datapoint.
+    decimal : bool, optional
+        Round to 2 decimal places instead of to an integer. Default is False.
+
+    Returns
+    -------
+    List[Number]
+        The consolidated number for each row.
+    """
+    if not rows:
+        return []
+    consolidated = consolidate(*pack_rows(rows))
+    # NumPy can be off by a tiny amount from Python, which changes the result when rounding ties
+    # such as 3.5, so those rows are consolidated again in Python
+    scaled = consolidated * 100 if decimal else consolidated
+    for row in np.flatnonzero(np.isclose(scaled % 1, 0.5, rtol=0, atol=1e-6)):
+        consolidated[row] = consolidate_row(rows[row])
+    # Round with Python so the results are the same as consolidate_nums, which returns 0 for no
+    # numbers
+    if decimal:
+        return [round(float(value), 2) if row else 0 for row, value in zip(rows, consolidated)]
+    return [round(float(value)) for value in consolidated]
+
+
+def weighted_sums(
+    rows: List[List[Number]], weights: List[List[Optional[Number]]]
+) -> List[List[Number]]:
+    """
+    Calculates weighted sums of the numbers in each row.
+
+    Parameters
+    ----------
+    rows : List[List[Number]]
+        The numbers in each row, all rows have the same length.
+    weights : List[List[Optional[Number]]]
+        The weights of each number for each sum. None means that the number is not in the sum.
+
+    Returns
+    -------
+    List[List[Number]]
+        Each weighted sum for each row. Sums are ints if every number and weight in them is an int,
+        the same as adding them up in Python.
+    """
+    if not rows or not weights:
+        return [[0] * len(weights) for _ in rows]
+    values = np.array(rows, dtype=float)
+    value_floats = np.array([[isinstance(value, float) for value in row] for row in rows])
+    used = np.array([[weight is not None for weight in row] for row in weights])
+    weight_matrix = np.array([[weight or 0 for weight in row] for row in weights], dtype=float)
+    weight_floats = (used & np.array([[isinstance(w, float) for w in row] for row in weights])).any(
+        axis=1
+    )
+    sums = values @ weight_matrix.T
+    floats = (value_floats.astype(int) @ used.T.astype(int) > 0) | weight_floats[None, :]
+    return [
+        [float(total) if is_float else int(total) for total, is_float in zip(row, row_floats)]
+        for row, row_floats in zip(sums, floats)
+    ]
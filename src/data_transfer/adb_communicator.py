@@ -275,7 +275,8 @@ def pull_device_data():
                     )
             # Consolidate Team Data from both strategists
             current_teams = set(
-                document["team_number"] for document in db.find("unconsolidated_ss_team")
+                document["team_number"]
+                for document in db.find("unconsolidated_ss_team", projection=["team_number"])
             )
             for team in current_teams:
                 document = decompressor.Decompressor.consolidate_ss_team(team)
@@ -8,7 +8,7 @@ from typing import Any, Dict, List, Optional, Union
 
 import pymongo
 
-from data_transfer import database
+from data_transfer import database, oplog_reader
 import utils
 import logging
 
@@ -20,26 +20,68 @@ class CloudDBUpdater:
     BASE_CONNECTION_STRING = "mongodb+srv://server:{}@scouting-system-3das1.gcp.mongodb.net/test?authSource=admin&replicaSet=scouting-system-shard-0&w=majority&readPreference=primary&appname=MongoDB%20Compass&retryWrites=true&ssl=true"
     OPERATION_MAP = {"i": pymongo.InsertOne, "u": pymongo.UpdateOne, "d": pymongo.DeleteOne}
 
-    def __init__(self):
+    def __init__(self, reader: Optional[oplog_reader.OplogReader] = None):
         self.cloud_db = self.get_cloud_db()
         self.db = database.Database()
         self.db_pattern = re.compile(r"^{}\..*".format(self.db.name))
         self.oplog = self.db.client.local.oplog.rs
         # Get an initial timestamp
         self.update_timestamp()
+        # The server passes in the reader it shares with the calculations
+        if reader is None:
+            reader = oplog_reader.OplogReader(self.oplog, self.last_timestamp)
+        self.oplog_reader = reader
 
     def entries_since_last(self) -> List[Dict]:
         """Returns the oplog entries since the last update
 
         These updates are filtered to only include Update, Insert, and Delete operations
         """
-        return list(
-            self.oplog.find({"ts": {"$gt": self.last_timestamp}, "op": {"$in": ["d", "i", "u"]}})
+        return self.oplog_reader.entries_since(self.last_timestamp, self.get_namespaces())
+
+    def get_namespaces(self) -> List[str]:
+        """Returns the namespaces ("<database>.<collection>") of the local collections to replicate
+
+        Shadow collections (see get_replaced_collections) and server-only collections aren't
+        replicated, so the oplog reader doesn't need to cache them.
+        """
+        return [
+            f"{self.db.name}.{collection}"
+            for collection in self.db.db.list_collection_names()
+            if not collection.endswith(database.SHADOW_SUFFIX)
+            and collection not in database.SERVER_ONLY_COLLECTIONS
+        ]
+
+    def get_replaced_collections(self) -> List[str]:
+        """Returns the collections replaced with Database.replace_collection since the last update
+
+        These are found from the renameCollection commands in the oplog, which aren't read by the
+        oplog reader.
+        """
+        renames = self.oplog.find(
+            {
+                "ts": {"$gt": self.last_timestamp},
+                "op": "c",
+                "o.renameCollection": {
+                    "$regex": r"^{}\..*{}$".format(
+                        re.escape(self.db.name), re.escape(database.SHADOW_SUFFIX)
+                    )
+                },
+            }
         )
+        return list({entry["o"]["to"].split(".", 1)[1] for entry in renames})
 
     def create_db_changes(self) -> collections.defaultdict:
         """Creates bulk write operations from oplog"""
         changes = collections.defaultdict(list)
+        # Replaced collections are rewritten with their current documents instead of replaying the
+        # writes to their shadow collections
+        replaced = self.get_replaced_collections()
+        for collection in replaced:
+            changes[collection].append(pymongo.DeleteMany({}))
+            changes[collection].extend(
+                pymongo.InsertOne(document) for document in self.db.find(collection)
+            )
         for entry in self.entries_since_last():
             # 'ns' in the entry is of the format <database>.<collection> and shows where the changes
             # were written
@@ -49,6 +91,12 @@ class CloudDBUpdater:
                 continue
             # Get collection name from full location
             collection = location[location.index(".") + 1 :]
+            if (
+                collection in replaced
+                or collection.endswith(database.SHADOW_SUFFIX)
+                or collection in database.SERVER_ONLY_COLLECTIONS
+            ):
+                continue
             if (bulk_op := self.create_bulk_operation(entry)) is None:
                 continue
             else:
@@ -110,20 +158,22 @@ class CloudDBUpdater:
 
         if operation is None:
             return None
-        if "o" in entry and "$v" in entry["o"]:
-            entry["o"].pop("$v")
+        document = entry.get("o")
+        # The entry is shared with the calculations through the oplog reader, so it isn't modified
+        if document is not None and "$v" in document:
+            document = {key: value for key, value in document.items() if key != "$v"}
 
-        if entry["op"] == "u" and "$set" not in entry["o"]:
+        if entry["op"] == "u" and "$set" not in document:
             return None
 
         if "o2" in entry:
             try:
-                return operation(entry["o2"], entry["o"])
+                return operation(entry["o2"], document)
             # Tries to InsertOne with an o2
             except:
-                return operation(entry["o"])
+                return operation(document)
 
-        return operation(entry["o"])
+        return operation(document)
 
     @classmethod
     def get_cloud_db(cls) -> Optional[database.Database]:
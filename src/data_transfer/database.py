@@ -4,9 +4,12 @@
 
 All communication with the MongoDB local database go through this file.
 """
+import contextlib
+import hashlib
 import os
-from collections import OrderedDict
-from typing import Any, Optional, Union
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
 import pymongo
 
@@ -38,6 +41,20 @@ VALID_COLLECTIONS = [
     "ss_team",
 ]
 
+# Collections only used by the server, which aren't sent to the cloud database or read from the
+# oplog, and aren't in the collection schema
+SERVER_ONLY_COLLECTIONS = ["qr_decode_cache"]
+
+# Number of times each query shape has been used, keyed by (collection, query fields)
+# Used by index_manager.py to check that the queries are covered by indexes
+QUERY_SHAPES = Counter()
+
+# Added to the name of a collection for the collection that replaces it in replace_collection
+SHADOW_SUFFIX = "_shadow"
+
+# Error code MongoDB uses for writes that break a unique index
+DUPLICATE_KEY_ERROR = 11000
+
 # Start mongod and initialize replica set
 start_mongod.start_mongod()
 
@@ -48,6 +65,28 @@ def check_collection_name(collection_name: str) -> None:
         log.warning(f'database.py: Unexpected collection name: "{collection_name}"')
 
 
+def get_query_fields(query: dict) -> Tuple[str, ...]:
+    """Returns the fields that 'query' filters by, in the order they first appear"""
+    fields = []
+    for key, value in query.items():
+        if key in ["$and", "$or", "$nor"]:
+            for sub_query in value:
+                fields.extend(get_query_fields(sub_query))
+        elif not key.startswith("$"):
+            fields.append(key)
+    return tuple(dict.fromkeys(fields))
+
+
+def record_query(collection: str, query: dict) -> None:
+    """Adds the shape of 'query' on 'collection' to QUERY_SHAPES"""
+    QUERY_SHAPES[(collection, get_query_fields(query))] += 1
+
+
+def get_qr_digest(qr_data: str) -> str:
+    """Returns the digest of a QR string, which raw_qr documents have a unique index on"""
+    return hashlib.sha256(qr_data.encode()).hexdigest()
+
+
 class Database:
     """Utility class for the database, performs CRUD functions on local and cloud databases"""
 
@@ -63,8 +102,13 @@ class Database:
         production_mode: bool = os.environ.get("SCOUTING_SERVER_ENV") == "production"
         self.name = tba_event_key if production_mode else f"test{tba_event_key}"
         self.db = self.client[self.name]
+        # Collections being replaced by the current thread, see replace_collection
+        self.shadows = threading.local()
+        # Whether the QR digest index has been created, see ensure_qr_digest_index
+        self.has_qr_digest_index = False
 
     def setup_db(self):
+        self.migrate_qr_digests()
         self.set_indexes()
         # All document names and their files
         coll_to_path = self._get_all_schema_names()
@@ -81,43 +125,264 @@ class Database:
                         [(field, pymongo.ASCENDING) for field in index["fields"]],
                         unique=index["unique"],
                     )
+        self.db.qr_decode_cache.create_index([("key", pymongo.ASCENDING)], unique=True)
+        self.db.qr_decode_cache.create_index([("ulid", pymongo.ASCENDING)])
+        self.ensure_qr_digest_index()
+
+    def migrate_qr_digests(self) -> None:
+        """Adds QR digests to raw_qr documents inserted before QRs had digests
+
+        Run once by setup_db, since each update is an oplog entry the calculations would read.
+        Documents with the same data as an earlier document don't get a digest (the index is
+        sparse), so databases that already have duplicate QRs can still be indexed.
+        """
+        digests = set()
+        updates = []
+        for document in self.db.raw_qr.find({"digest": {"$exists": False}}, {"data": 1}):
+            digest = get_qr_digest(document["data"])
+            if digest not in digests:
+                digests.add(digest)
+                updates.append(
+                    pymongo.UpdateOne({"_id": document["_id"]}, {"$set": {"digest": digest}})
+                )
+        if updates:
+            try:
+                self.db.raw_qr.bulk_write(updates, ordered=False)
+            except pymongo.errors.BulkWriteError as err:
+                # Documents with the same data as an indexed document are left without a digest
+                if any(e["code"] != DUPLICATE_KEY_ERROR for e in err.details["writeErrors"]):
+                    raise
+
+    def ensure_qr_digest_index(self) -> None:
+        """Creates the unique index on the digests of raw_qr documents, once for each Database
+
+        Documents from before QRs had digests aren't indexed until migrate_qr_digests runs.
+        """
+        if self.has_qr_digest_index:
+            return
+        self.db.raw_qr.create_index([("digest", pymongo.ASCENDING)], unique=True, sparse=True)
+        self.has_qr_digest_index = True
+
+    def get_collection(self, collection: str) -> pymongo.collection.Collection:
+        """Returns 'collection', or its shadow collection if the current thread is replacing it"""
+        return self.db[getattr(self.shadows, "names", {}).get(collection, collection)]
+
+    @contextlib.contextmanager
+    def replace_collection(self, collection: str) -> Iterator[None]:
+        """Replaces 'collection' with the documents written to it inside the with block
+
+        Reads and writes of 'collection' by the current thread go to an empty shadow collection,
+        which is renamed over 'collection' at the end of the block with renameCollection. Other
+        readers see the old documents until then instead of an empty collection. If an error is
+        raised, the shadow collection is dropped and 'collection' is left unchanged.
+        """
+        check_collection_name(collection)
+        shadow = f"{collection}{SHADOW_SUFFIX}"
+        self.db.drop_collection(shadow)
+        # Keep the validation and indexes of the collection being replaced
+        self.db.create_collection(shadow, **self.db[collection].options())
+        for name, index in self.db[collection].index_information().items():
+            if name != "_id_":
+                self.db[shadow].create_index(
+                    index["key"], unique=index.get("unique", False), name=name
+                )
+        if not hasattr(self.shadows, "names"):
+            self.shadows.names = {}
+        self.shadows.names[collection] = shadow
+        try:
+            yield
+        except BaseException:
+            self.db.drop_collection(shadow)
+            raise
+        finally:
+            del self.shadows.names[collection]
+        self.db[shadow].rename(collection, dropTarget=True)
+
+    def find(
+        self, collection: str, query: dict = {}, projection: Optional[Union[list, dict]] = None
+    ) -> list:
+        """Finds documents in 'collection', filtering by 'filters'
+
+        'projection' is a list of the fields to return, or a MongoDB projection dictionary. Full
+        documents are returned if it is None.
+        """
+        check_collection_name(collection)
+        record_query(collection, query)
+        return list(self.get_collection(collection).find(query, projection))
+
+    def find_iter(
+        self,
+        collection: str,
+        query: dict = {},
+        projection: Optional[Union[list, dict]] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[dict]:
+        """Same as find, but yields the documents as they are read in batches of 'batch_size'
+
+        This keeps only one batch of documents in memory at a time, instead of the whole collection.
+        """
+        check_collection_name(collection)
+        record_query(collection, query)
+        with self.get_collection(collection).find(
+            query, projection, batch_size=batch_size
+        ) as cursor:
+            yield from cursor
+
+    def find_grouped(
+        self,
+        collection: str,
+        keys: Iterable,
+        group_by: Union[str, Sequence[str]],
+        query: dict = {},
+        projection: Optional[Union[list, dict]] = None,
+    ) -> Dict[Any, List[dict]]:
+        """Finds documents in 'collection' for every key in 'keys' with one query, grouped by key
 
-    def find(self, collection: str, query: dict = {}) -> list:
-        """Finds documents in 'collection', filtering by 'filters'"""
+        'group_by' is the field the documents are grouped by, or a list of fields. When it is a
+        list, each key is a tuple of the values of those fields, in the same order. Every key is in
+        the returned dictionary, with an empty list if no documents match it. 'query' filters the
+        documents further, and 'projection' works the same as in find.
+        """
         check_collection_name(collection)
-        return list(self.db[collection].find(query))
+        fields = [group_by] if isinstance(group_by, str) else list(group_by)
+        # The fields documents are grouped by have to be returned
+        if isinstance(projection, list):
+            projection = projection + [field for field in fields if field not in projection]
+        elif isinstance(projection, dict) and any(projection.values()):
+            projection = {**projection, **{field: 1 for field in fields}}
+        # Removes duplicate keys and keeps the order
+        grouped = {key: [] for key in keys}
+        if not grouped:
+            return grouped
+        if isinstance(group_by, str):
+            key_query = {group_by: {"$in": list(grouped.keys())}}
+        else:
+            key_query = {"$or": [dict(zip(fields, key)) for key in grouped.keys()]}
+        if query:
+            key_query = {"$and": [query, key_query]}
+        record_query(collection, key_query)
+        for document in self.get_collection(collection).find(key_query, projection):
+            values = tuple(document.get(field) for field in fields)
+            key = values[0] if isinstance(group_by, str) else values
+            if key in grouped:
+                grouped[key].append(document)
+        return grouped
 
     def get_tba_cache(self, api_url: str) -> Optional[dict]:
         """Gets the TBA Cache of 'api_url'"""
+        record_query("tba_cache", {"api_url": api_url})
         return self.db.tba_cache.find_one({"api_url": api_url})
 
-    def update_tba_cache(self, data: Any, api_url: str, etag: Optional[str] = None) -> None:
-        """Updates one TBA Cache at 'api_url'"""
+    def update_tba_cache(
+        self,
+        data: Any,
+        api_url: str,
+        etag: Optional[str] = None,
+        timestamp: Optional[float] = None,
+    ) -> None:
+        """Updates one TBA Cache at 'api_url'
+
+        'timestamp' is when the data was last checked with TBA, in seconds since the epoch.
+        """
         write_object = {"data": data}
         if etag is not None:
             write_object["etag"] = etag
+        if timestamp is not None:
+            write_object["timestamp"] = timestamp
         self.db.tba_cache.update_one({"api_url": api_url}, {"$set": write_object}, upsert=True)
 
+    def mark_tba_cache_fresh(self, api_url: str, timestamp: float) -> None:
+        """Records that the TBA Cache at 'api_url' was checked with TBA at 'timestamp' and hasn't
+        changed"""
+        self.db.tba_cache.update_one({"api_url": api_url}, {"$set": {"timestamp": timestamp}})
+
+    def get_qr_decode_cache(self, keys: Iterable[str]) -> Dict[str, dict]:
+        """Gets the cached decompression results of raw QRs, by cache key (see
+        Decompressor.get_cache_key)"""
+        query = {"key": {"$in": list(keys)}}
+        record_query("qr_decode_cache", query)
+        return {
+            document["key"]: document["result"]
+            for document in self.db.qr_decode_cache.find(query, {"_id": 0, "key": 1, "result": 1})
+        }
+
+    def update_qr_decode_cache(self, results: Dict[str, dict]) -> None:
+        """Caches the decompression results of raw QRs, by cache key
+
+        Cached results of the same QRs with other keys, such as from before a QR was overridden,
+        are deleted.
+        """
+        if not results:
+            return
+        record_query("qr_decode_cache", {"ulid": None, "key": None})
+        self.db.qr_decode_cache.delete_many(
+            {
+                "ulid": {"$in": [result["ulid"] for result in results.values()]},
+                "key": {"$nin": list(results)},
+            }
+        )
+        record_query("qr_decode_cache", {"key": None})
+        self.db.qr_decode_cache.bulk_write(
+            [
+                pymongo.ReplaceOne(
+                    {"key": key},
+                    {"key": key, "ulid": result["ulid"], "result": result},
+                    upsert=True,
+                )
+                for key, result in results.items()
+            ],
+            ordered=False,
+        )
+
+    def prune_qr_decode_cache(self, keys: Iterable[str]) -> None:
+        """Deletes cached decompression results that aren't for one of 'keys', such as results from
+        before a QR was overridden"""
+        query = {"key": {"$nin": list(keys)}}
+        record_query("qr_decode_cache", query)
+        self.db.qr_decode_cache.delete_many(query)
+
     def delete_data(self, collection: str, query: dict = {}) -> None:
         """Deletes data in 'collection' according to 'filters'"""
         check_collection_name(collection)
         if "raw" in collection:
             log.warning(f"Attempted to delete raw data from collection {collection}")
             return
-        self.db[collection].delete_many(query)
+        self.get_collection(collection).delete_many(query)
 
     def insert_documents(self, collection: str, data: Union[list, dict]) -> None:
         """Inserts documents from 'data' list in 'collection'"""
         check_collection_name(collection)
         if isinstance(data, list) and data:
-            self.db[collection].insert_many(data)
+            self.get_collection(collection).insert_many(data)
         elif data != {} and isinstance(data, dict):
-            self.db[collection].insert_one(data)
+            self.get_collection(collection).insert_one(data)
         else:
             log.warning(
                 f'database.py: data for insertion to "{collection}" is not a list or dictionary, or is empty'
             )
 
+    def insert_raw_qrs(self, documents: List[dict]) -> List[dict]:
+        """Inserts raw_qr documents unless a document with the same QR data is already in raw_qr,
+        returns the documents that were inserted
+
+        Duplicates are found by the unique index on the digest of each QR, so raw_qr isn't read.
+        The documents are sent in one unordered insert_many, and duplicate key errors are skipped.
+        """
+        if not documents:
+            return []
+        self.ensure_qr_digest_index()
+        for document in documents:
+            document["digest"] = get_qr_digest(document["data"])
+        try:
+            self.get_collection("raw_qr").insert_many(documents, ordered=False)
+        except pymongo.errors.BulkWriteError as err:
+            write_errors = err.details["writeErrors"]
+            if any(error["code"] != DUPLICATE_KEY_ERROR for error in write_errors):
+                raise
+            duplicates = {error["index"] for error in write_errors}
+            return [document for i, document in enumerate(documents) if i not in duplicates]
+        return documents
+
     def update_document(
         self,
         collection: str,
@@ -129,7 +394,8 @@ class Database:
         if collection == "raw_qr":
             log.warning(f"Attempted to modify raw qr data")
             return
-        self.db[collection].update_one(query, {"$set": new_data}, upsert=True)
+        record_query(collection, query)
+        self.get_collection(collection).update_one(query, {"$set": new_data}, upsert=True)
 
     def update_many(
         self,
@@ -142,7 +408,38 @@ class Database:
         if collection == "raw_qr":
             log.warning(f"Attempted to modify raw qr data")
             return
-        self.db[collection].update_many(query, {"$set": new_data}, upsert=True)
+        self.get_collection(collection).update_many(query, {"$set": new_data}, upsert=True)
+
+    def bulk_upsert(
+        self,
+        collection: str,
+        docs: List[dict],
+        key_fields: Sequence[str],
+    ) -> Optional[pymongo.results.BulkWriteResult]:
+        """Updates the documents in 'collection' matching each document in 'docs', uses upsert
+
+        Documents are matched by the values of 'key_fields', and all of the updates are sent in
+        unordered batches instead of one update per document.
+        """
+        check_collection_name(collection)
+        if collection == "raw_qr":
+            log.warning(f"Attempted to modify raw qr data")
+            return None
+        # Merge documents with the same key, so later documents overwrite earlier ones like they
+        # would with separate updates
+        merged = {}
+        for doc in docs:
+            key = tuple(doc[field] for field in key_fields)
+            merged.setdefault(key, {}).update(doc)
+        if not merged:
+            return None
+        # Each update finds its document by the key fields
+        record_query(collection, {field: None for field in key_fields})
+        operations = [
+            pymongo.UpdateOne(dict(zip(key_fields, key)), {"$set": doc}, upsert=True)
+            for key, doc in merged.items()
+        ]
+        return self.get_collection(collection).bulk_write(operations, ordered=False)
 
     def update_qr_blocklist_status(self, query, blocklist=True) -> None:
         """Changes the status of a raw qr matching 'query' from blocklisted: true to blocklisted: false
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+"""Reads the MongoDB oplog once and shares the entries between calculations."""
+
+import collections
+import threading
+from typing import Dict, Iterable, List
+
+import bson
+import pymongo
+
+from data_transfer import database
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class OplogReader:
+    """Caches insert, update, and delete oplog entries indexed by namespace.
+
+    Each new oplog entry is only read from MongoDB once, no matter how many calculations ask for
+    it. Only namespaces that a reader has asked for are cached, and server-only collections are
+    never read. Entries are shared between readers, so they should not be modified.
+    """
+
+    OPERATIONS = ["i", "d", "u"]
+
+    def __init__(self, oplog: pymongo.collection.Collection, start_timestamp: bson.Timestamp):
+        self.oplog = oplog
+        # Every entry of the cached namespaces up to `last_timestamp` has been read
+        self.last_timestamp = start_timestamp
+        # Namespace ("<database>.<collection>") to the timestamp its cached entries start after
+        self.start_timestamps: Dict[str, bson.Timestamp] = {}
+        # Namespace to oplog entries, sorted by timestamp
+        self.entries: Dict[str, List[dict]] = collections.defaultdict(list)
+        # Calculations can read from different threads
+        self.lock = threading.Lock()
+
+    def find(self, query: dict) -> List[dict]:
+        """Returns the insert, update, and delete oplog entries matching `query`"""
+        return list(self.oplog.find({**query, "op": {"$in": self.OPERATIONS}}))
+
+    def refresh(self):
+        """Reads the oplog entries of the cached namespaces written since the last read"""
+        if not self.start_timestamps:
+            return
+        for entry in self.find(
+            {"ts": {"$gt": self.last_timestamp}, "ns": {"$in": list(self.start_timestamps)}}
+        ):
+            self.entries[entry["ns"]].append(entry)
+            self.last_timestamp = max(self.last_timestamp, entry["ts"])
+
+    def backfill(self, timestamp: bson.Timestamp, namespaces: Iterable[str]):
+        """Starts caching `namespaces` that weren't cached, and reads their oplog entries between
+        `timestamp` and the start of their cache"""
+        for namespace in namespaces:
+            # A namespace that wasn't cached starts at `last_timestamp`, older entries are read below
+            self.start_timestamps.setdefault(namespace, self.last_timestamp)
+        ends = {
+            namespace: self.start_timestamps[namespace]
+            for namespace in namespaces
+            if timestamp < self.start_timestamps[namespace]
+        }
+        if not ends:
+            return
+        older = collections.defaultdict(list)
+        for entry in self.find(
+            {"ts": {"$gt": timestamp, "$lte": max(ends.values())}, "ns": {"$in": list(ends)}}
+        ):
+            if entry["ts"] <= ends[entry["ns"]]:
+                older[entry["ns"]].append(entry)
+        for namespace in ends:
+            self.entries[namespace] = older[namespace] + self.entries[namespace]
+            self.start_timestamps[namespace] = timestamp
+
+    def entries_since(self, timestamp: bson.Timestamp, namespaces: Iterable[str]) -> List[dict]:
+        """Returns the oplog entries in `namespaces` after `timestamp`, sorted by timestamp.
+
+        This gives the same results as querying the oplog with `ts` greater than `timestamp`, except
+        that there are no entries for server-only collections.
+        """
+        namespaces = {
+            namespace
+            for namespace in namespaces
+            if namespace.split(".", 1)[-1] not in database.SERVER_ONLY_COLLECTIONS
+        }
+        with self.lock:
+            # Namespaces that weren't cached are read up to `last_timestamp` first, then refresh()
+            # reads the rest of their entries along with the other namespaces
+            self.backfill(timestamp, namespaces)
+            self.refresh()
+            found = []
+            for namespace in namespaces:
+                found.extend(
+                    entry for entry in self.entries.get(namespace, []) if entry["ts"] > timestamp
+                )
+        return sorted(found, key=lambda entry: entry["ts"])
+
+    def prune(self, timestamps: Dict[str, bson.Timestamp]):
+        """Removes the cached entries of each namespace at or before its timestamp in `timestamps`,
+        they are read again if needed"""
+        with self.lock:
+            for namespace, timestamp in timestamps.items():
+                if namespace not in self.start_timestamps:
+                    continue
+                # Nothing after `last_timestamp` has been read yet
+                timestamp = min(timestamp, self.last_timestamp)
+                if timestamp <= self.start_timestamps[namespace]:
+                    continue
+                self.entries[namespace] = [
+                    entry for entry in self.entries[namespace] if entry["ts"] > timestamp
+                ]
+                self.start_timestamps[namespace] = timestamp
@@ -6,7 +6,16 @@ Caches data to prevent duplicate data retrieval from the TBA API.
 API documentation: https://www.thebluealliance.com/apidocs/v3.
 """
 
+import collections
+import contextlib
+import copy
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Set, Tuple
+
 import requests
+import requests.adapters
 
 from data_transfer import database
 import utils
@@ -14,47 +23,252 @@ import logging
 
 log = logging.getLogger(__name__)
 
+BASE_URL = "https://www.thebluealliance.com/api/v3"
+# Seconds to wait to connect to TBA and for TBA to respond, so a bad connection doesn't stall a cycle
+TIMEOUT: Tuple[float, float] = (5, 15)
+# Most requests sent to TBA at once, extra requests wait for a connection
+MAX_CONNECTIONS = 4
+# Seconds cached data is used without checking TBA for changes, by the end of the API url. Stale
+# data is still used, but is checked with TBA in the background. Checked in order.
+CACHE_TTL_SECONDS = {
+    "/matches": 60,
+    "/rankings": 60,
+    "/alliances": 120,
+    "/oprs": 120,
+    "/teams/simple": 3600,
+    "/teams": 3600,
+}
+# Seconds cached data is fresh for API urls not in CACHE_TTL_SECONDS
+DEFAULT_CACHE_TTL_SECONDS = 300
+# Only uses the TBA cache, without sending any requests, for when there is no internet
+OFFLINE = os.environ.get("TBA_OFFLINE") == "1"
+
+# Cache hits, stale hits, misses, request errors and request latency, see get_cache_stats
+CACHE_STATS = collections.Counter()
+# Calculations and background revalidations update CACHE_STATS from different threads
+_stats_lock = threading.Lock()
+
+# Shared by all requests so connections to TBA are reused
+_session: Optional[requests.Session] = None
+_db: Optional[database.Database] = None
+_client_lock = threading.Lock()
+# API url to response, while a memo is active (see `request_memo`)
+_memo: Optional[Dict[str, Any]] = None
+# API url to the lock held while that url is being requested, so it's only requested once
+_memo_locks: Dict[str, threading.Lock] = {}
+_memo_lock = threading.Lock()
+# API urls being checked with TBA in the background
+_revalidating: Set[str] = set()
+_revalidating_lock = threading.Lock()
+# Number of active `synchronous_revalidation` contexts
+_synchronous_revalidations = 0
+
+
+def get_session() -> requests.Session:
+    """Returns the session used for all TBA requests, creating it on the first request"""
+    global _session
+    with _client_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=MAX_CONNECTIONS, pool_block=True
+            )
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def get_db() -> database.Database:
+    """Returns the database the TBA cache is in, connecting on the first request"""
+    global _db
+    with _client_lock:
+        if _db is None:
+            _db = database.Database()
+        return _db
+
+
+@contextlib.contextmanager
+def request_memo():
+    """Requests each API url at most once inside this context, such as in one server cycle
+
+    Later requests for the same url get a copy of the first response, and requests for a url that
+    is being requested wait for that request instead of sending another.
+    """
+    global _memo
+    with _memo_lock:
+        _memo = {}
+        _memo_locks.clear()
+    try:
+        yield
+    finally:
+        with _memo_lock:
+            _memo = None
+            _memo_locks.clear()
+
+
+@contextlib.contextmanager
+def synchronous_revalidation():
+    """Checks stale cached data with TBA before returning it inside this context, instead of in
+    the background, for scripts that exit before background checks would finish
+
+    Unchanged data is still not downloaded again, since TBA responds to its ETag with a 304.
+    """
+    global _synchronous_revalidations
+    with _revalidating_lock:
+        _synchronous_revalidations += 1
+    try:
+        yield
+    finally:
+        with _revalidating_lock:
+            _synchronous_revalidations -= 1
+
 
-def tba_request(api_url, write_db: bool = True):
+def tba_request(api_url, write_db: bool = True, timeout: Tuple[float, float] = None):
     """Sends a single web request to the TBA API v3.
 
     `api_url`: suffix of the API request URL (the part after '/api/v3').
 
     `write_db` (optional): if specified, doesn't write request to the DB cache and doesn't check for duplicates.
 
+    `timeout` (optional): seconds to wait to connect and to receive a response, `TIMEOUT` by default.
+
     Returns
     """
+    with _memo_lock:
+        memo = _memo
+        if memo is not None:
+            url_lock = _memo_locks.setdefault(api_url, threading.Lock())
+    if memo is None:
+        return send_tba_request(api_url, write_db, timeout)
+    with url_lock:
+        if api_url not in memo:
+            memo[api_url] = send_tba_request(api_url, write_db, timeout)
+        return copy.deepcopy(memo[api_url])
+
+
+def send_tba_request(api_url, write_db: bool = True, timeout: Tuple[float, float] = None):
+    """Sends the request for `tba_request`, without checking the memo
+
+    Fresh cached data (see `CACHE_TTL_SECONDS`) is returned without contacting TBA. Stale cached
+    data is returned immediately and checked with TBA in a background thread, so a slow or
+    dropped connection only delays updates instead of the calculations. TBA is only waited on if
+    there is no cached data, or for stale data inside `synchronous_revalidation`.
+    """
     log.info(f"tba request from {api_url} started")
-    full_url = f"https://www.thebluealliance.com/api/v3/{api_url}"
-    request_headers = {"X-TBA-Auth-Key": get_api_key()}
-    db = database.Database()
+    if not write_db:
+        response = fetch(api_url, {}, timeout)
+        return None if response is None else response.json()
+
+    cached = get_db().get_tba_cache(api_url)
+    if cached is not None:
+        if OFFLINE or time.time() - cached.get("timestamp", 0) < get_cache_ttl(api_url):
+            add_cache_stat("hits")
+        else:
+            add_cache_stat("stale_hits")
+            if _synchronous_revalidations:
+                return revalidate(api_url, cached, timeout)
+            start_revalidation(api_url, cached, timeout)
+        return cached["data"]
+    add_cache_stat("misses")
+    if OFFLINE:
+        log.error(f"Error: {api_url} is not in the TBA cache and TBA_OFFLINE is set.")
+        return None
+    return revalidate(api_url, None, timeout)
 
-    if write_db:
-        cached = db.get_tba_cache(api_url)
-        # Check if cache exists
-        if cached:
-            request_headers["If-None-Match"] = cached["etag"]
 
+def get_cache_ttl(api_url: str) -> float:
+    """Returns the seconds cached data from `api_url` is used without checking TBA"""
+    for suffix, ttl in CACHE_TTL_SECONDS.items():
+        if api_url.endswith(suffix):
+            return ttl
+    return DEFAULT_CACHE_TTL_SECONDS
+
+
+def fetch(
+    api_url, headers: dict, timeout: Tuple[float, float] = None
+) -> Optional[requests.Response]:
+    """Sends a GET request for `api_url` to TBA, returns None if TBA can't be reached"""
+    full_url = f"{BASE_URL}/{api_url}"
+    request_headers = {"X-TBA-Auth-Key": get_api_key(), **headers}
     log.info(f"Retrieving TBA data from {full_url}.")
+    start_time = time.monotonic()
     try:
-        request = requests.get(full_url, headers=request_headers)
+        response = get_session().get(full_url, headers=request_headers, timeout=timeout or TIMEOUT)
         log.info(f"TBA request from {api_url} finished.")
+        return response
+    except requests.exceptions.Timeout:
+        add_cache_stat("request_errors")
+        log.error(f"Error: TBA request from {api_url} timed out.")
     except requests.exceptions.ConnectionError:
+        add_cache_stat("request_errors")
         log.error("Error: No internet connection.")
-        return None
+    finally:
+        add_cache_stat("requests")
+        add_cache_stat("request_seconds", time.monotonic() - start_time)
+    return None
+
+
+def revalidate(api_url, cached: Optional[dict], timeout: Tuple[float, float] = None):
+    """Checks `api_url` with TBA and updates the TBA cache, returns the current data
 
+    Sends the ETag of `cached` so TBA can respond that it hasn't changed. If TBA can't be reached
+    or responds with an error, returns the cached data, or None if there isn't any.
+    """
+    headers = {}
+    if cached is not None and "etag" in cached:
+        headers["If-None-Match"] = cached["etag"]
+    response = fetch(api_url, headers, timeout)
+    cached_data = None if cached is None else cached["data"]
+    if response is None:
+        return cached_data
     # A 200 status code means the request was successful
-    # 304 means that data was not modified since the last timestamp
-    # specified in request_headers['If-Modified-Since']
-    if write_db:
-        if request.status_code == 304:
-            return cached["data"]
-        if request.status_code == 200:
-            db.update_tba_cache(request.json(), api_url, request.headers["etag"])
-            return request.json()
-        raise Warning(f"Request failed with status code {request.status_code}")
-    else:
-        return request.json()
+    # 304 means that data was not modified since the ETag in request_headers['If-None-Match']
+    if response.status_code == 304 and cached is not None:
+        get_db().mark_tba_cache_fresh(api_url, time.time())
+        return cached_data
+    if response.status_code == 200:
+        get_db().update_tba_cache(
+            response.json(), api_url, response.headers["etag"], timestamp=time.time()
+        )
+        return response.json()
+    add_cache_stat("request_errors")
+    log.error(f"Error: TBA request from {api_url} failed with status code {response.status_code}")
+    return cached_data
+
+
+def start_revalidation(api_url, cached: dict, timeout: Tuple[float, float] = None) -> None:
+    """Checks stale cached data from `api_url` with TBA in a background thread, unless it already
+    is being checked"""
+    with _revalidating_lock:
+        if api_url in _revalidating:
+            return
+        _revalidating.add(api_url)
+
+    def run():
+        try:
+            revalidate(api_url, cached, timeout)
+        finally:
+            with _revalidating_lock:
+                _revalidating.discard(api_url)
+
+    threading.Thread(target=run, name=f"tba-revalidate {api_url}", daemon=True).start()
+
+
+def add_cache_stat(stat: str, amount: float = 1) -> None:
+    """Adds `amount` to `stat` in CACHE_STATS"""
+    with _stats_lock:
+        CACHE_STATS[stat] += amount
+
+
+def get_cache_stats() -> Dict[str, float]:
+    """Returns the TBA cache counters and the average request latency in seconds"""
+    with _stats_lock:
+        stats = dict(CACHE_STATS)
+    requests_sent = stats.get("requests", 0)
+    stats["average_request_seconds"] = (
+        stats.get("request_seconds", 0) / requests_sent if requests_sent else 0
+    )
+    return stats
 
 
 def get_api_key() -> str:
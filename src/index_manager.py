@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+"""Checks that the queries made by the server are covered by indexes.
+
+The server saves the shapes of the queries it makes (the collection and the fields it filters by)
+to data/query_shapes.json. This runs explain() on each shape against the local database, reports
+the ones that scan the whole collection (COLLSCAN), and suggests or creates the missing compound
+indexes.
+"""
+
+import argparse
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+import pymongo
+
+from data_transfer import database
+import utils
+import logging
+
+log = logging.getLogger(__name__)
+
+QUERY_SHAPES_FILE = "data/query_shapes.json"
+
+
+def save_query_shapes(path: str = QUERY_SHAPES_FILE) -> None:
+    """Writes the query shapes recorded in database.QUERY_SHAPES to 'path'"""
+    shapes = [
+        {"collection": collection, "fields": list(fields), "count": count}
+        for (collection, fields), count in database.QUERY_SHAPES.most_common()
+    ]
+    with open(utils.create_file_path(path), "w") as file:
+        json.dump(shapes, file, indent=2)
+
+
+def load_query_shapes(path: str = QUERY_SHAPES_FILE) -> List[Dict[str, Any]]:
+    """Reads the query shapes saved by save_query_shapes"""
+    try:
+        with open(utils.create_file_path(path)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        log.error(f"index_manager: {path} not found, run the server to record query shapes")
+        return []
+
+
+def get_plan_stages(plan: Any) -> List[str]:
+    """Returns every stage in an explain() query plan, such as IXSCAN or COLLSCAN"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(get_plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(get_plan_stages(value))
+    return stages
+
+
+def explain_query_shape(db: database.Database, collection: str, fields: List[str]) -> List[str]:
+    """Runs explain() on a query on 'collection' filtering by 'fields', returns the plan stages
+
+    The query uses the values from a document in the collection when there is one, so the plan
+    is the same as for the queries the server makes.
+    """
+    sample = db.db[collection].find_one({}, fields) or {}
+    query = {field: sample.get(field) for field in fields}
+    explanation = db.db[collection].find(query).explain()
+    return get_plan_stages(explanation["queryPlanner"]["winningPlan"])
+
+
+def check_query_shapes(db: database.Database, shapes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Returns a report for each query shape, with whether its query scans the whole collection
+
+    Queries that don't filter by any fields read the whole collection anyway, so they are skipped.
+    """
+    report = []
+    for shape in shapes:
+        if not shape["fields"]:
+            continue
+        stages = explain_query_shape(db, shape["collection"], shape["fields"])
+        report.append({**shape, "stages": stages, "collscan": "COLLSCAN" in stages})
+    return report
+
+
+def get_schema_indexes() -> Dict[str, List[List[str]]]:
+    """Returns the fields of each index in collection_schema.yml by collection"""
+    indexes = {}
+    for collection, collection_dict in database.COLLECTION_SCHEMA["collections"].items():
+        indexes[collection] = [index["fields"] for index in collection_dict["indexes"] or []]
+    return indexes
+
+
+def suggest_index(shape: Dict[str, Any]) -> List[Tuple[str, int]]:
+    """Returns the keys of a compound index that covers the fields of 'shape'"""
+    return [(field, pymongo.ASCENDING) for field in shape["fields"]]
+
+
+def manage_indexes(
+    db: database.Database, shapes: List[Dict[str, Any]], create: bool = False
+) -> List[Dict[str, Any]]:
+    """Reports the query shapes that scan the whole collection, and creates indexes if 'create'
+
+    Returns the report from check_query_shapes.
+    """
+    report = check_query_shapes(db, shapes)
+    schema_indexes = get_schema_indexes()
+    for shape in report:
+        if not shape["collscan"]:
+            continue
+        index = suggest_index(shape)
+        log.warning(
+            f'index_manager: COLLSCAN on {shape["collection"]} filtering by {shape["fields"]} '
+            f'({shape["count"]} queries), suggested index: {index}'
+        )
+        if shape["fields"] in schema_indexes.get(shape["collection"], []):
+            log.warning(f"index_manager: index is in collection_schema.yml, run Database.setup_db")
+        else:
+            log.info(f"index_manager: add the index to collection_schema.yml to keep it")
+        if create:
+            name = db.db[shape["collection"]].create_index(index)
+            log.info(f'index_manager: created index {name} on {shape["collection"]}')
+    if not any(shape["collscan"] for shape in report):
+        log.info(f"index_manager: all {len(report)} query shapes use indexes")
+    return report
+
+
+def parser():
+    """
+    Defines the argument options when running the file from the command line
+
+    --create | Creates the suggested indexes instead of only reporting them
+    --shapes_file | File the query shapes are read from
+    """
+    parse = argparse.ArgumentParser()
+    parse.add_argument(
+        "--create", help="Should create missing indexes", default=False, action="store_true"
+    )
+    parse.add_argument(
+        "--shapes_file", help="File to read query shapes from", default=QUERY_SHAPES_FILE
+    )
+    return parse.parse_args()
+
+
+if __name__ == "__main__":
+    args = parser()
+    manage_indexes(database.Database(), load_query_shapes(args.shapes_file), args.create)
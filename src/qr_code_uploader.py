@@ -2,7 +2,8 @@
 
 """Houses upload_qr_codes which appends unique QR codes to local competition document.
 
-Checks for duplicates within set of QR codes to add, and the database.
+Checks for duplicates within set of QR codes to add, and the database (by the unique index on
+each QR code's digest).
 Appends new QR codes to raw.qr.
 """
 
@@ -28,19 +29,14 @@ def upload_qr_codes(qr_codes):
     # Gets the starting character for each QR code type, used to identify QR code type
     schema = utils.read_schema("schema/match_collection_qr_schema.yml")
 
-    # Acquires current qr data using database.py
-    qr_data = [qr_code["data"] for qr_code in local_database.find("raw_qr")]
-
     # Creates a set to store QR codes
     # This is a set in order to prevent addition of duplicate qr codes
     qr = set()
 
     for qr_code in qr_codes:
-        if qr_code in qr_data:
-            pass
         # Checks to make sure the qr is valid by checking its starting character. If the starting
         # character doesn't match either of the options, the QR is printed out.
-        elif not (
+        if not (
             qr_code.startswith(schema["subjective_aim"]["_start_character"])
             or qr_code.startswith(schema["objective_tim"]["_start_character"])
         ):
@@ -61,6 +57,7 @@ def upload_qr_codes(qr_codes):
             }
             for qr_code in qr
         ]
-        local_database.insert_documents("raw_qr", qr)
+        # QR codes that are already in the database are skipped
+        qr = local_database.insert_raw_qrs(qr)
 
     return qr
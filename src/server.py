@@ -2,13 +2,20 @@
 
 """Contains the server class."""
 import console  # DON'T DELETE THIS LINE. This initializes the logging system
+import argparse
+from concurrent import futures
 import importlib
-from typing import List, Type
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Set, Type
 
+import bson
 import yaml
 
 from calculations import base_calculations
-from data_transfer import database, cloud_db_updater
+from data_transfer import database, cloud_db_updater, oplog_reader
+import index_manager
 import utils
 import logging
 
@@ -26,15 +33,34 @@ class Server:
 
     CALCULATIONS_FILE = utils.create_file_path("src/calculations.yml")
     TBA_EVENT_KEY = utils.load_tba_event_key_file(utils._TBA_EVENT_KEY_FILE)
+    # Maximum number of calculations that run at the same time
+    MAX_CALCULATION_THREADS = 4
+    # In daemon mode, seconds without a new change before the changed calculations run
+    DEBOUNCE_SECONDS = 1.0
+    # In daemon mode, the longest a burst of changes can delay the calculations
+    MAX_DEBOUNCE_SECONDS = 5.0
+    # In daemon mode, how often calculations without watched collections (such as TBA calculations)
+    # run, since no change in the database triggers them
+    POLL_SECONDS = 60.0
+    # Database operations that trigger calculations in daemon mode
+    CHANGE_OPERATIONS = ["insert", "update", "replace", "delete"]
 
-    def __init__(self, write_cloud=False):
+    def __init__(self, write_cloud=False, daemon=False, stream_qrs=False):
         self.db = database.Database()
         self.oplog = self.db.client.local.oplog.rs
+        # Shared by the calculations and the cloud DB updater so new oplog entries are only read once
+        self.oplog_reader = oplog_reader.OplogReader(
+            self.oplog, base_calculations.BaseCalculations.get_latest_timestamp(self.oplog)
+        )
         if write_cloud:
-            self.cloud_db_updater = cloud_db_updater.CloudDBUpdater()
+            self.cloud_db_updater = cloud_db_updater.CloudDBUpdater(self.oplog_reader)
         else:
             self.cloud_db_updater = None
-        self.calc_all_data = self.ask_calc_all_data()
+        # Daemon mode runs calculations when the database changes, without asking for input
+        self.daemon = daemon
+        # In daemon mode, read QRs from stdin line by line while calculations run
+        self.stream_qrs = stream_qrs
+        self.calc_all_data = False if daemon else self.ask_calc_all_data()
 
         # Option to reinsert raw_qrs, obj_pit, and such
         if write_cloud and self.calc_all_data:
@@ -44,9 +70,17 @@ class Server:
         else:
             self.reinsert = False
 
+        # Snapshot shared by all calculations, so each one doesn't query the oplog and read the
+        # team list file separately
+        self.oplog_timestamp = base_calculations.BaseCalculations.get_latest_timestamp(self.oplog)
+        self.teams_list = base_calculations.BaseCalculations.get_teams_list()
+        # TBA matches shared by all calculations in a cycle, loaded by the first one that uses them
+        self.event_matches = None
+        self.event_matches_lock = threading.Lock()
+        # Seconds spent importing and instantiating each calculation, used by --profile-startup
+        self.startup_times: Dict[str, Dict[str, float]] = {}
         self.calculations = self.load_calculations()
 
-    # TODO: optimize this function, this takes a really long time (especially on the old server computer)
     def load_calculations(self) -> List["base_calculations.BaseCalculations"]:
         """Imports calculation modules and creates instances of calculation classes."""
         with open(self.CALCULATIONS_FILE) as f:
@@ -55,13 +89,19 @@ class Server:
         # `calculations.yml` is a list of dictionaries, each with an "import_path" and "class_name"
         # key. We need to import the module and then get the class from the imported module.
         for calc in calculation_load_list:
+            name = f'{calc["import_path"]}.{calc["class_name"]}'
+            times = self.startup_times[name] = {"import": 0.0, "init": 0.0}
             # Import the module
+            start_time = time.perf_counter()
             try:
                 module = importlib.import_module(calc["import_path"])
             except Exception as e:
                 log.error(f'{e.__class__.__name__} importing {calc["import_path"]}: {e}')
                 continue
+            finally:
+                times["import"] = time.perf_counter() - start_time
             # Get calculation class from module
+            start_time = time.perf_counter()
             try:
                 cls: Type["base_calculations.BaseCalculations"] = getattr(
                     module, calc["class_name"]
@@ -72,19 +112,137 @@ class Server:
                 # oplog or the database
                 loaded_calcs.append(cls(self))
             except Exception as e:
-                log.error(
-                    f'{e.__class__.__name__} instantiating {calc["import_path"]}.{calc["class_name"]}: {e}'
-                )
+                log.error(f"{e.__class__.__name__} instantiating {name}: {e}")
+            finally:
+                times["init"] = time.perf_counter() - start_time
         return loaded_calcs
 
-    def run_calculations(self):
-        """Run each calculation in `self.calculations` in order"""
+    def log_startup_times(self):
+        """Logs the time it took to import and instantiate each calculation"""
+        for name, times in self.startup_times.items():
+            log.info(
+                f"{name}: import {round(times['import'], 3)} sec, "
+                f"init {round(times['init'], 3)} sec"
+            )
+        total = sum(times["import"] + times["init"] for times in self.startup_times.values())
+        log.info(f"Total calculation startup time: {round(total, 2)} sec")
+
+    @staticmethod
+    def get_calc_collections(calc, attribute: str) -> Optional[Set[str]]:
+        """Returns the collections in `attribute` of `calc` as a set.
+
+        Returns None if the calculation does not declare the attribute, meaning it could read or
+        write to any collection.
+        """
+        collections = getattr(calc, attribute, NotImplemented)
+        if not isinstance(collections, (list, set, tuple)):
+            return None
+        return set(collections)
+
+    def get_calculation_dependencies(self) -> Dict[int, Set[int]]:
+        """Builds the dependency graph of `self.calculations`.
+
+        Returns a dictionary of calculation indexes to the indexes of the calculations that have to
+        finish before it can run. A calculation depends on an earlier calculation in
+        `calculations.yml` if one of them writes to a collection that the other reads or writes.
+        Calculations that don't declare their collections depend on everything before them, and
+        everything after them depends on them.
+        """
+        reads = []
+        writes = []
+        for calc in self.calculations:
+            watched = self.get_calc_collections(calc, "watched_collections")
+            extra = self.get_calc_collections(calc, "extra_read_collections")
+            reads.append(None if watched is None or extra is None else watched | extra)
+            writes.append(self.get_calc_collections(calc, "output_collections"))
+
+        dependencies = {}
+        for index in range(len(self.calculations)):
+            dependencies[index] = set()
+            for earlier in range(index):
+                if None in [reads[index], writes[index], reads[earlier], writes[earlier]]:
+                    dependencies[index].add(earlier)
+                elif (
+                    writes[earlier] & (reads[index] | writes[index])
+                    or reads[earlier] & writes[index]
+                ):
+                    dependencies[index].add(earlier)
+        return dependencies
+
+    def should_run(self, calc) -> bool:
+        """Returns whether `calc` should be ran this cycle"""
+        # Calculations that wait for input can't run in daemon mode
+        if self.daemon and hasattr(calc, "is_interactive"):
+            return False
+        # The re-insertion only runs if the user entered 'y'
+        return not hasattr(calc, "is_reinsert") or self.reinsert
+
+    def run_calculations(self, indexes: Optional[Set[int]] = None):
+        """Runs the calculations in `self.calculations`, in parallel where possible.
+
+        Each calculation starts as soon as all of the calculations it depends on have finished (see
+        `get_calculation_dependencies`), so calculations that use different collections can wait on
+        MongoDB and TBA at the same time.
+
+        If `indexes` is given, only the calculations at those indexes run.
+        """
+        dependencies = self.get_calculation_dependencies()
+        finished = set()
+        running = {}
+        with futures.ThreadPoolExecutor(max_workers=self.MAX_CALCULATION_THREADS) as executor:
+            while len(finished) < len(self.calculations):
+                for index, calc in enumerate(self.calculations):
+                    if index in finished or index in running.values():
+                        continue
+                    if not dependencies[index].issubset(finished):
+                        continue
+                    if (indexes is None or index in indexes) and self.should_run(calc):
+                        running[executor.submit(self.run_calculation, calc)] = index
+                    else:
+                        finished.add(index)
+                if not running:
+                    continue
+                done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    finished.add(running.pop(future))
+                    # Raise any errors from the calculation, same as running it directly
+                    future.result()
+
+    def run_calculation(self, calc) -> None:
+        """Runs `calc`, then moves its timestamp to the end of the oplog from before it ran
+
+        This way the next run only reads the changes made since this one started, instead of every
+        change since the server started. Changes made while the calculation runs are read again
+        next time. The timestamp doesn't move if the calculation raises an error.
+        """
+        timestamp = base_calculations.BaseCalculations.get_latest_timestamp(self.oplog)
+        calc.run()
+        # Calculations that don't read the oplog don't keep a timestamp
+        if isinstance(getattr(calc, "timestamp", None), bson.Timestamp):
+            calc.timestamp = max(calc.timestamp, timestamp)
+
+    def prune_oplog_reader(self):
+        """Removes oplog entries that every reader of their namespace has already read
+
+        Each namespace is pruned up to the oldest timestamp of the calculations that watch it, and
+        of the cloud DB updater, which reads every namespace. Calculations that haven't run don't
+        keep entries of other namespaces from being pruned.
+        """
+        timestamps = {}
         for calc in self.calculations:
-            if not hasattr(calc, "is_reinsert"):
-                calc.run()
-            # Run the re-insertion if user entered 'y'
-            elif self.reinsert:
-                calc.run()
+            watched = self.get_calc_collections(calc, "watched_collections")
+            timestamp = getattr(calc, "timestamp", None)
+            # Calculations without watched collections don't read the oplog
+            if not watched or not isinstance(timestamp, bson.Timestamp):
+                continue
+            for collection in watched:
+                namespace = f"{self.db.name}.{collection}"
+                timestamps[namespace] = min(timestamps.get(namespace, timestamp), timestamp)
+        if self.cloud_db_updater is not None:
+            timestamp = self.cloud_db_updater.last_timestamp
+            for namespace in list(self.oplog_reader.start_timestamps):
+                timestamps[namespace] = min(timestamps.get(namespace, timestamp), timestamp)
+        self.oplog_reader.prune(timestamps)
 
     def ask_calc_all_data(self):
         calc_all_data = input("Run calculations on all data? (y/N): ").lower()
@@ -94,20 +252,184 @@ class Server:
         else:
             return False
 
+    def get_event_matches(self) -> "event_matches.EventMatches":
+        """Returns the event's TBA matches, requesting them from TBA once per cycle
+
+        If TBA can't be reached, the matches in the TBA cache are used.
+        """
+        # Imported here so calculations that don't use TBA data don't load requests at startup
+        from calculations import event_matches
+        from data_transfer import tba_communicator
+
+        with self.event_matches_lock:
+            if self.event_matches is None:
+                api_url = f"event/{utils.TBA_EVENT_KEY}/matches"
+                matches = tba_communicator.tba_request(api_url)
+                if matches is None:
+                    cached = self.db.get_tba_cache(api_url)
+                    matches = cached["data"] if cached else []
+                self.event_matches = event_matches.EventMatches(matches)
+            return self.event_matches
+
+    def run_cycle(self, indexes: Optional[Set[int]] = None):
+        """Runs the calculations (or the ones at `indexes`) and writes the changes to the cloud"""
+        from data_transfer import tba_communicator
+
+        # Load new TBA matches the next time a calculation uses them
+        self.event_matches = None
+        # Each TBA url is only requested once per cycle, even if several calculations use it
+        with tba_communicator.request_memo():
+            self.run_calculations(indexes)
+        log.info(f"TBA cache stats: {tba_communicator.get_cache_stats()}")
+        if self.cloud_db_updater is not None:
+            self.cloud_db_updater.write_db_changes()
+        self.prune_oplog_reader()
+        # Used by index_manager.py to find queries that aren't covered by indexes
+        index_manager.save_query_shapes()
+
     def run(self):
         """Starts server cycles, runs in infinite loop"""
+        if self.daemon:
+            self.run_daemon()
         while True:
-            self.run_calculations()
-            if write_cloud:
-                self.cloud_db_updater.write_db_changes()
+            self.run_cycle()
             self.calc_all_data = self.ask_calc_all_data()
 
+    def get_triggered_calculations(self, changed_collections: Set[str]) -> Set[int]:
+        """Returns the indexes of the calculations that watch any of `changed_collections`"""
+        triggered = set()
+        for index, calc in enumerate(self.calculations):
+            watched = self.get_calc_collections(calc, "watched_collections")
+            # Calculations that don't declare their watched collections could use any collection
+            if watched is None or watched & changed_collections:
+                triggered.add(index)
+        return triggered
+
+    def get_polled_calculations(self) -> Set[int]:
+        """Returns the indexes of the calculations that don't watch any collections"""
+        return {
+            index
+            for index, calc in enumerate(self.calculations)
+            if self.get_calc_collections(calc, "watched_collections") == set()
+        }
+
+    def watch_changes(self) -> "pymongo.change_stream.DatabaseChangeStream":
+        """Opens a change stream on the event database for the operations in CHANGE_OPERATIONS"""
+        return self.db.db.watch(
+            [{"$match": {"operationType": {"$in": self.CHANGE_OPERATIONS}}}],
+            # Return from `try_next` often so the debounce timers are checked
+            max_await_time_ms=250,
+        )
+
+    def wait_for_changes(self, stream, timeout: float) -> Set[str]:
+        """Returns the names of the collections changed in `stream`.
+
+        Waits up to `timeout` seconds for the first change. After a change, keeps collecting changes
+        until there are none for DEBOUNCE_SECONDS or MAX_DEBOUNCE_SECONDS have passed, so a burst
+        of inserts (like a tablet uploading all of its QRs) triggers one calculation run.
+        """
+        changed_collections = set()
+        start_time = time.monotonic()
+        first_change_time = last_change_time = None
+        while True:
+            now = time.monotonic()
+            if first_change_time is None:
+                if now - start_time >= timeout:
+                    break
+            elif (
+                now - last_change_time >= self.DEBOUNCE_SECONDS
+                or now - first_change_time >= self.MAX_DEBOUNCE_SECONDS
+            ):
+                break
+            change = stream.try_next()
+            if change is None:
+                continue
+            changed_collections.add(change["ns"]["coll"])
+            last_change_time = time.monotonic()
+            if first_change_time is None:
+                first_change_time = last_change_time
+        return changed_collections
+
+    def start_qr_stream(self) -> None:
+        """Uploads QRs from stdin in a background thread as they are scanned (see
+        QRInput.stream_qr_codes), so the Decompressor runs on them during the scan"""
+        for calc in self.calculations:
+            if hasattr(calc, "stream_qr_codes"):
+                console.console.print("[green]ENTER DATA (one QR per line): ")
+                threading.Thread(
+                    target=calc.stream_qr_codes, args=(sys.stdin,), name="qr-stream", daemon=True
+                ).start()
+                return
+        log.warning("Streaming QRs requires the QRInput calculation")
+
+    def run_daemon(self):
+        """Runs calculations whenever their watched collections change, runs in infinite loop
+
+        Changes made by calculations trigger the calculations that watch their output collections,
+        so new data moves through the calculations without waiting for the next full cycle.
+        """
+        # Catch up on changes made while the server was off
+        self.run_cycle()
+        last_poll_time = time.monotonic()
+        with self.watch_changes() as stream:
+            if self.stream_qrs:
+                self.start_qr_stream()
+            while True:
+                timeout = max(0, self.POLL_SECONDS - (time.monotonic() - last_poll_time))
+                changed_collections = self.wait_for_changes(stream, timeout)
+                indexes = self.get_triggered_calculations(changed_collections)
+                if time.monotonic() - last_poll_time >= self.POLL_SECONDS:
+                    indexes |= self.get_polled_calculations()
+                    last_poll_time = time.monotonic()
+                if not indexes:
+                    continue
+                log.info(
+                    f"Running {len(indexes)} calculations for changes in {sorted(changed_collections)}"
+                )
+                self.run_cycle(indexes)
+
+
+def parser():
+    parse = argparse.ArgumentParser()
+    parse.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Print the import and instantiation time of each calculation, then exit",
+    )
+    parse.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Run calculations when the database changes instead of asking between cycles",
+    )
+    parse.add_argument(
+        "--stream-qrs",
+        action="store_true",
+        help="Run in daemon mode and upload QRs from stdin as each one is scanned",
+    )
+    parse.add_argument(
+        "--dump-plan",
+        action="store_true",
+        help="Print the obj_team counts and sums compiled from the schema, then exit",
+    )
+    return parse.parse_args()
+
 
 if __name__ == "__main__":
-    write_cloud_question = input("Write changes to cloud DB? (y/N): ").lower()
-    if write_cloud_question in ["y", "yes"]:
-        write_cloud = True
+    args = parser()
+    if args.dump_plan:
+        from calculations import obj_team
+
+        print(obj_team.format_plan(obj_team.OBJTeamCalc.PLAN))
     else:
-        write_cloud = False
-    server = Server(write_cloud)
-    server.run()
+        write_cloud_question = input("Write changes to cloud DB? (y/N): ").lower()
+        if write_cloud_question in ["y", "yes"]:
+            write_cloud = True
+        else:
+            write_cloud = False
+        server = Server(
+            write_cloud, daemon=args.daemon or args.stream_qrs, stream_qrs=args.stream_qrs
+        )
+        if args.profile_startup:
+            server.log_startup_times()
+        else:
+            server.run()
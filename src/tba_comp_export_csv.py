@@ -6,9 +6,14 @@ import csv
 import logging
 from datetime import datetime
 from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import itertools
 
 log = logging.getLogger(__name__)
 YEAR = str(date.today())[:4]
+# Most events pulled at once, TBA requests are also limited by tba_communicator.MAX_CONNECTIONS
+EXPORT_THREADS = tba_communicator.MAX_CONNECTIONS
 
 # dictionary for converting bad datapoint names into section titles for the csv file
 name_conversions = {
@@ -228,58 +233,101 @@ def export_csv(key, file_name):
     log.info(f"Successfully wrote to {file_name}")
 
 
-def export_all_comps(file_name):
-    """Pulls data from every completed competition so far this year, then writes team and match data in the csv file"""
-    # pull ALL comp data from current year events
-    all_events = tba_communicator.tba_request(f"events/{YEAR}/simple")
-    all_event_data = {}
+def get_completed_events():
+    """Returns the keys of every competition this year that has ended, in TBA order"""
+    all_events = tba_communicator.tba_request(f"events/{YEAR}/simple") or []
     present = datetime.now()
-    num_events_done = 0
-    for event in all_events:
-        if (
-            datetime(
-                int(event["end_date"][:4]),
-                int(event["end_date"][5:7]),
-                int(event["end_date"][8:10]),
-            )
-            < present
-        ):
-            all_event_data[event["key"]] = pull_comp_data(event["key"], True)
-        num_events_done += 1
-        # loading bar so that you can tell that its actually working :)
-        percent_done = int(num_events_done / len(all_events) * 100)
-        loading_bar_string = "Pulling event data... ["
-        for i in range(20):
-            loading_bar_string += "_" if percent_done < 5 * (i + 1) else "-"
-        loading_bar_string += f"] {percent_done}%"
-        print(loading_bar_string, end="\r")
+    return [
+        event["key"]
+        for event in all_events
+        if datetime(
+            int(event["end_date"][:4]),
+            int(event["end_date"][5:7]),
+            int(event["end_date"][8:10]),
+        )
+        < present
+    ]
+
+
+def pull_all_comp_data(event_keys):
+    """Pulls match and team data for each event in `event_keys`, EXPORT_THREADS events at a time
+
+    Yields (event_key, data) in the order of `event_keys` as soon as each event and the events
+    before it have been pulled, so they can be written without holding every event in memory.
+    Stale cached TBA data is checked with TBA before it's used, so only events whose data changed
+    since the last export are downloaded again (unchanged data gets a 304 response).
+    """
+    executor = ThreadPoolExecutor(max_workers=EXPORT_THREADS, thread_name_prefix="tba-export")
+    event_keys = iter(event_keys)
+    # (event_key, future) of the events being pulled, at most EXPORT_THREADS, so pulled events
+    # don't pile up in memory behind a slow event
+    pulling = collections.deque()
+    try:
+        with tba_communicator.synchronous_revalidation():
+            for event_key in itertools.islice(event_keys, EXPORT_THREADS):
+                pulling.append((event_key, executor.submit(pull_comp_data, event_key, True)))
+            while pulling:
+                event_key, future = pulling.popleft()
+                data = future.result()
+                # Start the next event before this one is written
+                for next_key in itertools.islice(event_keys, 1):
+                    pulling.append((next_key, executor.submit(pull_comp_data, next_key, True)))
+                yield event_key, data
+    finally:
+        # Don't pull the events that haven't started if writing stopped early or raised an error
+        for _, future in pulling:
+            future.cancel()
+        executor.shutdown(wait=True)
+
 
-    print(f"Writing data to {file_name}...    ")
+def print_loading_bar(num_events_done, num_events):
+    # loading bar so that you can tell that its actually working :)
+    percent_done = int(num_events_done / num_events * 100) if num_events else 100
+    loading_bar_string = "Pulling event data... ["
+    for i in range(20):
+        loading_bar_string += "_" if percent_done < 5 * (i + 1) else "-"
+    loading_bar_string += f"] {percent_done}%"
+    print(loading_bar_string, end="\r")
+
+
+def export_all_comps(file_name):
+    """Pulls data from every completed competition so far this year, then writes team and match data in the csv file
+
+    Match data is written as each event is pulled, team data is written after all of the matches.
+    """
+    event_keys = get_completed_events()
+    all_oprs_data = []
     with open(file_name, "w") as csv_file:
         # match data
         csv_file.write(f"ALL {YEAR} MATCH DATA\n")
-        all_match_data = []
-        for event, data in all_event_data.items():
-            all_match_data += data["matches"]
-        field_names = list(all_match_data[0].keys())
-        field_names.insert(0, field_names.pop(field_names.index("event_key")))
-        field_names.insert(0, field_names.pop(field_names.index("key")))
-        # writing data to file
-        csv_writer = csv.DictWriter(csv_file, fieldnames=field_names)
-        csv_writer.writeheader()
-        for i in all_match_data:
-            csv_writer.writerow(i)
+        csv_writer = None
+        for num_events_done, (event, data) in enumerate(pull_all_comp_data(event_keys), 1):
+            print_loading_bar(num_events_done, len(event_keys))
+            matches = data["matches"] or []
+            if csv_writer is None and matches:
+                # the match with the most fields, since matches without a score breakdown have fewer
+                field_names = list(max(matches, key=len).keys())
+                field_names.insert(0, field_names.pop(field_names.index("event_key")))
+                field_names.insert(0, field_names.pop(field_names.index("key")))
+                # writing data to file
+                csv_writer = csv.DictWriter(csv_file, fieldnames=field_names, extrasaction="ignore")
+                csv_writer.writeheader()
+            if csv_writer is not None:
+                csv_writer.writerows(matches)
+            if data["oprs"] is None:
+                log.warning(f"No OPR data for {event}")
+            else:
+                data["oprs"]["event_key"] = event
+                all_oprs_data.append(data["oprs"])
+        print(f"Writing team data to {file_name}...    ")
         # team data, currently only includes opr data
         csv_file.write(f"{YEAR} TEAM DATA\n")
-        all_oprs_data = []
-        for event, data in all_event_data.items():
-            data["oprs"]["event_key"] = event
-            all_oprs_data.append(data["oprs"])
-        field_names = ["team_key"] + list(all_oprs_data[0].keys())
-        field_names.insert(1, field_names.pop(field_names.index("event_key")))
-        # writing data to file
-        csv_writer = csv.DictWriter(csv_file, fieldnames=field_names)
-        csv_writer.writeheader()
+        if all_oprs_data:
+            field_names = ["team_key"] + list(all_oprs_data[0].keys())
+            field_names.insert(1, field_names.pop(field_names.index("event_key")))
+            # writing data to file
+            csv_writer = csv.DictWriter(csv_file, fieldnames=field_names)
+            csv_writer.writeheader()
         for event in all_oprs_data:
             if "ccwms" in event.keys():
                 for i in event[field_names[2]].keys():
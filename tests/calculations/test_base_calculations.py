@@ -22,6 +22,11 @@ class TestBaseCalculations:
         assert self.base_calc.calc_all_data == False
         assert self.base_calc_all_data.calc_all_data == True
         assert self.base_calc.watched_collections == NotImplemented
+        assert self.base_calc.output_collections == NotImplemented
+        assert self.base_calc.extra_read_collections == []
+        # Timestamp and team list come from the server's snapshot
+        assert self.base_calc.timestamp == self.test_server.oplog_timestamp
+        assert self.base_calc.teams_list == self.test_server.teams_list
 
     def test_update_timestamp(self):
         self.test_server.db.insert_documents("test", {"a": 1})
@@ -50,7 +55,8 @@ class TestBaseCalculations:
         self.test_server_all_data.db.insert_documents("testing1", [{"a": 1}, {"a": 2}, {"a": 3}])
         self.test_server_all_data.db.delete_data("testing1", {"a": 1})
         self.test_server_all_data.db.update_document("testing1", {"b": 2}, {"a": 2})
-        assert len(self.base_calc_all_data.entries_since_last()) == 3
+        # Documents are streamed when calculating all data
+        assert len(list(self.base_calc_all_data.entries_since_last())) == 3
         contains_first_insert = False
         for entry in self.base_calc_all_data.entries_since_last():
             assert entry["op"] == None
@@ -58,6 +64,43 @@ class TestBaseCalculations:
                 contains_first_insert = True
         assert contains_first_insert == True
 
+    def test_peek_entries_since_last(self):
+        self.base_calc_all_data.watched_collections = ["testing1"]
+        assert self.base_calc_all_data.peek_entries_since_last() is None
+        self.test_server_all_data.db.insert_documents("testing1", [{"a": 1, "b": 1}, {"a": 2}])
+        entries = self.base_calc_all_data.peek_entries_since_last(["a"])
+        assert [entry["o"]["a"] for entry in entries] == [1, 2]
+        # Only the given fields are read when calculating all data
+        assert "b" not in next(self.base_calc_all_data.entries_since_last(["a"]))["o"]
+        self.base_calc.watched_collections = ["testing2"]
+        assert self.base_calc.peek_entries_since_last() is None
+
+    def test_replace_outputs(self):
+        self.test_server.db.insert_documents("testing", [{"a": 1}, {"a": 2}])
+        # Writes go to the collection if not calculating all data
+        with self.base_calc.replace_outputs("testing"):
+            self.test_server.db.insert_documents("testing", {"a": 3})
+        assert len(self.test_server.db.find("testing")) == 3
+        # Otherwise the collection is replaced with the new documents
+        with self.base_calc_all_data.replace_outputs("testing"):
+            self.test_server_all_data.db.insert_documents("testing", {"a": 4})
+            # Other threads see the old documents until the collection is replaced
+            assert len(self.test_server.db.find("testing")) == 3
+        assert [doc["a"] for doc in self.test_server.db.find("testing")] == [4]
+
+    def test_get_timeline_index(self):
+        tim = {"timeline": [{"action_type": "score_amp", "time": 140, "in_teleop": False}]}
+        index = self.base_calc.get_timeline_index(tim)
+        # The index is only built once per timeline
+        assert self.base_calc.get_timeline_index(tim) is index
+        tim["timeline"].append({"action_type": "score_amp", "time": 30, "in_teleop": True})
+        assert self.base_calc.get_timeline_index(tim).count(action_type="score_amp") == 2
+        tim["timeline"][0]["action_type"] = "score_fail_amp"
+        self.base_calc.forget_timeline_index(tim)
+        assert self.base_calc.get_timeline_index(tim).count(action_type="score_amp") == 1
+        self.base_calc.clear_timeline_indexes()
+        assert self.base_calc.timeline_indexes == {}
+
     def test_get_updated_teams(self):
         self.base_calc.update_timestamp()
         self.base_calc.watched_collections = ["test"]
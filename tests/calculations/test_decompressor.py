@@ -1,9 +1,12 @@
 import datetime
+import subprocess
+import sys
 
 import pytest
 from unittest.mock import patch
 
 import server
+import utils
 from calculations import decompressor
 
 
@@ -353,6 +356,88 @@ class TestDecompressor:
             ]
         )
 
+    def test_decompress_qr(self):
+        # Errors are returned with the ULID of the QR instead of being raised
+        assert {
+            "ulid": "01GWSXQYKYQQ963QMT77A3NPBZ",
+            "collection": None,
+            "documents": [],
+            "error": "ValueError: QR type unknown - Invalid first character for QR: ?",
+        } == decompressor.Decompressor.decompress_qr(
+            {"data": "?A1", "ulid": "01GWSXQYKYQQ963QMT77A3NPBZ", "override": {}}
+        )
+        result = decompressor.Decompressor.decompress_qr(
+            {
+                "data": f"+A{decompressor.Decompressor.SCHEMA['schema_file']['version']}$B34$C1230$Dv1.3$EName$FTRUE%Z1678$Y14$X4$W060AC061AD$VFALSE$UN$TO$SN$RFALSE",
+                "ulid": "01GWSXQYKYQQ963QMT77A3NPBZ",
+                "override": {"scout_id": 15},
+            }
+        )
+        assert result["collection"] == "unconsolidated_obj_tim"
+        assert result["error"] is None
+        assert result["documents"][0]["scout_id"] == 15
+
+    def test_decompress_qr_results(self):
+        qrs = [
+            {
+                "data": f"+A{decompressor.Decompressor.SCHEMA['schema_file']['version']}$B{match_number}$C1230$Dv1.3$EName$FTRUE%Z1678$Y14$X4$W060AC061AD$VFALSE$UN$TO$SN$RFALSE",
+                "ulid": str(match_number),
+                "override": {},
+            }
+            for match_number in range(1, 9)
+        ]
+        qrs[3]["data"] = "?"
+        try:
+            with patch.object(decompressor.Decompressor, "MIN_PARALLEL_QRS", 0):
+                results = self.test_decompressor.decompress_qr_results(qrs, processes=3)
+                workers = list(self.test_decompressor.worker_pool.workers)
+                # The workers are kept and used again
+                assert self.test_decompressor.decompress_qr_results(qrs, processes=3) == results
+                assert self.test_decompressor.worker_pool.workers == workers
+            assert len(workers) == 3
+        finally:
+            self.test_decompressor.worker_pool.close()
+        assert all(worker.returncode == 0 for worker in workers)
+        # Results are in the same order as the QRs
+        assert [result["ulid"] for result in results] == [str(n) for n in range(1, 9)]
+        assert [result["error"] is None for result in results] == [True] * 3 + [False] + [True] * 4
+        assert results == self.test_decompressor.decompress_qr_results(qrs, processes=1)
+
+    def test_qr_worker_imports(self):
+        # Worker processes only import qr_worker and qr_decoder, which must not start or connect
+        # to mongod
+        check_imports = (
+            "import sys; from calculations import qr_decoder, qr_worker; "
+            "assert 'data_transfer.database' not in sys.modules and 'server' not in sys.modules"
+        )
+        subprocess.run(
+            [sys.executable, "-c", check_imports],
+            cwd=utils.create_file_path("src", False),
+            check=True,
+        )
+
+    def test_decompress_qr_results_cached(self):
+        qrs = [
+            {
+                "data": f"+A{decompressor.Decompressor.SCHEMA['schema_file']['version']}$B34$C1230$Dv1.3$EName$FTRUE%Z1678$Y14$X4$W060AC061AD$VFALSE$UN$TO$SN$RFALSE",
+                "ulid": "01GWSXQYKYQQ963QMT77A3NPBZ",
+                "override": {},
+            }
+        ]
+        with patch.object(
+            self.test_decompressor,
+            "decompress_qr_results",
+            wraps=self.test_decompressor.decompress_qr_results,
+        ) as decompress_mock:
+            first_results = self.test_decompressor.decompress_qr_results_cached(qrs)
+            # Unchanged QRs are restored from the cache
+            assert self.test_decompressor.decompress_qr_results_cached(qrs) == first_results
+            # Overridden QRs are decompressed again
+            qrs[0]["override"] = {"scout_id": 15}
+            overridden_results = self.test_decompressor.decompress_qr_results_cached(qrs)
+        assert [len(call.args[0]) for call in decompress_mock.call_args_list] == [1, 0, 1]
+        assert overridden_results[0]["documents"][0]["scout_id"] == 15
+
     def test_decompress_pit_data(self):
         raw_obj_pit = {
             "team_number": "3448",
@@ -689,6 +774,30 @@ class TestDecompressor:
             result.pop("_id")
             assert result == expected_sbj[i]
 
+    def test_run_raw_qrs_without_digests(self):
+        qrs = [
+            {
+                "data": f"+A{decompressor.Decompressor.SCHEMA['schema_file']['version']}$B{match_number}$C9321$Dv1.3$EName$FFALSE%Z3603$Y13$X2$W000AA001AB005AV006AB$VTRUE$UO$TN$SN$RFALSE",
+                "blocklisted": False,
+                "override": {},
+                "ulid": ulid,
+            }
+            for match_number, ulid in [
+                (51, "01GWSYJHR5EC6PAKCS79YZAF3Z"),
+                (52, "01GWSYKDZDM45M1K4ZBHN6G97H"),
+            ]
+        ]
+        # Inserted before raw_qr documents had digests
+        self.test_server.db.db.raw_qr.insert_one(qrs[0])
+        # Pasting QRs doesn't add digests to the documents already in raw_qr
+        assert self.test_server.db.insert_raw_qrs([qrs[1]]) == [qrs[1]]
+        assert "digest" not in self.test_server.db.db.raw_qr.find_one({"ulid": qrs[0]["ulid"]})
+        # The updates from the digest migration aren't decompressed
+        self.test_server.db.migrate_qr_digests()
+        self.test_decompressor.run()
+        result_obj = self.test_server.db.find("unconsolidated_obj_tim")
+        assert sorted(tim["ulid"] for tim in result_obj) == [qr["ulid"] for qr in qrs]
+
     def test_get_qr_type(self):
         # Test when QRType.OBJECTIVE returns when first character is '+'
         assert decompressor.QRType.OBJECTIVE == self.test_decompressor.get_qr_type("+")
@@ -0,0 +1,40 @@
+from calculations.event_matches import EventMatches
+
+
+def make_match(comp_level, match_number, red, blue, score_breakdown=None):
+    return {
+        "comp_level": comp_level,
+        "match_number": match_number,
+        "alliances": {
+            "red": {"team_keys": [f"frc{team}" for team in red]},
+            "blue": {"team_keys": [f"frc{team}" for team in blue]},
+        },
+        "score_breakdown": score_breakdown,
+    }
+
+
+MATCHES = [
+    make_match("qm", 1, ["1678", "254"], ["971", "118"], {"red": {}, "blue": {}}),
+    make_match("qm", 2, ["1678", "971"], ["254", "4414"]),
+    make_match("sf", 1, ["1323", "254"], ["118", "971"], {"red": {}, "blue": {}}),
+]
+
+
+def test_get_match():
+    event_matches = EventMatches(MATCHES)
+    assert event_matches.get_match(1) is MATCHES[0]
+    assert event_matches.get_match(1, "sf") is MATCHES[2]
+    assert event_matches.get_match(3) is None
+
+
+def test_get_teams():
+    event_matches = EventMatches(MATCHES)
+    assert event_matches.get_teams(2) == {"1678", "971", "254", "4414"}
+    assert event_matches.get_teams(1, "qm") == {"1678", "254", "971", "118"}
+    assert event_matches.get_teams(1) == {"1678", "254", "971", "118", "1323"}
+    assert event_matches.get_teams(5) == set()
+
+
+def test_get_latest_match_number():
+    assert EventMatches(MATCHES).get_latest_match_number() == 1
+    assert EventMatches(None).get_latest_match_number() == 0
@@ -1095,6 +1095,60 @@ class TestOBJTeamCalc:
             == expected_output
         )
 
+    def test_compile_plan(self):
+        """Tests compile_plan and format_plan from src/calculations/obj_team.py"""
+        schema = {
+            "counts": {
+                "parks": {"type": "int", "tim_fields": {"parked": True}},
+                "lfm_not_left": {
+                    "type": "int",
+                    "tim_fields": {"parked": False, "not": [{"obj_tim.stage_level_left": "N"}]},
+                },
+            },
+            "multi_counts": {"traps": {"tim_fields": ["obj_tim.trap", "obj_tim.failed_trap"]}},
+            "special_counts": {
+                "tippy_parks": {
+                    "tim_fields": [{"obj_tim.parked": True}, {"subj_tim.was_tippy": True}]
+                }
+            },
+            "sums": {
+                "total_incap_time": {"type": "int"},
+                "points": {"type": "float", "avg_amp": 2, "avg_speaker": ["multiplier", 5]},
+            },
+        }
+        plan = obj_team.compile_plan(schema)
+        tims = [
+            {"parked": True, "stage_level_left": "N"},
+            {"parked": False, "stage_level_left": "O"},
+            {"parked": False},
+        ]
+        # Every filter in a dict of tim_fields is counted once for each key
+        assert plan["counts"]["lfm_not_left"]["repeats"] == 2
+        assert plan["counts"]["lfm_not_left"]["lfm"]
+        assert self.test_calc.filter_tims_for_counts(tims, plan["counts"]["parks"]) == 1
+        assert self.test_calc.filter_tims_for_counts(tims, plan["counts"]["lfm_not_left"]) == 6
+        assert plan["multi_counts"]["traps"]["fields"] == ["trap", "failed_trap"]
+        assert [d for d, _ in plan["special_counts"]["tippy_parks"]["subj_tim"]] == [
+            "was_tippy in (missing, True)"
+        ]
+        assert plan["sums"]["total_incap_time"] == {"lfm": False, "field": "incap_time"}
+        team_data = {"avg_amp": 1, "avg_speaker": 2, "multiplier": 3}
+        assert [weight(team_data) for _, _, weight in plan["sums"]["points"]["terms"]] == [2, 15]
+        assert obj_team.format_plan(plan).splitlines() == [
+            "counts:",
+            "  parks = count(tims where parked == True)",
+            "  lfm_not_left = 2 * (count(lfm_tims where parked == False)"
+            " + count(lfm_tims where stage_level_left != 'N'))",
+            "multi_counts:",
+            "  traps = sum(tims.trap) + sum(tims.failed_trap)",
+            "special_counts:",
+            "  tippy_parks = count(obj_tims where parked in (missing, True)"
+            " with subj_tims where was_tippy in (missing, True))",
+            "sums:",
+            "  total_incap_time = sum(tims.incap_time)",
+            "  points = avg_amp * 2 + avg_speaker * multiplier * 5",
+        ]
+
     def test_super_counts(self):
         """Tests calculate_super_counts function from src/calculations.obj_team.py"""
         tims = [
@@ -1,10 +1,12 @@
 # Copyright (c) 2024 FRC Team 1678: Citrus Circuits
 
+import copy
 from unittest import mock
 
 from calculations import base_calculations
 from calculations import obj_tims
 from server import Server
+import utils
 import pytest
 from unittest.mock import patch
 
@@ -891,6 +893,29 @@ class TestObjTIMCalcs:
         calculated_tim = self.test_calculator.calculate_tim_times(self.unconsolidated_tims)
         assert calculated_tim["incap_time"] == 0
 
+    def test_calculate_tims(self):
+        # Same results as calculating each TIM separately
+        tims_data = [
+            (copy.deepcopy(self.unconsolidated_tims), self.unconsolidated_totals),
+            ([], []),
+            (copy.deepcopy(self.unconsolidated_tims[:2]), self.unconsolidated_totals[:2]),
+        ]
+        expected = [
+            self.test_calculator.calculate_tim(copy.deepcopy(tims), totals)
+            for tims, totals in tims_data
+        ]
+        assert expected[1] == {}
+        for calculated_tim, expected_tim in zip(
+            self.test_calculator.calculate_tims(tims_data), expected
+        ):
+            assert utils.dict_near(calculated_tim, expected_tim)
+        # Aggregates and point values are the same as the ones calculated one at a time
+        calculated_tim = self.test_calculator.calculate_tims(tims_data[:1])[0]
+        for field, value in self.test_calculator.calculate_aggregates(calculated_tim).items():
+            assert utils.near(calculated_tim[field], value)
+        for field, value in self.test_calculator.calculate_point_values(calculated_tim).items():
+            assert utils.near(calculated_tim[field], value)
+
     def test_run_consolidation(self):
         self.test_server.db.insert_documents("unconsolidated_obj_tim", self.unconsolidated_tims)
         self.test_server.db.delete_data("unconsolidated_totals")
@@ -0,0 +1,24 @@
+from calculations.partner_graph import PartnerGraph
+
+TIMS = [
+    {"match_number": 1, "team_number": "1678", "alliance_color_is_red": True},
+    {"match_number": 1, "team_number": "4414", "alliance_color_is_red": True},
+    {"match_number": 1, "team_number": "3", "alliance_color_is_red": False},
+    {"match_number": 2, "team_number": "1678", "alliance_color_is_red": False},
+    {"match_number": 2, "team_number": "3", "alliance_color_is_red": False},
+]
+
+
+def test_get_partners():
+    graph = PartnerGraph(TIMS)
+    assert graph.teams == ["1678", "4414", "3"]
+    assert graph.get_partners("1678") == ["1678", "4414", "1678", "3"]
+    assert graph.get_partners("3") == ["3", "1678", "3"]
+    assert graph.get_partners("254") == []
+
+
+def test_average_partner_values():
+    graph = PartnerGraph(TIMS)
+    averages = graph.average_partner_values({"1678": 1.0, "4414": 0.5, "3": 0.0})
+    assert averages == {"1678": 0.625, "4414": 0.75, "3": 1 / 3}
+    assert PartnerGraph([]).average_partner_values({}) == {}
@@ -407,6 +407,14 @@ class TestPredictedTeamCalc:
         ):
             assert self.test_calc.update_predicted_team(self.predicted_aim) == self.expected_results
 
+    def test_run_no_predicted_aim(self):
+        self.test_server.db.insert_documents("predicted_team", {"team_number": "1678"})
+        self.test_calc.calc_all_data = True
+        with mock.patch("data_transfer.tba_communicator.tba_request") as mock_request:
+            self.test_calc.run()
+        mock_request.assert_not_called()
+        assert len(self.test_server.db.find("predicted_team")) == 1
+
     def test_run(self):
         self.test_server.db.insert_documents("predicted_aim", self.predicted_aim)
         with mock.patch(
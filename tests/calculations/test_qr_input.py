@@ -1,10 +1,13 @@
 import server
 
+import time
 from unittest import mock
 
 import pytest
 
 FAKE_SCHEMA = {
+    "schema_file": {"version": 2},
+    "generic_data": {"_separator": "$", "_section_separator": "%", "schema_version": ["A", "int"]},
     "objective_tim": {"_start_character": "+"},
     "subjective_aim": {"_start_character": "*"},
 }
@@ -32,9 +35,10 @@ class TestQRInput:
             assert isinstance(query[0]["readable_time"], str)
 
             self.test_calc.run("*test\ntest")
+            # Duplicates are found when the QRs are inserted, after checking that they're valid
             assert [
-                "Duplicate QR code not uploaded\t*test",
                 'Invalid QR code not uploaded: "test"',
+                "Duplicate QR code not uploaded\t*test",
             ] == [rec.message for rec in caplog.records if rec.levelname == "WARNING"]
 
             self.test_calc.run("*test2\n+test3\n*test4")
@@ -56,3 +60,57 @@ class TestQRInput:
             # with mock.patch("builtins.input", return_value="*test2\t+test3\t*test4"):
             #     self.test_calc.run()
             #     assert (query := self.server.db.find("raw_qr")) and len(query) == 4
+
+    def test_check_streamed_qr_code(self, caplog):
+        with mock.patch("utils.read_schema", return_value=FAKE_SCHEMA), mock.patch(
+            "builtins.open", mock.mock_open(read_data="1,1,1")
+        ), mock.patch("json.load", return_value={}):
+            from calculations import qr_input
+
+            self.test_calc = qr_input.QRInput(self.server)
+        assert self.test_calc.check_streamed_qr_code("+A2$B34%Z1678")
+        assert not self.test_calc.check_streamed_qr_code("A2$B34%Z1678")
+        # QRs from another schema version are uploaded, but reported
+        assert self.test_calc.check_streamed_qr_code("*A1$B34%A1678")
+        warnings = [rec.message for rec in caplog.records if rec.levelname == "WARNING"]
+        assert warnings == [
+            'Invalid QR code not uploaded: "A2$B34%Z1678"',
+            "QR code schema version doesn't match the server (v2):\t*A1$B34%A1678",
+        ]
+
+    def test_stream_qr_codes(self, caplog):
+        with mock.patch("utils.read_schema", return_value=FAKE_SCHEMA), mock.patch(
+            "builtins.open", mock.mock_open(read_data="1,1,1")
+        ), mock.patch("json.load", return_value={}):
+            from calculations import qr_input
+
+            self.test_calc = qr_input.QRInput(self.server)
+
+        def scan(qr_codes):
+            for qr_code in qr_codes:
+                # Waiting longer than STREAM_BATCH_SECONDS inserts the QRs read so far
+                if qr_code is None:
+                    time.sleep(0.3)
+                    continue
+                yield qr_code + "\n"
+
+        with mock.patch.object(self.test_calc, "STREAM_BATCH_SIZE", 2), mock.patch.object(
+            self.test_calc, "STREAM_BATCH_SECONDS", 0.1
+        ), mock.patch.object(
+            self.test_calc, "upload_qr_codes", wraps=self.test_calc.upload_qr_codes
+        ) as upload_mock:
+            assert (
+                self.test_calc.stream_qr_codes(
+                    scan(["*test", "test", "+test2", "*test3", None, "*test", "", "+test4"])
+                )
+                == 4
+            )
+        assert [call.args[0] for call in upload_mock.call_args_list] == [
+            ["*test", "+test2"],
+            ["*test3"],
+            ["*test", "+test4"],
+        ]
+        assert len(self.server.db.find("raw_qr")) == 4
+        warnings = [rec.message for rec in caplog.records if rec.levelname == "WARNING"]
+        assert 'Invalid QR code not uploaded: "test"' in warnings
+        assert "Duplicate QR code not uploaded\t*test" in warnings
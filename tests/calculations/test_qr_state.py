@@ -27,3 +27,23 @@ class TestQRState:
             {"name": "action_type", "length": 2, "type": "Enum[str]", "position": 1},
         ]
         assert expected_timeline_info == QRState.get_timeline_info()
+
+    def test_get_decompressed_names(self):
+        decompressed_names = QRState.get_decompressed_names()
+        assert decompressed_names["action_type"]["AA"] == "score_speaker"
+        assert decompressed_names["objective_tim"]["W"] == "timeline"
+        assert decompressed_names["generic_data"]["$"] == "_separator"
+        assert decompressed_names["timeline"][3] == "time"
+
+    def test_get_data_field_types(self):
+        data_field_types = QRState.get_data_field_types("objective_tim")
+        assert data_field_types["Z"] == ("team_number", "str")
+        assert data_field_types["W"] == ("timeline", ["list", "dict"])
+        # Separators aren't data fields
+        assert "$" not in data_field_types
+
+    def test_get_timeline_slices(self):
+        assert QRState.get_timeline_slices() == (
+            [("time", 0, 3, "int"), ("action_type", 3, 5, "Enum[str]")],
+            5,
+        )
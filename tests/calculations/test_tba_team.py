@@ -28,6 +28,28 @@ class TestTBATeamCalc:
         assert self.test_calc.watched_collections == ["obj_tim", "tba_tim"]
         assert self.test_calc.server == self.test_server
 
+    def test_get_cc_values(self):
+        matches = [
+            {
+                "score_breakdown": {
+                    "red": {"foulPoints": 13, "endGame": {"points": 3}},
+                    "blue": {"foulPoints": 10, "endGame": {"points": 1}},
+                }
+            }
+        ]
+        assert self.test_calc.get_cc_values(
+            matches, {"score_breakdown": "foulPoints", "alliance": "opponent"}
+        ) == [10, 13]
+        assert self.test_calc.get_cc_values(matches, {"score_breakdown": "endGame.points"}) == [
+            3,
+            1,
+        ]
+
+    def test_get_match_ages(self):
+        matches = [{"actual_time": 20}, {"actual_time": 10}, {"actual_time": 30}]
+        assert self.test_calc.get_match_ages(matches) == [1, 2, 0]
+        assert self.test_calc.get_match_ages([{}, {}]) == [1, 0]
+
     def test_run(self):
         tba_cache = [
             {
@@ -0,0 +1,67 @@
+import random
+
+from calculations.timeline_index import TimelineIndex
+
+ACTION_TYPES = ["score_amp", "score_speaker", "intake_center", "start_incap", "end_incap", "fail"]
+
+
+def filter_actions(timeline, substring_values=(), **filters):
+    """Checks every action in the timeline, the same as filter_timeline_actions used to"""
+    actions = timeline
+    for field, required_value in filters.items():
+        if field == "time":
+            actions = [a for a in actions if required_value[0] <= a["time"] <= required_value[1]]
+        elif required_value in substring_values:
+            actions = [a for a in actions if str(required_value) in str(a[field])]
+        else:
+            actions = [a for a in actions if a[field] == required_value]
+    return actions
+
+
+def test_filter():
+    timeline = [
+        {"action_type": "score_amp", "time": 140, "in_teleop": False},
+        {"action_type": "intake_center", "time": 120, "in_teleop": True},
+        {"action_type": "score_speaker", "time": 110, "in_teleop": True},
+        {"action_type": "score_amp", "time": 30, "in_teleop": True},
+    ]
+    index = TimelineIndex(timeline)
+    assert index.filter(action_type="score_amp") == [timeline[0], timeline[3]]
+    assert index.filter(action_type="score_amp", in_teleop=True) == [timeline[3]]
+    assert index.filter(in_teleop=True) == timeline[1:]
+    assert index.filter(time=[30, 120]) == timeline[1:]
+    assert index.filter(("score",), action_type="score") == [timeline[0]] + timeline[2:]
+    assert index.filter(action_type="score") == []
+    assert index.filter(("score",), action_type="score", time=[100, 150]) == [
+        timeline[0],
+        timeline[2],
+    ]
+    assert index.filter() == timeline
+    assert index.count(action_type="none") == 0
+
+
+def test_filter_matches_timeline():
+    rng = random.Random(1678)
+    for _ in range(200):
+        timeline = [
+            {
+                "action_type": rng.choice(ACTION_TYPES),
+                "time": rng.randint(0, 150),
+                "in_teleop": rng.random() < 0.5,
+            }
+            for _ in range(rng.randint(0, 30))
+        ]
+        index = TimelineIndex(timeline)
+        for _ in range(20):
+            filters = {}
+            if rng.random() < 0.8:
+                filters["action_type"] = rng.choice(ACTION_TYPES + ["score"])
+            if rng.random() < 0.5:
+                filters["in_teleop"] = rng.random() < 0.5
+            if rng.random() < 0.4:
+                start = rng.randint(0, 150)
+                filters["time"] = [start, start + rng.randint(0, 60)]
+            assert index.filter(("score",), **filters) == filter_actions(
+                timeline, ("score",), **filters
+            )
+            assert index.filter(**filters) == filter_actions(timeline, **filters)
@@ -8,7 +8,7 @@ from unittest import mock
 import bson
 import pymongo
 import pytest
-from data_transfer import cloud_db_updater, database
+from data_transfer import cloud_db_updater, database, oplog_reader
 import utils
 
 PORT = 9678
@@ -25,6 +25,7 @@ class TestCloudDBUpdater:
         assert isinstance(self.CloudDBUpdater.oplog, pymongo.collection.Collection)
         assert self.CloudDBUpdater.oplog.name == "oplog.rs"
         assert isinstance(self.CloudDBUpdater.last_timestamp, bson.Timestamp)
+        assert isinstance(self.CloudDBUpdater.oplog_reader, oplog_reader.OplogReader)
 
     def test_create_bulk_operation_delete(self):
         entry = {
@@ -63,6 +64,19 @@ class TestCloudDBUpdater:
         expected = pymongo.UpdateOne({"_id": "1234512345134556"}, {"$set": {"test": 42}})
         assert self.CloudDBUpdater.create_bulk_operation(entry) == expected
 
+    def test_create_bulk_operation_version(self):
+        entry = {
+            "ts": 12345,
+            "op": "u",
+            "ns": "test.testing",
+            "o": {"$v": 1, "$set": {"test": 42}},
+            "o2": {"_id": "1234512345134556"},
+        }
+        expected = pymongo.UpdateOne({"_id": "1234512345134556"}, {"$set": {"test": 42}})
+        assert self.CloudDBUpdater.create_bulk_operation(entry) == expected
+        # The entry is shared with the calculations, so it isn't changed
+        assert entry["o"] == {"$v": 1, "$set": {"test": 42}}
+
     def test_entries_since_last(self):
         self.CloudDBUpdater.db.insert_documents("test.testing", ({"a": 1}, {"a": 2}, {"a": 3}))
         self.CloudDBUpdater.db.delete_data("test.testing", {"a": 1})
@@ -78,6 +92,8 @@ class TestCloudDBUpdater:
             {"ns": f"{current_db}test.test", "op": "d", "o": {"_id": "1234567"}},
             {"ns": f"{current_db}.test", "op": "d", "o": {"_id": "4321"}},
             {"ns": f"{current_db}.test2", "op": "i", "o": {"_id": "43210", "b": 1}},
+            # Server-only collections aren't sent to the cloud
+            {"ns": f"{current_db}.qr_decode_cache", "op": "i", "o": {"_id": "1", "key": "a"}},
         ]
         expected = collections.defaultdict()
         expected["test"] = [
@@ -91,6 +107,21 @@ class TestCloudDBUpdater:
             changes = self.CloudDBUpdater.create_db_changes()
         assert changes == expected
 
+    def test_create_db_changes_replaced(self):
+        db = self.CloudDBUpdater.db
+        db.insert_documents("obj_team", {"team_number": "1678"})
+        self.CloudDBUpdater.update_timestamp()
+        with db.replace_collection("obj_team"):
+            db.insert_documents("obj_team", {"team_number": "254"})
+        assert self.CloudDBUpdater.get_replaced_collections() == ["obj_team"]
+        changes = self.CloudDBUpdater.create_db_changes()
+        # The cloud collection is rewritten instead of getting the writes to the shadow collection
+        assert list(changes.keys()) == ["obj_team"]
+        assert changes["obj_team"] == [
+            pymongo.DeleteMany({}),
+            pymongo.InsertOne(db.find("obj_team")[0]),
+        ]
+
     def test_get_connection_string(self):
         with mock.patch(
             "data_transfer.cloud_db_updater.open",
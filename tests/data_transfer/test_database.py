@@ -1,5 +1,6 @@
 """Tests database.py"""
 import pymongo
+import pytest
 import yaml
 
 from data_transfer import database
@@ -60,6 +61,81 @@ class TestDatabase:
         TEST_DB_HELPER.test.insert_one({"test": "test"})
         assert TEST_DB_ACTUAL.find("test", {"test": "test"}) == [TEST_DB_HELPER.test.find_one({})]
 
+    def test_find_projection(self):
+        """Tests database find with only some fields returned"""
+        TEST_DB_HELPER.test.insert_one({"a": 1, "b": 2, "c": 3})
+        assert TEST_DB_ACTUAL.find("test", projection=["a", "b"]) == [
+            TEST_DB_HELPER.test.find_one({}, {"c": 0})
+        ]
+        assert TEST_DB_ACTUAL.find("test", {"a": 1}, {"_id": 0, "c": 1}) == [{"c": 3}]
+        # Fields that documents are grouped by are always returned
+        assert TEST_DB_ACTUAL.find_grouped("test", [1], "a", projection={"_id": 0, "b": 1}) == {
+            1: [{"a": 1, "b": 2}]
+        }
+
+    def test_record_query(self):
+        """Tests that the fields queries filter by are recorded"""
+        assert database.get_query_fields(
+            {"$and": [{"a": {"$in": [1, 2]}}, {"$or": [{"b": 1, "a": 2}, {"c": 3}]}]}
+        ) == ("a", "b", "c")
+        database.QUERY_SHAPES.clear()
+        TEST_DB_ACTUAL.find("test", {"a": 1, "b": 2})
+        TEST_DB_ACTUAL.find("test", {"a": 3, "b": 4})
+        assert database.QUERY_SHAPES == {("test", ("a", "b")): 2}
+
+    def test_find_iter(self):
+        """Tests database find with documents read in batches"""
+        TEST_DB_HELPER.test.insert_many([{"a": i} for i in range(5)])
+        documents = TEST_DB_ACTUAL.find_iter("test", {"a": {"$gt": 0}}, ["a"], batch_size=2)
+        assert [document["a"] for document in documents] == [1, 2, 3, 4]
+
+    def test_replace_collection(self):
+        """Tests replacing a collection with the documents written inside the with block"""
+        TEST_DB_HELPER.test.insert_many([{"a": 1}, {"a": 2}])
+        TEST_DB_HELPER.test.create_index("a", unique=True)
+        with TEST_DB_ACTUAL.replace_collection("test"):
+            # Reads and writes in this thread go to the shadow collection
+            assert TEST_DB_ACTUAL.find("test") == []
+            TEST_DB_ACTUAL.insert_documents("test", {"a": 3})
+            assert TEST_DB_HELPER.test.count_documents({}) == 2
+        assert [doc["a"] for doc in TEST_DB_ACTUAL.find("test")] == [3]
+        assert "a_1" in TEST_DB_HELPER.test.index_information()
+        assert "test" + database.SHADOW_SUFFIX not in TEST_DB_HELPER.list_collection_names()
+        # The collection is unchanged if there is an error
+        with pytest.raises(ValueError):
+            with TEST_DB_ACTUAL.replace_collection("test"):
+                TEST_DB_ACTUAL.insert_documents("test", {"a": 4})
+                raise ValueError
+        assert [doc["a"] for doc in TEST_DB_ACTUAL.find("test")] == [3]
+        assert "test" + database.SHADOW_SUFFIX not in TEST_DB_HELPER.list_collection_names()
+
+    def test_find_grouped(self):
+        """Tests database find with documents grouped by key"""
+        TEST_DB_HELPER.test.insert_many(
+            [
+                {"team_number": "1678", "match_number": 1, "a": 1},
+                {"team_number": "1678", "match_number": 1, "a": 2},
+                {"team_number": "1678", "match_number": 2, "a": 3},
+                {"team_number": "254", "match_number": 1, "a": 4},
+            ]
+        )
+        # Group by one field
+        grouped = TEST_DB_ACTUAL.find_grouped("test", ["1678", "973"], group_by="team_number")
+        assert list(grouped.keys()) == ["1678", "973"]
+        assert [document["a"] for document in grouped["1678"]] == [1, 2, 3]
+        assert grouped["973"] == []
+        # Group by multiple fields
+        grouped = TEST_DB_ACTUAL.find_grouped(
+            "test", [("1678", 1), ("254", 1), ("254", 2)], group_by=("team_number", "match_number")
+        )
+        assert [document["a"] for document in grouped[("1678", 1)]] == [1, 2]
+        assert [document["a"] for document in grouped[("254", 1)]] == [4]
+        assert grouped[("254", 2)] == []
+        # With an extra query
+        grouped = TEST_DB_ACTUAL.find_grouped("test", ["1678"], "team_number", {"a": {"$gt": 1}})
+        assert [document["a"] for document in grouped["1678"]] == [2, 3]
+        assert TEST_DB_ACTUAL.find_grouped("test", [], "team_number") == {}
+
     def test_get_tba_cache(self):
         """Tests tba cache read"""
         TEST_DB_HELPER.tba_cache.insert_one({"api_url": "test"})
@@ -82,6 +158,30 @@ class TestDatabase:
         del test_cache["_id"]
         assert test_cache == {"data": {"a": "b"}, "etag": "ETAG", "api_url": "test2"}
 
+    def test_mark_tba_cache_fresh(self):
+        """Tests recording when the tba cache was last checked"""
+        TEST_DB_ACTUAL.update_tba_cache({"a": "b"}, "test", "ETAG", timestamp=1.0)
+        assert TEST_DB_HELPER.tba_cache.find_one({"api_url": "test"})["timestamp"] == 1.0
+        TEST_DB_ACTUAL.mark_tba_cache_fresh("test", 2.0)
+        test_cache = TEST_DB_HELPER.tba_cache.find_one({"api_url": "test"})
+        assert test_cache["timestamp"] == 2.0
+        assert test_cache["data"] == {"a": "b"}
+
+    def test_qr_decode_cache(self):
+        """Tests reading, writing and pruning cached QR decompression results"""
+        assert TEST_DB_ACTUAL.get_qr_decode_cache(["a"]) == {}
+        TEST_DB_ACTUAL.update_qr_decode_cache({"a": {"ulid": "1"}, "b": {"ulid": "2"}})
+        TEST_DB_ACTUAL.update_qr_decode_cache({"a": {"ulid": "3"}})
+        assert TEST_DB_ACTUAL.get_qr_decode_cache(["a", "c"]) == {"a": {"ulid": "3"}}
+        # A QR's old result is deleted when its key changes
+        TEST_DB_ACTUAL.update_qr_decode_cache({"c": {"ulid": "2"}})
+        assert TEST_DB_ACTUAL.get_qr_decode_cache(["a", "b", "c"]) == {
+            "a": {"ulid": "3"},
+            "c": {"ulid": "2"},
+        }
+        TEST_DB_ACTUAL.prune_qr_decode_cache(["a"])
+        assert TEST_DB_HELPER.qr_decode_cache.count_documents({}) == 1
+
     def test_delete_data(self):
         """Tests deletion of data"""
         TEST_DB_HELPER.test.insert_many([{"test": "test"}, {"test1": "test1"}])
@@ -95,6 +195,22 @@ class TestDatabase:
         TEST_DB_ACTUAL.insert_documents("test", {"test_2": "b"})
         assert TEST_DB_HELPER.test.find_one({"test_2": "b"})
 
+    def test_insert_raw_qrs(self):
+        """Tests inserting raw QRs, skipping QRs that are already in raw_qr"""
+        # Inserted before raw_qr had digests
+        TEST_DB_HELPER.raw_qr.insert_one({"data": "*a"})
+        # A new Database, so it creates the digest index
+        test_db = database.Database()
+        test_db.migrate_qr_digests()
+        inserted = test_db.insert_raw_qrs([{"data": "*a"}, {"data": "+b"}])
+        assert [document["data"] for document in inserted] == ["+b"]
+        inserted = test_db.insert_raw_qrs([{"data": "+b"}, {"data": "+c"}])
+        assert [document["data"] for document in inserted] == ["+c"]
+        assert TEST_DB_HELPER.raw_qr.count_documents({}) == 3
+        assert TEST_DB_HELPER.raw_qr.find_one({"data": "*a"})["digest"] == database.get_qr_digest(
+            "*a"
+        )
+
     def test_update_document(self):
         """Tests updating of documents"""
         TEST_DB_HELPER.test.insert_one({"test": "a"})
@@ -105,6 +221,30 @@ class TestDatabase:
         TEST_DB_ACTUAL.update_document("test", {"test_2": "c"}, {"test_2": "a"})
         assert TEST_DB_HELPER.test.find_one({"test_2": "c"})["test_2"] == "c"
 
+    def test_bulk_upsert(self):
+        """Tests upserting many documents at once"""
+        TEST_DB_HELPER.test.insert_one({"team_number": "1678", "match_number": 1, "a": 1})
+        result = TEST_DB_ACTUAL.bulk_upsert(
+            "test",
+            [
+                {"team_number": "1678", "match_number": 1, "b": 2},
+                {"team_number": "254", "match_number": 1, "a": 3},
+                # Same key as the last document, so its fields overwrite the last document's
+                {"team_number": "254", "match_number": 1, "a": 4, "b": 5},
+            ],
+            ["team_number", "match_number"],
+        )
+        assert result.matched_count == 1
+        assert result.upserted_count == 1
+        first = TEST_DB_HELPER.test.find_one({"team_number": "1678"}, {"_id": 0})
+        assert first == {"team_number": "1678", "match_number": 1, "a": 1, "b": 2}
+        second = TEST_DB_HELPER.test.find_one({"team_number": "254"}, {"_id": 0})
+        assert second == {"team_number": "254", "match_number": 1, "a": 4, "b": 5}
+        assert TEST_DB_ACTUAL.bulk_upsert("test", [], ["team_number"]) is None
+        # Raw QRs can't be modified
+        assert TEST_DB_ACTUAL.bulk_upsert("raw_qr", [{"data": "a"}], ["data"]) is None
+        assert TEST_DB_HELPER.raw_qr.find_one({"data": "a"}) is None
+
     def test_update_qr_blocklist_status(self):
         """Tests blocklisting of qrs"""
         TEST_DB_HELPER.raw_qr.insert_one(
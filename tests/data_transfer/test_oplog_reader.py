@@ -0,0 +1,86 @@
+from unittest import mock
+
+from data_transfer import database, oplog_reader
+from calculations.base_calculations import BaseCalculations
+
+
+class TestOplogReader:
+    def setup_method(self, method):
+        self.db = database.Database()
+        self.oplog = self.db.client.local.oplog.rs
+        self.start_timestamp = BaseCalculations.get_latest_timestamp(self.oplog)
+        self.reader = oplog_reader.OplogReader(self.oplog, self.start_timestamp)
+        self.namespace = f"{self.db.name}.testing"
+
+    def test_entries_since(self):
+        self.db.insert_documents("testing", [{"a": 1}, {"a": 2}, {"a": 3}])
+        self.db.delete_data("testing", {"a": 1})
+        self.db.update_document("testing", {"b": 2}, {"a": 2})
+        self.db.insert_documents("testing2", {"c": 1})
+        entries = self.reader.entries_since(self.start_timestamp, [self.namespace])
+        # Same results as querying the oplog directly
+        expected = list(
+            self.oplog.find(
+                {
+                    "ts": {"$gt": self.start_timestamp},
+                    "op": {"$in": ["i", "d", "u"]},
+                    "ns": {"$in": [self.namespace]},
+                }
+            )
+        )
+        assert entries == expected
+        assert len(entries) == 5
+        # Entries from several namespaces
+        namespaces = [self.namespace, f"{self.db.name}.testing2"]
+        assert len(self.reader.entries_since(self.start_timestamp, namespaces)) == 6
+        # Only entries after the timestamp
+        assert self.reader.entries_since(entries[-1]["ts"], [self.namespace]) == []
+
+    def test_entries_since_reads_oplog_once(self):
+        self.db.insert_documents("testing", {"a": 1})
+        with mock.patch.object(self.reader, "find", wraps=self.reader.find) as mock_find:
+            first = self.reader.entries_since(self.start_timestamp, [self.namespace])
+            second = self.reader.entries_since(self.start_timestamp, [self.namespace])
+        assert first == second
+        # The second call only asks for entries after the newest cached entry
+        assert mock_find.call_args_list[1].args[0]["ts"]["$gt"] >= first[-1]["ts"]
+
+    def test_backfill(self):
+        self.db.insert_documents("testing", {"a": 1})
+        reader = oplog_reader.OplogReader(
+            self.oplog, BaseCalculations.get_latest_timestamp(self.oplog)
+        )
+        self.db.insert_documents("testing", {"a": 2})
+        # Timestamp from before the reader was created
+        entries = reader.entries_since(self.start_timestamp, [self.namespace])
+        assert [entry["o"]["a"] for entry in entries] == [1, 2]
+        assert reader.start_timestamps == {self.namespace: self.start_timestamp}
+
+    def test_only_caches_read_namespaces(self):
+        self.db.insert_documents("testing", {"a": 1})
+        self.db.insert_documents("testing2", {"b": 1})
+        assert len(self.reader.entries_since(self.start_timestamp, [self.namespace])) == 1
+        self.db.insert_documents("testing2", {"b": 2})
+        self.reader.entries_since(self.start_timestamp, [self.namespace])
+        assert list(self.reader.entries) == [self.namespace]
+        # Namespaces that weren't cached are read when they are asked for
+        entries = self.reader.entries_since(self.start_timestamp, [f"{self.db.name}.testing2"])
+        assert [entry["o"]["b"] for entry in entries] == [1, 2]
+
+    def test_skips_server_only_collections(self):
+        self.db.db.qr_decode_cache.insert_one({"key": "a"})
+        namespace = f"{self.db.name}.qr_decode_cache"
+        assert self.reader.entries_since(self.start_timestamp, [namespace]) == []
+        assert namespace not in self.reader.start_timestamps
+
+    def test_prune(self):
+        self.db.insert_documents("testing", [{"a": 1}, {"a": 2}])
+        entries = self.reader.entries_since(self.start_timestamp, [self.namespace])
+        self.reader.prune({self.namespace: entries[0]["ts"]})
+        assert self.reader.entries[self.namespace] == entries[1:]
+        assert self.reader.start_timestamps[self.namespace] == entries[0]["ts"]
+        # Namespaces that aren't cached are ignored
+        self.reader.prune({f"{self.db.name}.testing2": entries[1]["ts"]})
+        assert f"{self.db.name}.testing2" not in self.reader.start_timestamps
+        # Pruned entries are read again when needed
+        assert self.reader.entries_since(self.start_timestamp, [self.namespace]) == entries
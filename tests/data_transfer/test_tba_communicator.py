@@ -1,7 +1,11 @@
 from data_transfer import tba_communicator
+import http.server
+import json
+import threading
+import time
 import pytest
 import requests
-from unittest.mock import patch, mock_open
+from unittest.mock import ANY, patch, mock_open
 
 test_cache = {
     "api_url": "event/2020caln/teams",
@@ -12,7 +16,44 @@ test_cache = {
 test_json = {"teams": ["frc1678", "frc4414", "frc1671"]}
 
 
-@patch("requests.get")
+@pytest.fixture
+def tba_stub():
+    """Runs a local stand-in for the TBA API and points tba_communicator at it
+
+    Yields the paths requested from it. Paths starting with /slow don't respond until the test ends.
+    """
+    requested_paths = []
+    test_finished = threading.Event()
+
+    class StubHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            requested_paths.append(self.path)
+            if self.path.startswith("/slow"):
+                test_finished.wait(5)
+                return
+            body = json.dumps({"path": self.path}).encode()
+            self.send_response(200)
+            self.send_header("etag", "ETAG")
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    stub = http.server.ThreadingHTTPServer(("localhost", 0), StubHandler)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    with patch.object(tba_communicator, "BASE_URL", f"http://localhost:{stub.server_port}"), patch(
+        "data_transfer.tba_communicator.get_api_key", return_value="api_key"
+    ):
+        yield requested_paths
+    test_finished.set()
+    stub.shutdown()
+    stub.server_close()
+
+
+@patch("requests.Session.get")
 def test_connection_error(get_mock, caplog):
     get_mock.side_effect = requests.exceptions.ConnectionError()
     with patch("data_transfer.tba_communicator.get_api_key", return_value="api_key"):
@@ -22,24 +63,28 @@ def test_connection_error(get_mock, caplog):
     ]
 
 
-@patch("requests.get")
+@patch("requests.Session.get")
 def test_status_code_304(get_mock):
     get_mock.return_value.status_code = 304
-    with patch("data_transfer.database.Database.get_tba_cache", return_value=test_cache), patch(
+    with patch("data_transfer.database.Database.mark_tba_cache_fresh") as mark_mock, patch(
         "data_transfer.tba_communicator.get_api_key", return_value="api_key"
     ):
-        assert tba_communicator.tba_request("events/2020caln/teams") == test_cache["data"]
+        assert (
+            tba_communicator.revalidate("events/2020caln/teams", test_cache) == test_cache["data"]
+        )
+    assert get_mock.call_args.kwargs["headers"]["If-None-Match"] == test_cache["etag"]
+    mark_mock.assert_called_once_with("events/2020caln/teams", ANY)
 
 
-@patch("requests.get")
+@patch("requests.Session.get")
 def test_status_code_200(get_mock):
     get_mock.return_value.status_code = 200
     get_mock.return_value.json.return_value = test_json
     get_mock.return_value.headers = {"etag": 'W/"fb0425e78890c8df10daa66401177a80c154eeb2"'}
 
     with patch("data_transfer.database.Database.update_tba_cache") as update_mock, patch(
-        "data_transfer.tba_communicator.get_api_key", return_value="api_key"
-    ):
+        "data_transfer.database.Database.get_tba_cache", return_value=None
+    ), patch("data_transfer.tba_communicator.get_api_key", return_value="api_key"):
         assert tba_communicator.tba_request("events/2020caln/teams") == {
             "teams": ["frc1678", "frc4414", "frc1671"]
         }
@@ -47,18 +92,134 @@ def test_status_code_200(get_mock):
             {"teams": ["frc1678", "frc4414", "frc1671"]},
             "events/2020caln/teams",
             'W/"fb0425e78890c8df10daa66401177a80c154eeb2"',
+            timestamp=ANY,
         )
 
 
-@patch("requests.get")
-def test_error_code(get_mock):
+@patch("requests.Session.get")
+def test_error_code(get_mock, caplog):
     get_mock.return_value.status_code = "abcd"
-    with pytest.raises(Warning, match="Request failed with status code abcd"), patch(
+    with patch("data_transfer.database.Database.get_tba_cache", return_value=None), patch(
         "data_transfer.tba_communicator.get_api_key", return_value="api_key"
     ):
-        tba_communicator.tba_request("events/2020caln/teams")
+        assert tba_communicator.tba_request("events/2020caln/teams") is None
+        # Cached data is used if TBA responds with an error
+        assert (
+            tba_communicator.revalidate("events/2020caln/teams", test_cache) == test_cache["data"]
+        )
+    assert ["Error: TBA request from events/2020caln/teams failed with status code abcd"] * 2 == [
+        rec.message for rec in caplog.records if rec.levelname == "ERROR"
+    ]
+
+
+@patch("requests.Session.get")
+def test_fresh_cache(get_mock):
+    fresh_cache = {**test_cache, "timestamp": time.time()}
+    hits = tba_communicator.CACHE_STATS["hits"]
+    with patch("data_transfer.database.Database.get_tba_cache", return_value=fresh_cache):
+        assert tba_communicator.tba_request("events/2020caln/teams") == test_cache["data"]
+    get_mock.assert_not_called()
+    assert tba_communicator.get_cache_stats()["hits"] == hits + 1
+
+
+def test_stale_cache():
+    # test_cache has no timestamp, so it is stale
+    with patch("data_transfer.database.Database.get_tba_cache", return_value=test_cache), patch(
+        "data_transfer.tba_communicator.start_revalidation"
+    ) as revalidation_mock:
+        assert tba_communicator.tba_request("events/2020caln/teams") == test_cache["data"]
+    revalidation_mock.assert_called_once_with("events/2020caln/teams", test_cache, None)
+
+
+@patch("requests.Session.get")
+def test_revalidate_offline(get_mock):
+    get_mock.side_effect = requests.exceptions.ConnectionError()
+    with patch("data_transfer.tba_communicator.get_api_key", return_value="api_key"):
+        assert (
+            tba_communicator.revalidate("events/2020caln/teams", test_cache) == test_cache["data"]
+        )
+        assert tba_communicator.revalidate("events/2020caln/teams", None) is None
+
+
+def test_get_cache_ttl():
+    assert tba_communicator.get_cache_ttl("event/2020caln/matches") == 60
+    assert tba_communicator.get_cache_ttl("event/2020caln/teams/simple") == 3600
+    assert (
+        tba_communicator.get_cache_ttl("event/2020caln")
+        == tba_communicator.DEFAULT_CACHE_TTL_SECONDS
+    )
+
+
+def test_add_cache_stat():
+    start = tba_communicator.CACHE_STATS["test_stat"]
+
+    def add():
+        for _ in range(1000):
+            tba_communicator.add_cache_stat("test_stat")
+
+    threads = [threading.Thread(target=add) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert tba_communicator.get_cache_stats()["test_stat"] == start + 8000
 
 
 def test_get_api_key():
     with patch("builtins.open", mock_open(read_data="api_key")):
         assert tba_communicator.get_api_key() == "api_key"
+
+
+def test_stub_request(tba_stub):
+    assert tba_communicator.tba_request("event/2020caln/teams", write_db=False) == {
+        "path": "/event/2020caln/teams"
+    }
+    assert tba_stub == ["/event/2020caln/teams"]
+
+
+def test_request_memo(tba_stub):
+    with tba_communicator.request_memo():
+        threads = [
+            threading.Thread(
+                target=tba_communicator.tba_request, args=("event/2020caln/matches", False)
+            )
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        response = tba_communicator.tba_request("event/2020caln/matches", False)
+        # Each caller gets its own copy
+        response["path"] = None
+        assert tba_communicator.tba_request("event/2020caln/matches", False) == {
+            "path": "/event/2020caln/matches"
+        }
+    assert tba_stub == ["/event/2020caln/matches"]
+    # Outside of the memo, every request is sent
+    tba_communicator.tba_request("event/2020caln/matches", False)
+    assert len(tba_stub) == 2
+
+
+def test_timeout(tba_stub, caplog):
+    assert tba_communicator.tba_request("slow", False, timeout=(1, 0.2)) is None
+    assert ["Error: TBA request from slow timed out."] == [
+        rec.message for rec in caplog.records if rec.levelname == "ERROR"
+    ]
+
+
+@patch("requests.Session.get")
+def test_synchronous_revalidation(get_mock):
+    get_mock.return_value.status_code = 304
+    with patch("data_transfer.database.Database.get_tba_cache", return_value=test_cache), patch(
+        "data_transfer.database.Database.mark_tba_cache_fresh"
+    ) as mark_mock, patch(
+        "data_transfer.tba_communicator.start_revalidation"
+    ) as revalidation_mock, patch(
+        "data_transfer.tba_communicator.get_api_key", return_value="api_key"
+    ):
+        with tba_communicator.synchronous_revalidation():
+            assert tba_communicator.tba_request("events/2020caln/teams") == test_cache["data"]
+    revalidation_mock.assert_not_called()
+    mark_mock.assert_called_once_with("events/2020caln/teams", ANY)
+    assert get_mock.call_args.kwargs["headers"]["If-None-Match"] == test_cache["etag"]
@@ -1,4 +1,4 @@
-from cc import cc
+from cc import cc, CCEngine
 
 
 def test_cc():
@@ -30,3 +30,33 @@ def test_cc_empty_input():
     result = cc(data)
     expected_result = {}
     assert result == expected_result
+
+
+def test_cc_engine_solve_many():
+    engine = CCEngine([["A", "B"], ["A", "C"], ["B", "C"]])
+    result = engine.solve_many({"first": [10.0, 5.0, 7.5], "second": [2.0, 2.0, 2.0]})
+    assert result == {
+        "first": {"A": 3.75, "B": 6.25, "C": 1.25},
+        "second": {"A": 1, "B": 1, "C": 1},
+    }
+    assert engine.solve_many({}) == {}
+
+
+def test_cc_engine_add_event():
+    engine = CCEngine([["A", "B"], ["A", "C"]])
+    engine.solve([10.0, 5.0])
+    engine.add_event(["B", "C"])
+    assert engine.solve([10.0, 5.0, 7.5]) == cc(
+        [
+            {"parties": ["A", "B"], "value": 10.0},
+            {"parties": ["A", "C"], "value": 5.0},
+            {"parties": ["B", "C"], "value": 7.5},
+        ]
+    )
+
+
+def test_cc_engine_weights():
+    engine = CCEngine([["A"], ["A"], ["B"]])
+    assert engine.solve([1.0, 4.0, 2.0]) == {"A": 2.5, "B": 2.0}
+    # Weighting the second event three times as much as the first
+    assert engine.solve([1.0, 4.0, 2.0], weights=[1, 3, 1]) == {"A": 3.25, "B": 2.0}
@@ -0,0 +1,42 @@
+import random
+
+from calculations.base_calculations import BaseCalculations
+from calculations.obj_tims import ObjTIMCalcs
+from consolidation import consolidate_rows, pack_rows, weighted_sums
+import utils
+
+
+def test_pack_rows():
+    values, mask = pack_rows([[1, 2], [], [3]])
+    assert values.tolist() == [[1, 2], [0, 0], [3, 0]]
+    assert mask.tolist() == [[True, True], [False, False], [True, False]]
+
+
+def test_consolidate_rows():
+    rows = [[3, 3, 3], [4, 4, 4, 4, 1], [2, 2, 1], [], [1, 4], [2, 1, 6, 5], [1, 2, 7]]
+    assert consolidate_rows(rows) == [3, 4, 2, 0, 2, 3, 2]
+    assert consolidate_rows([[1, 2, 7], []], decimal=True) == [2.23, 0]
+    assert consolidate_rows([]) == []
+
+
+def test_consolidate_rows_matches_consolidate_nums():
+    # consolidate_nums doesn't use the calculation's attributes
+    calc = ObjTIMCalcs.__new__(ObjTIMCalcs)
+    rng = random.Random(1678)
+    rows = [
+        [rng.choice([rng.randint(0, 9), round(rng.uniform(0, 20), 2)]) for _ in range(n)]
+        for n in [rng.randint(0, 5) for _ in range(2000)]
+    ]
+    for decimal in [False, True]:
+        expected = [calc.consolidate_nums(row, decimal) for row in rows]
+        for result, expected_result in zip(consolidate_rows(rows, decimal), expected):
+            assert utils.near(result, expected_result)
+            assert type(result) == type(expected_result)
+
+
+def test_weighted_sums():
+    rows = [[1, 2, 3], [4, 5, 6.5]]
+    weights = [[1, None, 1], [2, 1.5, None], [None, None, None]]
+    assert weighted_sums(rows, weights) == [[4, 5.0, 0], [10.5, 15.5, 0]]
+    assert type(weighted_sums(rows, weights)[0][0]) == int
+    assert weighted_sums([], weights) == []
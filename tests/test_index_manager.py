@@ -0,0 +1,69 @@
+import json
+
+import pymongo
+
+from data_transfer import database
+import index_manager
+
+DATABASE = database.Database()
+
+
+def test_save_query_shapes(tmp_path):
+    database.QUERY_SHAPES.clear()
+    database.record_query("test", {"a": 1, "b": 2})
+    database.record_query("test", {"a": 3, "b": 4})
+    database.record_query("test2", {})
+    path = str(tmp_path / "query_shapes.json")
+    index_manager.save_query_shapes(path)
+    with open(path) as file:
+        assert json.load(file) == [
+            {"collection": "test", "fields": ["a", "b"], "count": 2},
+            {"collection": "test2", "fields": [], "count": 1},
+        ]
+    assert index_manager.load_query_shapes(path) == [
+        {"collection": "test", "fields": ["a", "b"], "count": 2},
+        {"collection": "test2", "fields": [], "count": 1},
+    ]
+
+
+def test_get_plan_stages():
+    plan = {
+        "stage": "FETCH",
+        "inputStage": {"stage": "OR", "inputStages": [{"stage": "IXSCAN"}, {"stage": "COLLSCAN"}]},
+    }
+    assert index_manager.get_plan_stages(plan) == ["FETCH", "OR", "IXSCAN", "COLLSCAN"]
+
+
+def test_suggest_index():
+    assert index_manager.suggest_index({"fields": ["team_number", "match_number"]}) == [
+        ("team_number", pymongo.ASCENDING),
+        ("match_number", pymongo.ASCENDING),
+    ]
+
+
+class TestManageIndexes:
+    def setup_method(self, method):
+        DATABASE.client.drop_database(DATABASE.name)
+        DATABASE.insert_documents("test", [{"a": 1, "b": 2}, {"a": 2, "b": 3}])
+        self.shapes = [
+            {"collection": "test", "fields": ["a", "b"], "count": 5},
+            {"collection": "test", "fields": [], "count": 1},
+        ]
+
+    def test_manage_indexes(self, caplog):
+        report = index_manager.manage_indexes(DATABASE, self.shapes)
+        # Queries without fields are skipped
+        assert len(report) == 1
+        assert report[0]["collscan"]
+        assert "COLLSCAN on test" in caplog.text
+        # Only reports the missing index
+        assert list(DATABASE.db.test.index_information().keys()) == ["_id_"]
+
+    def test_manage_indexes_create(self):
+        report = index_manager.manage_indexes(DATABASE, self.shapes, create=True)
+        assert report[0]["collscan"]
+        assert "a_1_b_1" in DATABASE.db.test.index_information()
+        # The query uses the new index
+        report = index_manager.manage_indexes(DATABASE, self.shapes)
+        assert not report[0]["collscan"]
+        assert "IXSCAN" in report[0]["stages"]
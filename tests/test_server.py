@@ -29,6 +29,18 @@ class TestServer:
         calcs = s.load_calculations()
         assert calcs == [mock_import.return_value.test()]
 
+    @mock.patch("server.importlib.import_module")
+    @mock.patch("server.yaml.load", return_value=[{"import_path": "a.b", "class_name": "test"}])
+    def test_load_calculations_startup_times(self, mock_calc_dict, mock_import, caplog):
+        with mock.patch("server.Server.ask_calc_all_data", return_value=False):
+            s = server.Server()
+        assert list(s.startup_times.keys()) == ["a.b.test"]
+        assert s.startup_times["a.b.test"]["import"] >= 0
+        assert s.startup_times["a.b.test"]["init"] >= 0
+        s.log_startup_times()
+        messages = [rec.message for rec in caplog.records if rec.levelname == "INFO"]
+        assert any(message.startswith("a.b.test: import") for message in messages)
+
     @mock.patch("server.Server.ask_calc_all_data", return_value=False)
     @mock.patch("server.yaml.load", return_value=[{"import_path": "a.b", "class_name": "test"}])
     def test_load_calculations_import_error(self, mock_calc_dict, mock_calc_all_data, caplog):
@@ -69,3 +81,204 @@ class TestServer:
         s.run_calculations()
         for c in calcs:
             c.run.assert_called_once()
+
+    def test_get_calculation_dependencies(self):
+        calcs = [
+            mock.MagicMock(
+                watched_collections=[],
+                extra_read_collections=["raw_qr"],
+                output_collections=["raw_qr"],
+            ),
+            mock.MagicMock(
+                watched_collections=["raw_qr"],
+                extra_read_collections=[],
+                output_collections=["subj_tim"],
+            ),
+            mock.MagicMock(
+                watched_collections=[],
+                extra_read_collections=["tba_tim"],
+                output_collections=["tba_tim"],
+            ),
+            mock.MagicMock(
+                watched_collections=["subj_tim"],
+                extra_read_collections=[],
+                output_collections=["subj_team"],
+            ),
+            # Doesn't declare its collections, so it has to run after everything else
+            mock.MagicMock(),
+        ]
+        with mock.patch("server.Server.load_calculations", return_value=calcs), mock.patch(
+            "server.Server.ask_calc_all_data", return_value=False
+        ):
+            s = server.Server()
+        assert s.get_calculation_dependencies() == {
+            0: set(),
+            1: {0},
+            2: set(),
+            3: {1},
+            4: {0, 1, 2, 3},
+        }
+
+    def test_run_calculations_order(self):
+        order = []
+        calcs = []
+        for name, watched, output in [
+            ("decompressor", ["raw_qr"], ["subj_tim"]),
+            ("subj_team", ["subj_tim"], ["subj_team"]),
+            ("tba_tims", [], ["tba_tim"]),
+        ]:
+            calc = mock.MagicMock(
+                watched_collections=watched, extra_read_collections=[], output_collections=output
+            )
+            calc.run.side_effect = lambda name=name: order.append(name)
+            del calc.is_reinsert
+            calcs.append(calc)
+        with mock.patch("server.Server.load_calculations", return_value=calcs), mock.patch(
+            "server.Server.ask_calc_all_data", return_value=False
+        ):
+            s = server.Server()
+        s.run_calculations()
+        assert sorted(order) == ["decompressor", "subj_team", "tba_tims"]
+        assert order.index("decompressor") < order.index("subj_team")
+
+    def test_get_triggered_calculations(self):
+        calcs = [
+            mock.MagicMock(watched_collections=[]),
+            mock.MagicMock(watched_collections=["raw_qr"]),
+            mock.MagicMock(watched_collections=["obj_tim", "subj_tim"]),
+            # Doesn't declare its watched collections, so it always runs
+            mock.MagicMock(watched_collections=NotImplemented),
+        ]
+        with mock.patch("server.Server.load_calculations", return_value=calcs):
+            s = server.Server(daemon=True)
+        assert s.calc_all_data == False
+        assert s.get_triggered_calculations({"subj_tim"}) == {2, 3}
+        assert s.get_triggered_calculations(set()) == {3}
+        assert s.get_polled_calculations() == {0}
+
+    def test_should_run_daemon(self):
+        calc = mock.MagicMock(is_interactive=True)
+        del calc.is_reinsert
+        with mock.patch("server.Server.load_calculations", return_value=[calc]):
+            s = server.Server(daemon=True)
+        assert s.should_run(calc) == False
+        s.daemon = False
+        assert s.should_run(calc) == True
+
+    def test_start_qr_stream(self):
+        calcs = [mock.MagicMock(spec=["run"]), mock.MagicMock()]
+        with mock.patch("server.Server.load_calculations", return_value=calcs):
+            s = server.Server(daemon=True, stream_qrs=True)
+        with mock.patch("server.threading.Thread") as mock_thread:
+            s.start_qr_stream()
+        mock_thread.assert_called_once_with(
+            target=calcs[1].stream_qr_codes, args=(server.sys.stdin,), name="qr-stream", daemon=True
+        )
+        mock_thread.return_value.start.assert_called_once()
+
+    def test_wait_for_changes(self):
+        with mock.patch("server.Server.load_calculations", return_value=[]):
+            s = server.Server(daemon=True)
+        with s.watch_changes() as stream:
+            s.db.insert_documents("raw_qr", [{"data": "a"}, {"data": "b"}])
+            s.db.insert_documents("obj_tim", {"team_number": "1678"})
+            assert s.wait_for_changes(stream, timeout=10) == {"raw_qr", "obj_tim"}
+            # Nothing changed, so it returns after the timeout
+            assert s.wait_for_changes(stream, timeout=0.5) == set()
+
+    def test_run_cycle_daemon_no_duplicate_tims(self):
+        from calculations import decompressor
+
+        with mock.patch("server.Server.load_calculations", return_value=[]):
+            s = server.Server(daemon=True)
+        s.calculations = [decompressor.Decompressor(s)]
+        version = decompressor.Decompressor.SCHEMA["schema_file"]["version"]
+        for match_number, ulid in [
+            (51, "01GWSYJHR5EC6PAKCS79YZAF3Z"),
+            (52, "01GWSYKDZDM45M1K4ZBHN6G97H"),
+        ]:
+            s.db.insert_documents(
+                "raw_qr",
+                {
+                    "data": f"+A{version}$B{match_number}$C9321$Dv1.3$EXvfaPcSrgJw25VKrcsphdbyEVjmHrH1V$FFALSE%Z3603$Y13$X2$W000AA001AB005AV006AB007AC008AD$VTRUE$UO$TN$SN$RFALSE",
+                    "blocklisted": False,
+                    "override": {},
+                    "ulid": ulid,
+                },
+            )
+            s.run_cycle(s.get_triggered_calculations({"raw_qr"}))
+        ulids = [tim["ulid"] for tim in s.db.find("unconsolidated_obj_tim")]
+        assert sorted(ulids) == ["01GWSYJHR5EC6PAKCS79YZAF3Z", "01GWSYKDZDM45M1K4ZBHN6G97H"]
+
+    def test_run_calculation_timestamp(self):
+        calc = mock.MagicMock()
+        with mock.patch("server.Server.load_calculations", return_value=[calc]):
+            s = server.Server(daemon=True)
+        calc.timestamp = s.oplog_timestamp
+        calc.run.side_effect = lambda: s.db.insert_documents("obj_tim", {"team_number": "1678"})
+        s.run_calculation(calc)
+        # Changes made while the calculation ran are read again next time
+        assert len(s.oplog_reader.entries_since(calc.timestamp, [f"{s.db.name}.obj_tim"])) == 1
+        calc.run.side_effect = ValueError
+        with pytest.raises(ValueError):
+            s.run_calculation(calc)
+        assert len(s.oplog_reader.entries_since(calc.timestamp, [f"{s.db.name}.obj_tim"])) == 1
+
+    def test_prune_oplog_reader(self):
+        calcs = [
+            mock.MagicMock(watched_collections=["raw_qr"]),
+            mock.MagicMock(watched_collections=["obj_tim"]),
+            mock.MagicMock(watched_collections=[]),
+        ]
+        with mock.patch("server.Server.load_calculations", return_value=calcs):
+            s = server.Server(daemon=True)
+        for calc in calcs:
+            calc.timestamp = s.oplog_timestamp
+        s.db.insert_documents("raw_qr", {"data": "a"})
+        s.db.insert_documents("obj_tim", {"team_number": "1678"})
+        namespaces = [f"{s.db.name}.raw_qr", f"{s.db.name}.obj_tim"]
+        assert len(s.oplog_reader.entries_since(s.oplog_timestamp, namespaces)) == 2
+        # Only the raw_qr calculation has read its entries
+        calcs[0].timestamp = server.base_calculations.BaseCalculations.get_latest_timestamp(s.oplog)
+        s.prune_oplog_reader()
+        assert s.oplog_reader.entries[namespaces[0]] == []
+        assert len(s.oplog_reader.entries[namespaces[1]]) == 1
+
+    def test_run_calculations_indexes(self):
+        calcs = [mock.MagicMock(), mock.MagicMock()]
+        with mock.patch("server.Server.load_calculations", return_value=calcs), mock.patch(
+            "server.Server.ask_calc_all_data", return_value=False
+        ):
+            s = server.Server()
+        s.run_calculations({1})
+        calcs[0].run.assert_not_called()
+        calcs[1].run.assert_called_once()
+
+    @mock.patch("server.Server.load_calculations", return_value=[])
+    def test_get_event_matches(self, mock_load):
+        with mock.patch("server.Server.ask_calc_all_data", return_value=False):
+            s = server.Server()
+        matches = [
+            {
+                "comp_level": "qm",
+                "match_number": 1,
+                "alliances": {
+                    "red": {"team_keys": ["frc1678"]},
+                    "blue": {"team_keys": ["frc254"]},
+                },
+            }
+        ]
+        with mock.patch(
+            "data_transfer.tba_communicator.tba_request", return_value=matches
+        ) as mock_request:
+            assert s.get_event_matches().get_teams(1) == {"1678", "254"}
+            s.get_event_matches()
+            mock_request.assert_called_once()
+            # Each cycle requests the matches again
+            s.run_cycle()
+            s.get_event_matches()
+            assert mock_request.call_count == 2
+        s.event_matches = None
+        s.db.update_tba_cache(matches, f"event/{server.utils.TBA_EVENT_KEY}/matches")
+        with mock.patch("data_transfer.tba_communicator.tba_request", return_value=None):
+            assert s.get_event_matches().get_match(1) == matches[0]
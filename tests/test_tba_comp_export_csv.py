@@ -1,4 +1,5 @@
 import tba_comp_export_csv
+import time
 import warnings
 from data_transfer import tba_communicator
 from unittest.mock import *
@@ -376,3 +377,33 @@ def test_export_all_comps():
         with open("tba_data_2024_comps.csv", "r") as test_output:
             assert test_output.read() == expected_csv
     tba_communicator.tba_request = real_tba_request
+
+
+def test_pull_all_comp_data():
+    def mock_pull_comp_data(event_key, only_match_team_data=False):
+        # the first event finishes last, but is still yielded first
+        if event_key == "2023cada":
+            time.sleep(0.1)
+        return {"matches": [{"key": f"{event_key}qm1"}]}
+
+    with patch("tba_comp_export_csv.pull_comp_data", side_effect=mock_pull_comp_data) as pull_mock:
+        assert list(
+            tba_comp_export_csv.pull_all_comp_data(["2023cada", "2023caph", "2023casj"])
+        ) == [
+            ("2023cada", {"matches": [{"key": "2023cadaqm1"}]}),
+            ("2023caph", {"matches": [{"key": "2023caphqm1"}]}),
+            ("2023casj", {"matches": [{"key": "2023casjqm1"}]}),
+        ]
+    assert pull_mock.call_count == 3
+
+
+def test_pull_all_comp_data_close():
+    event_keys = [f"2023ca{i}" for i in range(20)]
+    with patch("tba_comp_export_csv.EXPORT_THREADS", 2), patch(
+        "tba_comp_export_csv.pull_comp_data", return_value={"matches": []}
+    ) as pull_mock:
+        pulls = tba_comp_export_csv.pull_all_comp_data(event_keys)
+        assert next(pulls)[0] == "2023ca0"
+        pulls.close()
+    # only the events being pulled when writing stopped are pulled
+    assert pull_mock.call_count <= 3